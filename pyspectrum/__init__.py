@@ -1,4 +1,12 @@
 from .errors import *
 from .data import Data, Spectrum
 from .spectrometer import Spectrometer, FactoryConfig
+from .dark_library import DarkLibrary
 from .device_factory import UsbID, EthernetID
+from .stream import FrameStream
+from .ring import FrameRing
+from .async_spectrometer import AsyncSpectrometer
+from .storage import Capture
+from .recorder import Recorder
+from .lazy import LazyData
+from .group import SpectrometerGroup, GroupReading
@@ -0,0 +1,173 @@
+"""Экспорт и импорт `Data` и `Spectrum` в хранилища со сжатием: HDF5 (h5py) и Zarr.
+
+Данные хранятся блоками из нескольких кадров и нескольких соседних отсчётов. Импорт не читает
+данные в память: `intensity` и `clipped` загруженного объекта - массивы хранилища, и срез
+(`data[100:200, 500:600]`) читает с диска только затронутые блоки.
+
+Для работы нужны дополнительные зависимости: `pip install vmk-spectrum[hdf5]` или `vmk-spectrum[zarr]`.
+"""
+import json
+from dataclasses import asdict, replace
+from typing import Optional
+
+import numpy as np
+
+from .data import Data
+from .storage import CaptureHeader
+
+ATTRIBUTE = 'pyspectrum'
+CHUNK_FRAMES = 256
+CHUNK_PIXELS = 512
+
+
+def _import(module: str, extra: str):
+    try:
+        return __import__(module)
+    except ImportError as e:
+        raise ImportError(f'{module} is required for this format, install it with `pip install vmk-spectrum[{extra}]`') from e
+
+
+def _chunks(data: Data, chunk_frames: int, chunk_pixels: int) -> tuple[int, int]:
+    return max(min(chunk_frames, data.n_times), 1), max(min(chunk_pixels, data.n_numbers), 1)
+
+
+def _attributes(data: Data, factory_config) -> str:
+    # wavelength is stored as a separate array, attributes have a limited size
+    return json.dumps(asdict(replace(CaptureHeader.for_data(data, factory_config), wavelength=None)))
+
+
+def _copy_frames(data: Data, intensity, clipped, chunk_frames: int) -> None:
+    for start in range(0, data.n_times, chunk_frames):
+        end = min(start + chunk_frames, data.n_times)
+        intensity[start:end] = np.asarray(data.intensity[start:end])
+        clipped[start:end] = np.asarray(data.clipped[start:end], dtype=bool)
+
+
+def _make_data(header: CaptureHeader, intensity, clipped, wavelength) -> Data:
+    data = Data(intensity, clipped, header.exposure, intensity_scale=header.intensity_scale)
+    if header.kind == 'Spectrum':
+        return data.to_spectrum(None if wavelength is None else np.asarray(wavelength[:]))
+    return data
+
+
+def save_hdf5(data: Data, path: str, group: str = '/', factory_config=None,
+              chunk_frames: int = CHUNK_FRAMES, chunk_pixels: int = CHUNK_PIXELS,
+              compression: Optional[str] = 'gzip', compression_opts=4) -> None:
+    """
+    Сохранить данные в файл HDF5
+    Args:
+        data: Сохраняемые данные
+        path: Путь к файлу. Если файл существует, данные добавляются в него
+        group: Группа внутри файла
+        factory_config: Заводские настройки устройства (`FactoryConfig`), сохраняются в атрибутах
+        chunk_frames: Количество кадров в блоке
+        chunk_pixels: Количество отсчётов в блоке
+        compression: Алгоритм сжатия h5py (`gzip`, `lzf` или `None`)
+        compression_opts: Параметры сжатия
+    """
+    h5py = _import('h5py', 'hdf5')
+    chunks = _chunks(data, chunk_frames, chunk_pixels)
+    options = dict(chunks=chunks, compression=compression, shuffle=compression is not None)
+    if compression == 'gzip':
+        options['compression_opts'] = compression_opts
+
+    with h5py.File(path, 'a') as f:
+        g = f.require_group(group)
+        for name in ('intensity', 'clipped', 'wavelength'):
+            if name in g:
+                del g[name]
+        intensity = g.create_dataset('intensity', shape=data.shape, dtype=data.intensity.dtype, **options)
+        clipped = g.create_dataset('clipped', shape=data.shape, dtype=bool, **options)
+        _copy_frames(data, intensity, clipped, chunks[0])
+        if getattr(data, 'wavelength', None) is not None:
+            g.create_dataset('wavelength', data=np.asarray(data.wavelength))
+        g.attrs[ATTRIBUTE] = _attributes(data, factory_config)
+
+
+class Hdf5Archive:
+    """Файл HDF5 с данными, сохранёнными `save_hdf5`, открытый для чтения.
+    Массивы `data` - наборы данных h5py, они доступны до закрытия файла (`close` или выход из `with`)"""
+
+    def __init__(self, path: str, group: str = '/'):
+        """
+        Params:
+            path: Путь к файлу
+            group: Группа внутри файла
+        """
+        h5py = _import('h5py', 'hdf5')
+        self.__file = h5py.File(path, 'r')
+        try:
+            g = self.__file[group]
+            header = CaptureHeader(**json.loads(g.attrs[ATTRIBUTE]))
+            self.__data = _make_data(header, g['intensity'], g['clipped'], g.get('wavelength'))
+        except BaseException:
+            self.__file.close()
+            raise
+
+    @property
+    def data(self) -> Data:
+        """`Data` или `Spectrum`, массивы которого - наборы данных h5py"""
+        return self.__data
+
+    def close(self) -> None:
+        """Закрыть файл"""
+        self.__file.close()
+
+    def __enter__(self) -> 'Hdf5Archive':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_hdf5(path: str, group: str = '/') -> Hdf5Archive:
+    """
+    Открыть данные, сохранённые `save_hdf5`. Файл остаётся открытым, пока не будет закрыт архив
+    Args:
+        path: Путь к файлу
+        group: Группа внутри файла
+    Returns:
+        Открытый архив, данные доступны в `Hdf5Archive.data`
+    """
+    return Hdf5Archive(path, group)
+
+
+def save_zarr(data: Data, path: str, factory_config=None,
+              chunk_frames: int = CHUNK_FRAMES, chunk_pixels: int = CHUNK_PIXELS) -> None:
+    """
+    Сохранить данные в хранилище Zarr. Используется сжатие Zarr по умолчанию
+    Args:
+        data: Сохраняемые данные
+        path: Путь к хранилищу. Существующее хранилище будет перезаписано
+        factory_config: Заводские настройки устройства (`FactoryConfig`), сохраняются в атрибутах
+        chunk_frames: Количество кадров в блоке
+        chunk_pixels: Количество отсчётов в блоке
+    """
+    zarr = _import('zarr', 'zarr')
+    chunks = _chunks(data, chunk_frames, chunk_pixels)
+
+    g = zarr.open_group(path, mode='w')
+    # zarr 3 renamed create_dataset
+    create = getattr(g, 'create_array', None) or g.create_dataset
+    intensity = create('intensity', shape=data.shape, chunks=chunks, dtype=data.intensity.dtype)
+    clipped = create('clipped', shape=data.shape, chunks=chunks, dtype=bool)
+    _copy_frames(data, intensity, clipped, chunks[0])
+    if getattr(data, 'wavelength', None) is not None:
+        wavelength = np.asarray(data.wavelength)
+        create('wavelength', shape=wavelength.shape, dtype=wavelength.dtype)[:] = wavelength
+    g.attrs[ATTRIBUTE] = _attributes(data, factory_config)
+
+
+def load_zarr(path: str) -> Data:
+    """
+    Открыть данные, сохранённые `save_zarr`
+    Args:
+        path: Путь к хранилищу
+    Returns:
+        `Data` или `Spectrum`, массивы которого - массивы Zarr
+    """
+    zarr = _import('zarr', 'zarr')
+    g = zarr.open_group(path, mode='r')
+    header = CaptureHeader(**json.loads(g.attrs[ATTRIBUTE]))
+    wavelength = g['wavelength'] if 'wavelength' in g else None
+    return _make_data(header, g['intensity'], g['clipped'], wavelength)
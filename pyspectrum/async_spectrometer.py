@@ -0,0 +1,240 @@
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Optional
+
+from .data import Data, Spectrum
+from .device_factory import DeviceID, EthernetID, release_device
+from .errors import DeviceClosedError, DeviceError
+from .ethernet_device import AsyncEthernetDevice, EthernetFrame
+from .exposure import AutoExposureResult
+from .spectrometer import Spectrometer, FactoryConfig, Config
+
+
+# `Spectrometer.set_config` parameters that are read from disk, applied in order after the other settings
+_PATH_SETTINGS = ('dark_library_path', 'dark_signal_path', 'wavelength_calibration_path')
+
+
+class _StagedDevice:
+    # Device seen by the synchronous spectrometer when frames are received by `AsyncEthernetDevice`.
+    # The frame is received on the event loop and staged here right before the spectrometer reads it,
+    # so the spectrometer only processes data and never blocks. The timer is set by the async side.
+
+    def __init__(self, device: AsyncEthernetDevice):
+        self.device = device
+        self.frame: EthernetFrame | None = None
+
+    @property
+    def isOpened(self) -> bool:
+        return self.device.isOpened
+
+    def setTimer(self, millis):
+        pass
+
+    def close(self):
+        pass
+
+    def getMinExposure(self) -> float:
+        return self.device.getMinExposure()
+
+    def getPixelCount(self) -> int:
+        return self.device.getPixelCount()
+
+    def readFrame(self, n_times) -> EthernetFrame:
+        frame, self.frame = self.frame, None
+        if frame is None or len(frame.samples) != n_times:
+            raise DeviceError('Frame was not received before reading')
+        return frame
+
+
+class _StagedID(DeviceID):
+    # hashed by identity, so the entry it leaves in the device cache has to be released on close
+
+    def __init__(self, device: _StagedDevice):
+        self.device = device
+
+    def _create(self):
+        return self.device
+
+
+class AsyncSpectrometer:
+    """Обёртка над `Spectrometer` для использования в asyncio.
+
+    Команды ethernet спектрометру и приём кадров выполняются в цикле событий (см. `AsyncEthernetDevice`),
+    без отдельных потоков. Обращения к usb спектрометру выполняются по очереди в отдельном рабочем потоке,
+    принадлежащем этому спектрометру; нативное чтение с USB не удерживает GIL. Поэтому один цикл событий
+    может обслуживать много устройств одновременно.
+    """
+
+    def __init__(self, spectrometer: Spectrometer, _staged: Optional[_StagedID] = None):
+        """
+        Params:
+            spectrometer: Открытый спектрометр. Для открытия устройства без блокировки цикла событий используйте `open`
+        """
+        self.__spectrometer = spectrometer
+        self.__staged_id = _staged
+        self.__staged = None if _staged is None else _staged.device
+        self.__device = None if _staged is None else self.__staged.device
+        self.__executor: ThreadPoolExecutor | None = None
+        if _staged is None:
+            self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncSpectrometer')
+
+    @classmethod
+    async def open(cls, device_id: DeviceID, factory_config: FactoryConfig = FactoryConfig.default(),
+                   reopen: bool = True) -> 'AsyncSpectrometer':
+        """
+        Открыть устройство, не блокируя цикл событий
+        Params:
+            device_id: Идентификатор устройства
+            factory_config: Заводские настройки
+            reopen: См. `Spectrometer`. Ethernet устройство всегда открывается заново
+        Returns:
+            Асинхронный спектрометр
+        """
+        if not isinstance(device_id, EthernetID):
+            spectrometer = await asyncio.to_thread(Spectrometer, device_id, factory_config, reopen)
+            return cls(spectrometer)
+
+        device = await AsyncEthernetDevice.open(device_id.ip, device_id.timeout, device_id.retries)
+        staged = _StagedID(_StagedDevice(device))
+        try:
+            spectrometer = Spectrometer(staged, factory_config, reopen=False)
+            await device.setTimer(spectrometer.config.exposure)
+        except BaseException:
+            release_device(staged)
+            await device.close()
+            raise
+        return cls(spectrometer, staged)
+
+    async def __run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, partial(func, *args, **kwargs))
+
+    async def __read_staged(self, n_times: Optional[int], func):
+        # the frame is received on the event loop, then processed by the synchronous spectrometer
+        if not self.__device.isOpened:
+            raise DeviceClosedError()
+        frame = await self.__device.readFrame(self.config.n_times if n_times is None else n_times)
+        self.__staged.frame = frame
+        try:
+            return func()
+        finally:
+            self.__staged.frame = None
+
+    @property
+    def spectrometer(self) -> Spectrometer:
+        """Обёрнутый синхронный спектрометр"""
+        return self.__spectrometer
+
+    @property
+    def config(self) -> Config:
+        return self.__spectrometer.config
+
+    @property
+    def is_configured(self) -> bool:
+        """Возвращает `True`, если спектрометр настроен для чтения обработанных данных"""
+        return self.__spectrometer.is_configured
+
+    @property
+    def dark_signal(self) -> Data | None:
+        """Текущий темновой сигнал"""
+        return self.__spectrometer.dark_signal
+
+    async def close(self) -> None:
+        """Закрыть устройство"""
+        if self.__device is not None:
+            release_device(self.__staged_id)
+            await self.__device.close()
+            return
+        await self.__run(self.__spectrometer.close)
+        self.__executor.shutdown(wait=False)
+
+    async def read_raw(self, n_times: Optional[int] = None) -> Data:
+        """Получить сырые данные с устройства (см. `Spectrometer.read_raw`)"""
+        if self.__device is not None:
+            return await self.__read_staged(n_times, partial(self.__spectrometer.read_raw, n_times))
+        return await self.__run(self.__spectrometer.read_raw, n_times)
+
+    async def read(self, force: bool = False, n_times: Optional[int] = None) -> Spectrum:
+        """Получить обработанный спектр с устройства (см. `Spectrometer.read`)"""
+        if self.__device is not None:
+            return await self.__read_staged(n_times, partial(self.__spectrometer.read, force=force, n_times=n_times))
+        return await self.__run(self.__spectrometer.read, force=force, n_times=n_times)
+
+    async def read_dark_signal(self, n_times: Optional[int] = None) -> None:
+        """Считать темновой сигнал (см. `Spectrometer.read_dark_signal`)"""
+        if self.__device is not None:
+            await self.__read_staged(n_times, partial(self.__spectrometer.read_dark_signal, n_times))
+            return
+        await self.__run(self.__spectrometer.read_dark_signal, n_times)
+
+    async def auto_exposure(self, **kwargs) -> AutoExposureResult:
+        """Подобрать экспозицию. Параметры совпадают с `Spectrometer.auto_exposure`"""
+        if self.__device is None:
+            return await self.__run(self.__spectrometer.auto_exposure, **kwargs)
+
+        # same steps as the synchronous version, reads and timer changes are awaited on the event loop
+        n_times = kwargs.get('n_times', 1)
+        steps = self.__spectrometer.auto_exposure_steps(**kwargs)
+        try:
+            exposure = next(steps)
+            while True:
+                if exposure is None:
+                    exposure = steps.send(await self.read_raw(n_times))
+                else:
+                    await self.set_config(exposure=exposure)
+                    exposure = steps.send(None)
+        except StopIteration as stop:
+            return stop.value
+
+    async def set_config(self, **kwargs) -> None:
+        """Установить настройки спектрометра. Параметры совпадают с `Spectrometer.set_config`"""
+        if self.__device is None:
+            await self.__run(self.__spectrometer.set_config, **kwargs)
+            return
+
+        exposure = kwargs.get('exposure')
+        if exposure is not None and exposure != self.config.exposure:
+            await self.__device.setTimer(exposure)
+
+        # files are loaded in a thread, everything else is applied on the event loop
+        paths = {name: kwargs.pop(name) for name in _PATH_SETTINGS if kwargs.get(name) is not None}
+        self.__spectrometer.set_config(**kwargs)
+        if paths:
+            await asyncio.to_thread(self.__spectrometer.set_config, **paths)
+
+    async def stream(self, n_times: Optional[int] = None, processed: bool = False) -> AsyncIterator[Data]:
+        """
+        Непрерывно читать данные с устройства. Следующее чтение запускается до того, как
+        текущая пачка кадров передана пользователю, поэтому устройство не простаивает.
+        При закрытии итератора уже запущенное чтение дожидается завершения, а его данные отбрасываются.
+        Чтобы итератор закрывался сразу при выходе из цикла, используйте `contextlib.aclosing`
+        Args:
+            n_times: Количество кадров, считываемых одной командой. По умолчанию используется `config.n_times`
+            processed: Если `True`, возвращаются обработанные спектры, иначе - сырые данные
+        Returns:
+            Асинхронный итератор по пачкам кадров
+        """
+        if processed:
+            read = partial(self.read, n_times=n_times)
+        else:
+            read = partial(self.read_raw, n_times)
+
+        pending = asyncio.ensure_future(read())
+        try:
+            while True:
+                data = await pending
+                pending = asyncio.ensure_future(read())
+                yield data
+        finally:
+            # a started read can not be interrupted: cancelling the task would leave the
+            # device busy, so the next read would be mixed up with its frames
+            with contextlib.suppress(Exception):
+                await pending
+
+    async def __aenter__(self) -> 'AsyncSpectrometer':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
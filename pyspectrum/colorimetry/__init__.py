@@ -0,0 +1,2 @@
+from .colorimeter import Colorimeter, Colors, weighting_matrix
+from .led import LedAnalyzer, ColorRendering, FlickerResult, blackbody, cct, flicker
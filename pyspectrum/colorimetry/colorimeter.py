@@ -0,0 +1,169 @@
+import numpy as np
+from numpy.typing import NDArray
+
+from ..data import Spectrum
+from . import data
+
+
+def weighting_matrix(wavelength: NDArray[float], illuminant: str = 'E', observer: str = '2deg') -> NDArray[float]:
+    """
+    Матрица перехода от спектра к координатам XYZ.
+    Содержит функции сложения цветов наблюдателя, умноженные на спектр источника и шаг по длине волны,
+    и нормирована так, что `Y` идеального отражателя равен 1. Отсчёты вне диапазона таблиц имеют нулевой вес
+    Args:
+        wavelength: Длины волн отсчётов спектра
+        illuminant: Источник освещения (см. `data.ILLUMINANT_INTENSITY`)
+        observer: Стандартный наблюдатель (см. `data.OBSERVER_SENSITIVITY`)
+    Returns:
+        Матрица размера (количество отсчётов, 3)
+    """
+    illuminant_data = data.ILLUMINANT_INTENSITY[illuminant]
+    observer_data = data.OBSERVER_SENSITIVITY[observer]
+    wavelength = np.asarray(wavelength, dtype=float)
+
+    mask = (wavelength >= illuminant_data['wavelength'][0]) & (wavelength <= illuminant_data['wavelength'][-1])
+    dwl = np.abs(np.diff(wavelength, append=wavelength[-1:]))
+
+    illuminant_intensity = np.interp(wavelength, illuminant_data['wavelength'], illuminant_data['intensity'])
+    weights = np.stack([
+        np.interp(wavelength, observer_data['wavelength'], observer_data[c]) for c in 'XYZ'
+    ], axis=1)
+    weights *= (illuminant_intensity * dwl * mask)[:, None]
+    return weights / np.sum(weights[:, 1])
+
+
+def _f_lab(t: NDArray[float]) -> NDArray[float]:
+    return np.where(t > 0.008856, np.cbrt(t), (903.3 * t + 16) / 116)
+
+
+def _polar(a: NDArray[float], b: NDArray[float]) -> tuple[NDArray[float], NDArray[float]]:
+    return np.hypot(a, b), np.degrees(np.arctan2(b, a))
+
+
+class Colors:
+    """Цвета набора кадров. Все методы возвращают массивы размера (количество кадров, 3)"""
+
+    def __init__(self, XYZ: NDArray[float], illuminant: str, observer: str):
+        self.__XYZ = XYZ
+        self.illuminant = illuminant
+        self.observer = observer
+
+    @property
+    def n_times(self) -> int:
+        return self.__XYZ.shape[0]
+
+    def __getitem__(self, key) -> 'Colors':
+        return Colors(np.atleast_2d(self.__XYZ[key]), self.illuminant, self.observer)
+
+    def __white_point(self) -> NDArray[float]:
+        return data.ILLUMINANT_WHITE_POINT[self.illuminant][self.observer]
+
+    def XYZ(self) -> NDArray[float]:
+        return np.copy(self.__XYZ)
+
+    def xyY(self) -> NDArray[float]:
+        X, Y, Z = self.__XYZ.T
+        s = X + Y + Z
+        return np.stack([X / s, Y / s, Y], axis=1)
+
+    def Lab(self) -> NDArray[float]:
+        fx, fy, fz = _f_lab(self.__XYZ / self.__white_point()).T
+        return np.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)], axis=1)
+
+    def LCh_ab(self) -> NDArray[float]:
+        L, a, b = self.Lab().T
+        return np.stack([L, *_polar(a, b)], axis=1)
+
+    def Luv(self) -> NDArray[float]:
+        X, Y, Z = self.__XYZ.T
+        wx, wy, wz = self.__white_point()
+        L = np.where(Y > 0.008856, 116 * np.cbrt(Y) - 16, 903.3 * Y)
+        d = X + 15 * Y + 3 * Z
+        wd = wx + 15 * wy + 3 * wz
+        u = 13 * L * (4 * X / d - 4 * wx / wd)
+        v = 13 * L * (9 * Y / d - 9 * wy / wd)
+        return np.stack([L, u, v], axis=1)
+
+    def LCh_uv(self) -> NDArray[float]:
+        L, u, v = self.Luv().T
+        return np.stack([L, *_polar(u, v)], axis=1)
+
+    def RGB(self, rgb_space: str = 'sRGB', adaptation_method: str | None = 'Bradford') -> NDArray[float]:
+        """
+        Координаты в пространстве RGB с гамма-коррекцией, ограниченные диапазоном [0, 1]
+        Args:
+            rgb_space: Пространство RGB (см. `data.RGB_PRIMARIES`)
+            adaptation_method: Метод хроматической адаптации к белой точке пространства
+                (см. `data.CHROMATIC_ADAPTATION_MATRIX`) или `None`
+        """
+        m = _rgb_space_matrix(rgb_space, self.observer)
+        if adaptation_method is not None:
+            m = m @ _adaptation_matrix(self.illuminant, self.observer, rgb_space, adaptation_method)
+        v = self.__XYZ @ m.T
+        return data.RGB_GAMMA[rgb_space](np.clip(v, 0, 1))
+
+    def __repr__(self) -> str:
+        cls = self.__class__
+        return f'{cls.__name__}({self.n_times = }, {self.illuminant = }, {self.observer = })'
+
+
+def _rgb_space_matrix(rgb_space: str, observer: str) -> NDArray[float]:
+    [[xr, yr], [xg, yg], [xb, yb]] = data.RGB_PRIMARIES[rgb_space].tolist()
+    w = data.RGB_WHITE_POINT[rgb_space][observer]
+    m1 = np.array([[xr / yr, xg / yg, xb / yb], [1, 1, 1], [(1 - xr - yr) / yr, (1 - xg - yg) / yg, (1 - xb - yb) / yb]])
+    m = m1 @ np.diag(np.linalg.solve(m1, w))
+    return np.linalg.inv(m)
+
+
+def _adaptation_matrix(illuminant: str, observer: str, rgb_space: str, adaptation_method: str) -> NDArray[float]:
+    w_src = data.ILLUMINANT_WHITE_POINT[illuminant][observer]
+    w_dst = data.RGB_WHITE_POINT[rgb_space][observer]
+    m1 = data.CHROMATIC_ADAPTATION_MATRIX[adaptation_method]
+    s = m1 @ w_src
+    d = m1 @ w_dst
+    return np.linalg.inv(m1) @ np.diag(d / s) @ m1
+
+
+class Colorimeter:
+    """Вычисление цвета образца по спектрам.
+
+    Спектр образца делится на спектр эталона (белого образца) и умножается на матрицу весов (см. `weighting_matrix`).
+    Деление на эталон включено в матрицу, которая вычисляется один раз для калибровки по длинам волн,
+    поэтому цвета всех кадров спектра получаются одним умножением матриц.
+    """
+
+    def __init__(self, reference_spectrum: Spectrum, illuminant: str = 'E', observer: str = '2deg'):
+        """
+        Params:
+            reference_spectrum: Спектр эталона. Используется среднее по кадрам
+            illuminant: Источник освещения (см. `data.ILLUMINANT_INTENSITY`)
+            observer: Стандартный наблюдатель (см. `data.OBSERVER_SENSITIVITY`)
+        """
+        self.illuminant = illuminant
+        self.observer = observer
+        self.__reference = np.mean(reference_spectrum.scaled().intensity, axis=0)
+        self.__wavelength = np.asarray(reference_spectrum.wavelength)
+        self.__matrix = self.__make_matrix(self.__wavelength)
+
+    def __make_matrix(self, wavelength: NDArray[float]) -> NDArray[float]:
+        weights = weighting_matrix(wavelength, self.illuminant, self.observer)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = weights / self.__reference[:, None]
+        return np.where(np.isfinite(weights), weights, 0)
+
+    @property
+    def matrix(self) -> NDArray[float]:
+        """Матрица перехода от интенсивности спектра к координатам XYZ, размер (количество отсчётов, 3)"""
+        return self.__matrix
+
+    def measure(self, spectrum: Spectrum) -> Colors:
+        """
+        Вычислить цвета всех кадров спектра
+        Args:
+            spectrum: Спектр образца, измеренный с той же калибровкой по длинам волн, что и эталон
+        Returns:
+            Цвета кадров
+        """
+        if spectrum.wavelength is not self.__wavelength and not np.array_equal(spectrum.wavelength, self.__wavelength):
+            raise ValueError('Spectrum has different wavelengths than the reference spectrum')
+        return Colors(spectrum.scaled().intensity @ self.__matrix, self.illuminant, self.observer)
@@ -0,0 +1,128 @@
+import os
+from collections.abc import Mapping
+from functools import partial
+from typing import Any, Callable
+
+import numpy as np
+
+TABLES_DIR = os.path.join(os.path.dirname(__file__), 'tables')
+"""Каталог с таблицами CIE в формате `.npy`"""
+
+
+class LazyMapping(Mapping):
+    """Словарь, значения которого вычисляются при первом обращении и затем хранятся.
+    Ключи известны заранее, поэтому перебор ключей ничего не загружает"""
+
+    def __init__(self, loaders: dict[str, Callable[[], Any]]):
+        self.__loaders = loaders
+        self.__values = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__values:
+            self.__values[key] = self.__loaders[key]()
+        return self.__values[key]
+
+    def __iter__(self):
+        return iter(self.__loaders)
+
+    def __len__(self) -> int:
+        return len(self.__loaders)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({list(self.__loaders)})'
+
+
+def load_table(name: str) -> np.ndarray:
+    """Отобразить таблицу `name` из `TABLES_DIR` в память (только для чтения)"""
+    return np.load(os.path.join(TABLES_DIR, f'{name}.npy'), mmap_mode='r')
+
+
+def _equal_energy() -> np.ndarray:
+    table = np.empty(471, dtype=[('wavelength', 'f'), ('intensity', 'f')])
+    table['wavelength'] = np.arange(360, 831)
+    table['intensity'] = 100
+    return table
+
+
+def _luminous_efficiency(observer: str) -> np.ndarray:
+    observer_data = OBSERVER_SENSITIVITY[observer]
+    table = np.empty(len(observer_data), dtype=[('wavelength', 'f'), ('efficiency', 'f')])
+    table['wavelength'] = observer_data['wavelength']
+    table['efficiency'] = observer_data['Y']
+    return table
+
+
+OBSERVER_SENSITIVITY = LazyMapping({
+    '2deg': partial(load_table, 'observer_2deg'),
+    '10deg': partial(load_table, 'observer_10deg'),
+})
+
+ILLUMINANT_INTENSITY = LazyMapping({
+    'D65': partial(load_table, 'illuminant_D65'),
+    'E': _equal_energy,
+})
+
+# V(λ) is the y-bar function of the CIE 1931 observer
+LUMINOUS_EFFICIENCY = LazyMapping({
+    'photopic': partial(_luminous_efficiency, '2deg'),
+})
+
+def calculate_white_point(illuminant, observer):
+    illuminant_data = ILLUMINANT_INTENSITY[illuminant]
+    observer_data = OBSERVER_SENSITIVITY[observer]
+    X = np.sum(observer_data['X'] * illuminant_data['intensity'])
+    Y = np.sum(observer_data['Y'] * illuminant_data['intensity'])
+    Z = np.sum(observer_data['Z'] * illuminant_data['intensity'])
+    return np.array([X, Y, Z]) / Y
+
+ILLUMINANT_WHITE_POINT = LazyMapping({
+    illuminant: partial(LazyMapping, {
+        observer: partial(calculate_white_point, illuminant, observer) for observer in OBSERVER_SENSITIVITY
+    }) for illuminant in ILLUMINANT_INTENSITY
+})
+
+RGB_PRIMARIES = {
+    'Adobe RGB': np.array([
+        (0.64, 0.33),
+        (0.21, 0.71),
+        (0.15, 0.06),
+    ], dtype=[('x', 'f'), ('y', 'f')]),
+    'CIE RGB': np.array([
+        (0.735, 0.265),
+        (0.274, 0.717),
+        (0.167, 0.009),
+    ], dtype=[('x', 'f'), ('y', 'f')]),
+    'sRGB': np.array([
+        (0.64, 0.33),
+        (0.30, 0.60),
+        (0.15, 0.06),
+    ], dtype=[('x', 'f'), ('y', 'f')]),
+}
+
+RGB_WHITE_POINT = LazyMapping({
+    'Adobe RGB': partial(ILLUMINANT_WHITE_POINT.__getitem__, 'D65'),
+    'CIE RGB': partial(ILLUMINANT_WHITE_POINT.__getitem__, 'E'),
+    'sRGB': partial(ILLUMINANT_WHITE_POINT.__getitem__, 'D65'),
+})
+
+RGB_GAMMA = {
+    'Adobe RGB': lambda x: x ** (1/2.2),
+    'CIE RGB': lambda x: x ** (1/2.2),
+    'sRGB': lambda x: np.where(x <= 0.0031308, 12.92 * x, 1.055 * x ** (1/2.4) - 0.055),
+}
+
+CHROMATIC_ADAPTATION_MATRIX = {
+    'XYZ Scaling': np.eye(3),
+    'Bradford': np.array([[ 0.8951,  0.2664, -0.1614],
+                          [-0.7502,  1.7135,  0.0367],
+                          [ 0.0389, -0.0685,  1.0296]]),
+    'Von Kries': np.array([[ 0.40024, 0.70760, -0.08081],
+                           [-0.22630, 1.16532,  0.04570],
+                           [ 0.00000, 0.00000,  0.91822]]),
+}
+
+# reflectance of the 14 CIE 13.3 test colour samples, 5 nm step
+TEST_COLOR_SAMPLES = LazyMapping({
+    'wavelength': partial(np.arange, 360, 831, 5, dtype='f'),
+    'reflectance': partial(load_table, 'test_color_samples'),
+})
@@ -0,0 +1,277 @@
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.typing import NDArray
+
+from . import data
+
+KM = 683
+"""Максимальная световая эффективность излучения, лм/Вт"""
+LIGHT_VELOCITY = 299792458
+"""Скорость света, м/с"""
+PLANCK_C1 = 3.741771e-16
+"""Первая радиационная постоянная, Вт·м²"""
+PLANCK_C2 = 1.4388e-2
+"""Вторая радиационная постоянная, м·К"""
+
+
+def resample(wavelength: NDArray[float], intensity: NDArray[float], grid: NDArray[float]) -> NDArray[float]:
+    """
+    Линейно интерполировать спектры на новую сетку длин волн
+    Args:
+        wavelength: Длины волн исходных отсчётов
+        intensity: Спектры, массив размера (..., количество отсчётов)
+        grid: Новая сетка длин волн
+    Returns:
+        Спектры на новой сетке, массив размера (..., len(grid))
+    """
+    return Resampler(wavelength, grid)(intensity)
+
+
+class Resampler:
+    """Линейная интерполяция спектров на сетку длин волн.
+    Индексы и веса вычисляются один раз, после чего интерполяция всех кадров - две выборки по индексам"""
+
+    def __init__(self, wavelength: NDArray[float], grid: NDArray[float]):
+        wavelength = np.asarray(wavelength, dtype=float)
+        self.__order = np.argsort(wavelength)
+        wavelength = wavelength[self.__order]
+        grid = np.clip(np.asarray(grid, dtype=float), wavelength[0], wavelength[-1])
+
+        right = np.clip(np.searchsorted(wavelength, grid), 1, len(wavelength) - 1)
+        left = right - 1
+        self.__left = self.__order[left]
+        self.__right = self.__order[right]
+        self.__t = (grid - wavelength[left]) / (wavelength[right] - wavelength[left])
+
+    def __call__(self, intensity: NDArray[float]) -> NDArray[float]:
+        intensity = np.asarray(intensity)
+        return intensity[..., self.__left] * (1 - self.__t) + intensity[..., self.__right] * self.__t
+
+
+def blackbody(wavelength: NDArray[float], temperature: NDArray[float]) -> NDArray[float]:
+    """
+    Спектральная плотность излучения абсолютно чёрного тела (закон Планка)
+    Args:
+        wavelength: Длины волн, нм
+        temperature: Температуры, К. Для массива температур возвращается по спектру на каждую
+    Returns:
+        Массив размера (..., len(wavelength))
+    """
+    wl = np.asarray(wavelength, dtype=float) * 1e-9
+    temperature = np.asarray(temperature, dtype=float)[..., None]
+    return PLANCK_C1 / np.expm1(PLANCK_C2 / (wl * temperature)) / wl ** 5 * 1e-9
+
+
+def xy_to_uv(xy: NDArray[float]) -> NDArray[float]:
+    """Перевести координаты цветности `xy` в координаты `uv` CIE 1960"""
+    x, y = xy[..., 0], xy[..., 1]
+    d = 12 * y - 2 * x + 3
+    return np.stack([4 * x / d, 6 * y / d], axis=-1)
+
+
+def cct(xy: NDArray[float], method: str = 'mccamy') -> NDArray[float]:
+    """
+    Коррелированная цветовая температура по координатам цветности
+    Args:
+        xy: Координаты цветности, массив размера (..., 2)
+        method: `'mccamy'` - кубическая формула Маккэми (точнее всего в диапазоне 2000-12500 К),
+            `'hernandez'` - экспоненциальная формула Эрнандес-Андреса (3000-50000 К)
+    Returns:
+        Температура, К
+    """
+    x, y = xy[..., 0], xy[..., 1]
+    if method == 'mccamy':
+        n = (x - 0.3320) / (y - 0.1858)
+        return -449 * n ** 3 + 3525 * n ** 2 - 6823.3 * n + 5520.33
+    if method == 'hernandez':
+        n = (x - 0.3366) / (y - 0.1735)
+        return (-949.86315 + 6253.80338 * np.exp(-n / 0.92159) + 28.70599 * np.exp(-n / 0.20039)
+                + 0.00004 * np.exp(-n / 0.07125))
+    raise ValueError(f'Unknown CCT method: {method}')
+
+
+@dataclass()
+class ColorRendering:
+    """Индексы цветопередачи для каждого кадра"""
+    special: NDArray[float]
+    """Частные индексы для 14 контрольных образцов, массив размера (количество кадров, 14)"""
+    general: NDArray[float]
+    """Общий индекс Ra: среднее частных индексов для образцов 1-8 (CIE 13.3)"""
+    mean_special: NDArray[float]
+    """Среднее частных индексов для всех 14 образцов. Не является индексом Ra"""
+    reference_temperature: NDArray[float]
+    """Температура эталонного излучателя, К"""
+    is_valid: NDArray[bool]
+    """`True`, если цветность источника достаточно близка к линии Планка (DC < 0.0054)"""
+
+
+@dataclass()
+class FlickerResult:
+    """Пульсации светового потока"""
+    power: NDArray[float]
+    """Световой поток для каждого кадра"""
+    percent_flicker: float
+    """Коэффициент пульсаций `(max - min) / (max + min)`, %"""
+    flicker_index: float
+    """Индекс мерцания: доля светового потока выше среднего значения"""
+    dominant_frequency: float
+    """Частота наибольшей гармоники пульсаций, Гц"""
+
+
+def flicker(power: NDArray[float], frame_period: float) -> FlickerResult:
+    """
+    Вычислить параметры пульсаций по световому потоку последовательных кадров
+    Args:
+        power: Световой поток для каждого кадра
+        frame_period: Интервал между кадрами, с. Если кадры читаются подряд, равен экспозиции
+    Returns:
+        Параметры пульсаций
+    """
+    power = np.asarray(power, dtype=float)
+    if power.ndim != 1 or len(power) < 2:
+        raise ValueError('At least two frames are required')
+    high, low, mean = power.max(), power.min(), power.mean()
+
+    deviation = power - mean
+    # frames are equally spaced, so the integrals reduce to sums
+    flicker_index = np.sum(deviation, where=deviation > 0) / np.sum(power)
+
+    spectrum = np.abs(np.fft.rfft(deviation))
+    frequencies = np.fft.rfftfreq(len(power), frame_period)
+    dominant = frequencies[1 + np.argmax(spectrum[1:])]
+
+    return FlickerResult(
+        power=power,
+        percent_flicker=float(100 * (high - low) / (high + low)),
+        flicker_index=float(flicker_index),
+        dominant_frequency=float(dominant),
+    )
+
+
+class LedAnalyzer:
+    """Параметры света светодиодов: цветность, цветовая температура, световой поток и индекс цветопередачи.
+
+    Спектры интерполируются на сетку с шагом 1 нм, все таблицы CIE переводятся на эту сетку один раз
+    при создании объекта. Все методы принимают интенсивность в виде массива (количество кадров, количество
+    отсчётов) или одного кадра и обрабатывают все кадры одновременно.
+    """
+
+    def __init__(self, wavelength: NDArray[float], min_wavelength: int = 400, max_wavelength: int = 781,
+                 luminance_scale: float = 100):
+        """
+        Params:
+            wavelength: Длины волн отсчётов спектра, нм
+            min_wavelength: Начало рабочего диапазона, нм
+            max_wavelength: Конец рабочего диапазона (не включается), нм
+            luminance_scale: Яркость белого при расчёте индекса цветопередачи (100 по CIE 13.3)
+        """
+        self.grid = np.arange(min_wavelength, max_wavelength)
+        self.luminance_scale = luminance_scale
+        self.__resampler = Resampler(wavelength, self.grid)
+
+        observer = data.OBSERVER_SENSITIVITY['2deg']
+        self.__cmf = np.stack([np.interp(self.grid, observer['wavelength'], observer[c]) for c in 'XYZ'], axis=1)
+
+        # test colour samples are defined with a 5 nm step
+        self.__coarse = slice(0, None, 5)
+        tcs = data.TEST_COLOR_SAMPLES
+        reflectance = np.array([np.interp(self.grid[self.__coarse], tcs['wavelength'], r) for r in tcs['reflectance']])
+        # (sample, wavelength, XYZ) weights of every test colour sample
+        self.__tcs_weights = reflectance[:, :, None] * self.__cmf[self.__coarse][None, :, :] * 5
+
+    def resample(self, intensity: NDArray[float]) -> NDArray[float]:
+        """Спектры на сетке `grid`"""
+        return np.atleast_2d(self.__resampler(intensity))
+
+    def XYZ(self, intensity: NDArray[float]) -> NDArray[float]:
+        """Координаты XYZ, нормированные на равноэнергетический источник с той же суммарной мощностью"""
+        return self.__XYZ(self.resample(intensity))
+
+    def __XYZ(self, resampled: NDArray[float]) -> NDArray[float]:
+        return resampled @ self.__cmf / np.sum(100 * self.__cmf[:, 1]) * 100
+
+    def xyY(self, intensity: NDArray[float]) -> NDArray[float]:
+        """Координаты цветности `x`, `y` и яркость `Y`"""
+        return self.__xyY(self.__XYZ(self.resample(intensity)))
+
+    @staticmethod
+    def __xyY(XYZ: NDArray[float]) -> NDArray[float]:
+        s = np.sum(XYZ, axis=-1)
+        return np.stack([XYZ[..., 0] / s, XYZ[..., 1] / s, XYZ[..., 1]], axis=-1)
+
+    def cct(self, intensity: NDArray[float], method: str = 'mccamy') -> NDArray[float]:
+        """Коррелированная цветовая температура, К (см. `cct`)"""
+        return cct(self.xyY(intensity), method)
+
+    def luminous_power(self, intensity: NDArray[float]) -> NDArray[float]:
+        """Световой поток для каждого кадра, взвешенный функцией относительной световой эффективности V(λ)"""
+        return self.resample(intensity) @ self.__cmf[:, 1] * (KM / LIGHT_VELOCITY)
+
+    def flicker(self, intensity: NDArray[float], frame_period: float) -> FlickerResult:
+        """
+        Параметры пульсаций по последовательным кадрам (см. `flicker`)
+        Args:
+            intensity: Кадры, массив размера (количество кадров, количество отсчётов)
+            frame_period: Интервал между кадрами, с
+        """
+        return flicker(self.luminous_power(intensity), frame_period)
+
+    def color_rendering(self, intensity: NDArray[float]) -> ColorRendering:
+        """
+        Индекс цветопередачи по CIE 13.3. Эталонный излучатель - абсолютно чёрное тело
+        с цветовой температурой источника
+        """
+        source = self.resample(intensity)
+        source_xyY = self.__xyY(self.__XYZ(source))
+        temperature = cct(source_xyY)
+        reference = blackbody(self.grid, temperature)
+        reference_xyY = self.__xyY(self.__XYZ(reference))
+
+        uv_source = xy_to_uv(source_xyY)
+        uv_ref = xy_to_uv(reference_xyY)
+        is_valid = np.hypot(*(uv_source - uv_ref).T) < 0.0054
+
+        def cd(uv):
+            u, v = uv[..., 0], uv[..., 1]
+            return (4 - u - 10 * v) / v, (1.708 * v - 1.481 * u + 0.404) / v
+
+        c_source, d_source = cd(uv_source)
+        c_ref, d_ref = cd(uv_ref)
+
+        source_colors = self.__tcs_xyY(source)
+        ref_colors = self.__tcs_xyY(reference)
+        uv_source_colors = xy_to_uv(source_colors)
+        uv_ref_colors = xy_to_uv(ref_colors)
+
+        # von Kries adaptation of the test colours from the source to the reference illuminant
+        c_colors, d_colors = cd(uv_source_colors)
+        cs = (c_ref / c_source)[:, None] * c_colors
+        ds = (d_ref / d_source)[:, None] * d_colors
+        denominator = 16.518 + 1.481 * cs - ds
+        u_adapted = (10.872 + 0.404 * cs - 4 * ds) / denominator
+        v_adapted = 5.52 / denominator
+
+        u0, v0 = uv_ref[:, 0:1], uv_ref[:, 1:2]
+        w_source = 25 * np.cbrt(source_colors[..., 2]) - 17
+        w_ref = 25 * np.cbrt(ref_colors[..., 2]) - 17
+        delta_e = np.sqrt(
+            (w_ref - w_source) ** 2
+            + (13 * w_ref * (uv_ref_colors[..., 0] - u0) - 13 * w_source * (u_adapted - u0)) ** 2
+            + (13 * w_ref * (uv_ref_colors[..., 1] - v0) - 13 * w_source * (v_adapted - v0)) ** 2
+        )
+        special = 100 - 4.6 * delta_e
+        return ColorRendering(
+            special=special,
+            general=special[:, :8].mean(axis=1),
+            mean_special=special.mean(axis=1),
+            reference_temperature=temperature,
+            is_valid=is_valid,
+        )
+
+    def __tcs_xyY(self, resampled: NDArray[float]) -> NDArray[float]:
+        # xyY of every test colour sample under every frame, shape (frames, samples, 3)
+        coarse = resampled[:, self.__coarse]
+        XYZ = np.einsum('nm,imc->nic', coarse, self.__tcs_weights)
+        k = self.luminance_scale / (coarse @ self.__cmf[self.__coarse, 1] * 5)
+        return self.__xyY(XYZ * k[:, None, None])
@@ -0,0 +1,100 @@
+import numpy as np
+from numpy.typing import NDArray
+
+from .data import Data
+from .errors import LoadError
+
+
+class DarkLibrary:
+    """Набор темновых сигналов, снятых при разных экспозициях.
+
+    Для каждой экспозиции хранится средний по кадрам темновой сигнал в отсчётах АЦП.
+    Для экспозиции, которой нет в наборе, сигнал линейно интерполируется между соседними
+    экспозициями (темновой ток растёт линейно со временем накопления), а за пределами
+    диапазона используется ближайшая экспозиция.
+    """
+
+    def __init__(self, interpolate: bool = True):
+        """
+        Params:
+            interpolate: Если `False`, вместо интерполяции всегда используется ближайшая экспозиция
+        """
+        self.interpolate = interpolate
+        self.__references: dict[int, NDArray[float]] = {}
+
+    @property
+    def exposures(self) -> list[int]:
+        """Экспозиции, для которых есть темновой сигнал, по возрастанию"""
+        return sorted(self.__references)
+
+    def __len__(self) -> int:
+        return len(self.__references)
+
+    def __contains__(self, exposure: int) -> bool:
+        return exposure in self.__references
+
+    def add(self, data: Data, intensity_scale: float) -> None:
+        """
+        Добавить темновой сигнал. Сигнал с той же экспозицией заменяется
+        Args:
+            data: Темновой сигнал
+            intensity_scale: Множитель интенсивности устройства (см. `FactoryConfig.intensity_scale`)
+        """
+        counts = data.intensity if data.intensity_scale is not None else data.intensity / intensity_scale
+        self.add_reference(data.exposure, np.mean(counts, axis=0))
+
+    def add_reference(self, exposure: int, reference: NDArray[float]) -> None:
+        """Добавить средний темновой сигнал в отсчётах АЦП"""
+        reference = np.asarray(reference, dtype=float)
+        other = next(iter(self.__references.values()), None)
+        if other is not None and other.shape != reference.shape:
+            raise ValueError('Dark signal has different shape')
+        self.__references[exposure] = reference
+
+    def reference(self, exposure: int) -> NDArray[float]:
+        """
+        Средний темновой сигнал в отсчётах АЦП для экспозиции
+        Args:
+            exposure: Экспозиция в миллисекундах
+        Returns:
+            Сигнал для каждого отсчёта кадра
+        """
+        if not self.__references:
+            raise ValueError('Dark library is empty')
+        if exposure in self.__references:
+            return self.__references[exposure]
+
+        exposures = self.exposures
+        i = int(np.searchsorted(exposures, exposure))
+        if i == 0 or i == len(exposures) or not self.interpolate:
+            nearest = min(exposures, key=lambda e: abs(e - exposure))
+            return self.__references[nearest]
+
+        low, high = exposures[i - 1], exposures[i]
+        t = (exposure - low) / (high - low)
+        return self.__references[low] * (1 - t) + self.__references[high] * t
+
+    def save(self, path: str) -> None:
+        """Сохранить набор в файл"""
+        exposures = self.exposures
+        with open(path, 'wb') as f:
+            np.savez(f, exposures=np.array(exposures, dtype=int),
+                     references=np.array([self.__references[e] for e in exposures]))
+
+    @staticmethod
+    def load(path: str, interpolate: bool = True) -> 'DarkLibrary':
+        """Прочитать набор из файла"""
+        try:
+            with np.load(path) as f:
+                exposures, references = f['exposures'], f['references']
+        except (OSError, KeyError, ValueError):
+            raise LoadError(path)
+
+        library = DarkLibrary(interpolate)
+        for exposure, reference in zip(exposures, references):
+            library.add_reference(int(exposure), reference)
+        return library
+
+    def __repr__(self) -> str:
+        cls = self.__class__
+        return f'{cls.__name__}({self.exposures = })'
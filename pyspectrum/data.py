@@ -27,6 +27,9 @@ class Data:
     """Массив boolean значений. Если `clipped[i,j]==True`, `intensity[i,j]` содержит зашкаленное значение"""
     exposure: int
     """Экспозиция в миллисекундах"""
+    intensity_scale: float | None = field(default=None, kw_only=True)
+    """Если не `None`, `intensity` содержит необработанные отсчёты АЦП,
+    а интенсивность равна `intensity * intensity_scale` (см. `scaled`)"""
 
     @property
     def n_times(self) -> int:
@@ -43,17 +46,36 @@ class Data:
         """Размерность данынх"""
         return self.intensity.shape
 
-    def save(self, path: str):
-        """Сохранить объект в файл"""
-        with open(path, 'wb') as f:
-            pickle.dump(self, f)
+    def save(self, path: str, factory_config=None):
+        """
+        Сохранить объект в файл (см. `pyspectrum.storage`)
+        Args:
+            path: Путь к файлу
+            factory_config: Заводские настройки устройства (`FactoryConfig`), сохраняемые вместе с данными
+        """
+        from .storage import write_capture
+        write_capture(path, self, factory_config)
 
     @classmethod
-    def load(cls, path: str) -> 'Data':
-        """Прочитать объект из файла"""
-
-        with open(path, 'rb') as f:
-            result = pickle.load(f)
+    def load(cls, path: str, allow_pickle: bool = False) -> 'Data':
+        """
+        Прочитать объект из файла в память. Для доступа к большим файлам без чтения в память
+        используйте `pyspectrum.Capture`
+        Args:
+            path: Путь к файлу
+            allow_pickle: Разрешить чтение файлов старого формата (pickle).
+                Не используйте для файлов из недоверенных источников
+        """
+        from .storage import Capture, is_capture
+
+        if is_capture(path):
+            result = Capture(path).data
+        elif allow_pickle:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        else:
+            raise LoadError(f'{path} is not a capture file. If it is a file of the old format (pickle) '
+                            f'from a trusted source, load it with allow_pickle=True')
 
         if not isinstance(result, cls):
             raise LoadError(path)
@@ -64,22 +86,40 @@ class Data:
         if self.exposure != other.exposure:
             raise ValueError('Exposures are different')
 
+    def _scaled_intensity(self) -> NDArray[float]:
+        if self.intensity_scale is None:
+            return self.intensity
+        return self.intensity * self.intensity_scale
+
+    def scaled(self) -> 'Data':
+        """Вернуть объект, интенсивность которого переведена из отсчётов АЦП в вещественные значения.
+        Если интенсивность уже переведена, возвращается сам объект"""
+        if self.intensity_scale is None:
+            return self
+        return Data(self._scaled_intensity(), self.clipped, self.exposure)
+
+    def lazy(self) -> 'LazyData':
+        """Вернуть `LazyData` для отложенных вычислений над этими данными (см. `pyspectrum.lazy`)"""
+        from .lazy import LazyData
+        return LazyData.from_data(self)
+
     def to_spectrum(self, wavelength: NDArray[float]) -> 'Spectrum':
-        return Spectrum(self.intensity, self.clipped, self.exposure, wavelength, None)
+        return Spectrum(self.intensity, self.clipped, self.exposure, wavelength, None,
+                        intensity_scale=self.intensity_scale)
 
     def __add__(self, other):
         if isinstance(other, Data):
             # add Data or Spectrum
             self.check_exposure(other)
             return Data(
-                self.intensity + other.intensity,
+                self._scaled_intensity() + other._scaled_intensity(),
                 np.bitwise_or(self.clipped, other.clipped),
                 self.exposure
             )
         else:
             # add numpy array or scalar
             return Data(
-                self.intensity + other,
+                self._scaled_intensity() + other,
                 self.clipped,
                 self.exposure
             )
@@ -89,14 +129,14 @@ class Data:
             # sub Data or Spectrum
             self.check_exposure(other)
             return Data(
-                self.intensity - other.intensity,
+                self._scaled_intensity() - other._scaled_intensity(),
                 np.bitwise_or(self.clipped, other.clipped),
                 self.exposure
             )
         else:
             # sub numpy array or scalar
             return Data(
-                self.intensity - other,
+                self._scaled_intensity() - other,
                 self.clipped,
                 self.exposure
             )
@@ -106,7 +146,7 @@ class Data:
         if isinstance(other, Data):
             raise TypeError('Cannot multiply by Data')
         return Data(
-            self.intensity * other,
+            self._scaled_intensity() * other,
             self.clipped,
             self.exposure
         )
@@ -120,7 +160,8 @@ class Data:
         return Data(
             intensity=self.intensity.__getitem__(key),
             clipped=self.clipped.__getitem__(key),
-            exposure=self.exposure
+            exposure=self.exposure,
+            intensity_scale=self.intensity_scale,
         )
 
 
@@ -145,6 +186,11 @@ class Spectrum(Data):
     def __mul__(self, other):
         return super().__mul__(other).to_spectrum(self.wavelength)
 
+    def scaled(self) -> 'Spectrum':
+        if self.intensity_scale is None:
+            return self
+        return super().scaled().to_spectrum(self.wavelength)
+
     def __getitem__(self, key) -> 'Spectrum':
         _check_slice_key(key)
         if type(key) == tuple and len(key) >= 2:
@@ -155,6 +201,7 @@ class Spectrum(Data):
             wavelength=new_wl,
             exposure=self.exposure,
             intensity=self.intensity.__getitem__(key),
-            clipped=self.clipped.__getitem__(key)
+            clipped=self.clipped.__getitem__(key),
+            intensity_scale=self.intensity_scale,
         )
 
@@ -30,10 +30,17 @@ class UsbID(DeviceID):
 
 @dataclass(unsafe_hash=True)
 class EthernetID(DeviceID):
+    """Идентификатор ethernet спектрометра"""
+    """IP адрес устройства"""
     ip: str
 
+    """Время ожидания ответа на команду в секундах"""
+    timeout: float = field(default=1.0, compare=False)
+    """Количество повторных отправок команды, ответ на которую не был получен"""
+    retries: int = field(default=3, compare=False)
+
     def _create(self):
-        return EthernetDevice(self.ip)
+        return EthernetDevice(self.ip, self.timeout, self.retries)
 
 
 __device_cache: dict[DeviceID, Any] = dict()
@@ -45,3 +52,7 @@ def create_device(spec: DeviceID, reopen: bool):
     device = spec._create()
     __device_cache[spec] = device
     return device
+
+
+def release_device(spec: DeviceID):
+    __device_cache.pop(spec, None)
@@ -13,5 +13,13 @@ class ConfigurationError(Exception):
         super().__init__(what)
 
 
-class DeviceClosedError(Exception):
+class DeviceError(Exception):
+    pass
+
+
+class DeviceClosedError(DeviceError):
+    pass
+
+
+class DeviceTimeoutError(DeviceError):
     pass
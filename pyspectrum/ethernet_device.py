@@ -1,9 +1,12 @@
-from socket import socket, AF_INET, SOCK_DGRAM, SOCK_STREAM, MSG_WAITALL
+import asyncio
+from socket import socket, timeout as socket_timeout, AF_INET, SOCK_DGRAM, SOCK_STREAM, MSG_WAITALL
 import struct
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import numpy as np
 from numpy.typing import NDArray
 
+from .errors import DeviceTimeoutError, DeviceClosedError
+
 CMD_READ_INI            = 0x800B
 CMD_READ_ASSEMBLY_SWAP  = 0x8013
 CMD_READ_MULTILINE      = 0x0005
@@ -15,6 +18,18 @@ udp_port = 555
 tcp_port = 556
 udp_buff_size = 65536
 
+# response code, opcode, sequence number
+reply_header = struct.Struct('<H2xHH')
+
+measurement_header = np.array([0, 0, 0x8000, 0x8000, 0xabab, 0xabab], dtype=np.uint16)
+# same rule as in the usb driver: a saturated sample reads as UINT16_MAX
+clipped_value = np.iinfo(np.uint16).max
+
+
+def check_header(rows: NDArray):
+    if np.any(rows[:, :len(measurement_header)] != measurement_header):
+        raise Exception('Invalid measurement header')
+
 
 @dataclass
 class EthernetDeviceIni:
@@ -38,16 +53,123 @@ class EthernetFrame:
     clipped: NDArray
 
 
+@dataclass()
+class PendingCommand:
+    opcode: int
+    packet: bytes
+    n_packets: int
+    retransmit: bool
+    attempts: int = 1
+    payloads: list[bytes] = field(default_factory=list)
+    error: Exception | None = None
+    # set when the command is done, only used by `AsyncEthernetDevice`
+    waiter: asyncio.Future | None = None
+
+    @property
+    def is_done(self) -> bool:
+        return self.error is not None or len(self.payloads) == self.n_packets
+
+    def result(self) -> list[bytes]:
+        if self.error is not None:
+            raise self.error
+        return self.payloads
+
+    def retry(self):
+        """Prepare for a retransmit: the reply is assembled again from the packets of the new attempt"""
+        self.attempts += 1
+        self.payloads.clear()
+
+
+def make_packet(opcode, seq_num, data=b'', pad_to=16) -> bytes:
+    return struct.pack('<HH', opcode, seq_num) + data + bytes([0]*(pad_to-4-len(data)))
+
+
+def dispatch_reply(pending: dict[int, PendingCommand], response: bytes) -> PendingCommand | None:
+    """Store a reply packet in the pending command it belongs to. Returns that command,
+    or `None` for a duplicate reply to a command that is already collected"""
+    resp_code, resp_cmd, resp_seq_num = reply_header.unpack(response[:reply_header.size])
+    reply_to = pending.get(resp_seq_num)
+    if reply_to is None:
+        return None
+    if resp_code > 2:
+        reply_to.error = Exception(f'Unsuccessful response code: {resp_code}')
+    elif resp_cmd != reply_to.opcode:
+        reply_to.error = Exception('Response opcode does not match request')
+    elif len(reply_to.payloads) < reply_to.n_packets:
+        # packets of a reply arrive in order
+        reply_to.payloads.append(response[reply_header.size:])
+    return reply_to
+
+
+def timer_data(millis, min_exposure) -> bytes:
+    """Payload of CMD_SET_TIMER: 10 bit significand in tenths of a millisecond and decimal exponent"""
+    if millis < min_exposure:
+        raise Exception(f'Exposure too low, minimal is {min_exposure}')
+    millis *= 10
+    millis = int(millis)
+    exponent = 0
+    while millis >= (1 << 10):
+        exponent += 1
+        millis //= 10
+    if exponent >= 4:
+        raise Exception("Exposure too big")
+    return struct.pack('<H2xH', millis, exponent)
+
+
+def line_length_data(ini: EthernetDeviceIni) -> bytes:
+    return struct.pack('<IH', ini.num_pixels, ini.num_chips)
+
+
+def read_multiline_data(n_times) -> bytes:
+    return struct.pack('<H2xI', 0, n_times)
+
+
+def parse_ini(data: bytes) -> EthernetDeviceIni:
+    chips_num, chip_pixel_num, chip_type, adc_rate, config_bits, assembly_type, min_exposure_value, min_exposure_exponent, pixel_number, dia_present, termostat_en, temp0, v0 = struct.unpack('<B3xHHBBxBHHIBBff', data[:30])
+    return EthernetDeviceIni(
+        num_chips=chips_num,
+        num_pixels_per_chip=chip_pixel_num,
+        chip_type=chip_type,
+        adc_rate=adc_rate,
+        config_bits=config_bits,
+        assembly_type=assembly_type,
+        min_exposure=0.1*min_exposure_value*(10**min_exposure_exponent),
+        num_pixels=pixel_number,
+        mtr0=temp0,
+        mui0=v0,
+        dia_present=(dia_present == 0xAB),
+        thermostat_enabled=(termostat_en == 0xAB),
+    )
+
+
+def decode_frames(arr: NDArray) -> EthernetFrame:
+    """Check headers of received frames and split off the samples"""
+    check_header(arr)
+    samples = arr[:, len(measurement_header):]
+    return EthernetFrame(samples, samples == clipped_value)
+
+
 class EthernetDevice:
-    def __init__(self, addr: str):
+    def __init__(self, addr: str, timeout: float = 1.0, retries: int = 3):
+        """
+        Params:
+            addr: IP адрес устройства
+            timeout: Время ожидания ответа на команду в секундах
+            retries: Количество повторных отправок команды, ответ на которую не был получен
+        """
         self.dev_addr = addr
         self.seq_num = 1
+        self.retries = retries
+        self.pending: dict[int, PendingCommand] = {}
+        self.state: dict[int, bytes] = {}
 
         self.udp_sock = socket(AF_INET, SOCK_DGRAM)
+        self.udp_sock.settimeout(timeout)
         self.tcp_sock = socket(AF_INET, SOCK_STREAM)
         self.tcp_sock.connect((addr, tcp_port))
 
         self.ini = self.read_ini()
+        self.staging: NDArray | None = None
 
         self.opened = True
 
@@ -56,85 +178,270 @@ class EthernetDevice:
         return self.opened
 
     def setTimer(self, millis):
-        if millis < self.ini.min_exposure:
-            raise Exception(f'Exposure too low, minimal is {self.ini.min_exposure}')
-        millis *= 10
-        millis = int(millis)
-        exponent = 0
-        while millis >= (1 << 10):
-            exponent += 1
-            millis //= 10
-        if exponent >= 4:
-            raise Exception("Exposure too big")
-
-        self.send_command(
-            CMD_SET_TIMER,
-            data=struct.pack('<H2xH', millis, exponent)
-        )
+        self.set_state(CMD_SET_TIMER, timer_data(millis, self.ini.min_exposure))
 
     def close(self):
         self.tcp_sock.close()
         self.udp_sock.close()
 
+    def getMinExposure(self) -> float:
+        return self.ini.min_exposure
+
+    def getPixelCount(self) -> int:
+        return self.ini.num_pixels - len(measurement_header)
+
     def readFrame(self, n_times):
-        ini = self.ini
-        self.set_line_length(ini.num_pixels, ini.num_chips)
-        arr = np.empty((n_times, ini.num_pixels), dtype=np.uint16)
-        self.send_command(CMD_READ_MULTILINE, struct.pack('<H2xI', 0, n_times))
-        self.tcp_sock.recv_into(arr, n_times * ini.num_pixels * 2, MSG_WAITALL)
-        measurement_header = np.array([0, 0, 0x8000, 0x8000, 0xabab, 0xabab])
-        header_len = len(measurement_header)
-        for i in range(n_times):
-            if not np.array_equal(measurement_header, arr[i][:header_len]):
-                raise Exception('Invalid measurement header')
-
-        samples = arr[:, header_len:].astype('int32')
-        # TODO: clipped support
-        return EthernetFrame(samples, np.zeros(samples.shape))
+        arr = np.empty((n_times, self.ini.num_pixels), dtype=np.uint16)
+        self.receive_frames(arr)
+        return decode_frames(arr)
+
+    def readFrameInto(self, samples: NDArray, clipped: NDArray):
+        """Read `samples.shape[0]` frames into preallocated arrays of shape (n_times, pixel_count)"""
+        n_times = samples.shape[0]
+        if self.staging is None or self.staging.shape[0] < n_times:
+            self.staging = np.empty((n_times, self.ini.num_pixels), dtype=np.uint16)
+        arr = self.staging[:n_times]
+        self.receive_frames(arr)
+
+        np.copyto(samples, arr[:, len(measurement_header):])
+        np.equal(samples, clipped_value, out=clipped)
+
+    def iterFrames(self, n_times, chunk_frames=64):
+        """Read n_times frames, yielding them as soon as they arrive.
+
+        The TCP stream is received into a reused buffer of chunk_frames frames, so memory does not
+        grow with n_times. Every yielded EthernetFrame holds one or more complete frames and is
+        only valid until the next step of the iteration. If the iteration is stopped early, the
+        rest of the frames is received and discarded so the connection stays in sync.
+        """
+        row_bytes = self.ini.num_pixels * 2
+        buffer = np.empty((min(chunk_frames, n_times), self.ini.num_pixels), dtype=np.uint16)
+        view = memoryview(buffer).cast('B')
+        self.start_read(n_times)
+
+        remaining = n_times
+        received = decoded = 0
+        try:
+            while remaining > 0:
+                chunk = min(len(buffer), remaining)
+                received = 0
+                decoded = 0
+                while decoded < chunk:
+                    n = self.tcp_sock.recv_into(view[received:chunk * row_bytes])
+                    if n == 0:
+                        raise Exception('Connection closed by device')
+                    received += n
+                    complete = received // row_bytes
+                    if complete > decoded:
+                        rows = buffer[decoded:complete]
+                        frames = decode_frames(rows)
+                        decoded = complete
+                        remaining -= len(rows)
+                        yield frames
+        finally:
+            # bytes of a partially received frame are already in the buffer
+            self.discard(remaining * row_bytes - (received - decoded * row_bytes))
 
     # internal stuff
-    def send_command(self, opcode, data=b'', ext_packets=0, pad_to=16):
+    def send_command(self, opcode, data=b'', ext_packets=0, pad_to=16, retransmit=True):
+        return self.collect(self.submit(opcode, data, ext_packets, pad_to, retransmit))
+
+    def submit(self, opcode, data=b'', ext_packets=0, pad_to=16, retransmit=True) -> int:
+        """Send a command without waiting for the reply, returns its sequence number (see `collect`)"""
         seq_num = self.seq_num
-        self.seq_num += 1
+        self.seq_num = (self.seq_num + 1) & 0xFFFF
 
-        packet = struct.pack('<HH', opcode, seq_num) + data + bytes([0]*(pad_to-4-len(data)))
+        packet = make_packet(opcode, seq_num, data, pad_to)
+        self.pending[seq_num] = PendingCommand(opcode, packet, 1 + ext_packets, retransmit)
         self.udp_sock.sendto(packet, (self.dev_addr, udp_port))
+        return seq_num
 
-        response_payloads = []
+    def collect(self, seq_num) -> list[bytes]:
+        """Wait for all reply packets of a submitted command. Replies to other commands are kept until collected"""
+        command = self.pending[seq_num]
+        try:
+            while not command.is_done:
+                try:
+                    response = self.udp_sock.recvfrom(udp_buff_size)[0]
+                except socket_timeout:
+                    if not command.retransmit or command.attempts > self.retries:
+                        raise DeviceTimeoutError(f'No response to command 0x{command.opcode:04x}')
+                    command.retry()
+                    self.udp_sock.sendto(command.packet, (self.dev_addr, udp_port))
+                    continue
 
-        for _ in range(1 + ext_packets):
-            response = self.udp_sock.recvfrom(udp_buff_size)[0]
-            resp_code, resp_cmd, resp_seq_num = struct.unpack('<H2xHH', response[:8])
-            if resp_code > 2:
-                raise Exception(f'Unsuccessful response code: {resp_code}')
-            if resp_cmd != opcode:
-                raise Exception(f'Response opcode does not match request')
-            if resp_seq_num != seq_num:
-                raise Exception(f'Response sequence number does not match request')
-            response_payloads.append(response[8:])
+                dispatch_reply(self.pending, response)
+            return command.result()
+        except Exception:
+            # device state is unknown after a failed command
+            self.state.pop(command.opcode, None)
+            raise
+        finally:
+            del self.pending[seq_num]
 
-        return response_payloads
+    def set_state(self, opcode, data):
+        """Send a state-changing command unless the device is known to already be in that state"""
+        if self.state.get(opcode) == data:
+            return
+        self.send_command(opcode, data)
+        self.state[opcode] = data
 
     def read_ini(self) -> EthernetDeviceIni:
-        data = self.send_command(CMD_READ_INI, data=bytes([0]), ext_packets=1)[1]
-        chips_num, chip_pixel_num, chip_type, adc_rate, config_bits, assembly_type, min_exposure_value, min_exposure_exponent, pixel_number, dia_present, termostat_en, temp0, v0 = struct.unpack('<B3xHHBBxBHHIBBff', data[:30])
-        return EthernetDeviceIni(
-            num_chips=chips_num,
-            num_pixels_per_chip=chip_pixel_num,
-            chip_type=chip_type,
-            adc_rate=adc_rate,
-            config_bits=config_bits,
-            assembly_type=assembly_type,
-            min_exposure=0.1*min_exposure_value*(10**min_exposure_exponent),
-            num_pixels=pixel_number,
-            mtr0=temp0,
-            mui0=v0,
-            dia_present=(dia_present == 0xAB),
-            thermostat_enabled=(termostat_en == 0xAB),
-        )
-
-    def set_line_length(self, num_pixels, num_chips):
-        self.send_command(
-            CMD_SET_LINE_LENGTH,
-            struct.pack('<IH', num_pixels, num_chips)
-        )
+        return parse_ini(self.send_command(CMD_READ_INI, data=bytes([0]), ext_packets=1)[1])
+
+    def receive_frames(self, arr: NDArray):
+        n_times = arr.shape[0]
+        self.start_read(n_times)
+        self.tcp_sock.recv_into(arr, n_times * self.ini.num_pixels * 2, MSG_WAITALL)
+        check_header(arr)
+
+    def discard(self, n_bytes):
+        if n_bytes <= 0:
+            return
+        scratch = bytearray(min(n_bytes, 1 << 16))
+        while n_bytes > 0:
+            n = self.tcp_sock.recv_into(scratch, min(n_bytes, len(scratch)))
+            if n == 0:
+                return
+            n_bytes -= n
+
+    def start_read(self, n_times):
+        ini = self.ini
+
+        # line length is normally already set, then reading takes a single round trip.
+        # Otherwise it must be acknowledged before the read starts, or a failure would leave frames in the stream
+        self.set_state(CMD_SET_LINE_LENGTH, line_length_data(ini))
+        # repeating a read command would produce duplicate frames, so it is never retransmitted
+        self.send_command(CMD_READ_MULTILINE, read_multiline_data(n_times), retransmit=False)
+
+
+class CommandProtocol(asyncio.DatagramProtocol):
+    def __init__(self, device: 'AsyncEthernetDevice'):
+        self.device = device
+
+    def datagram_received(self, data, addr):
+        self.device.on_reply(data)
+
+
+class AsyncEthernetDevice:
+    """Ethernet device driven by the asyncio event loop.
+
+    Commands go through a datagram endpoint and frames are read from an asyncio stream, so one event loop
+    serves any number of devices without a thread per device. Replies are matched to commands by sequence
+    number exactly like in `EthernetDevice`. A frame read is shielded from cancellation: once started, it runs
+    to completion, so the TCP stream always stays in sync.
+    """
+
+    def __init__(self, addr: str, timeout: float = 1.0, retries: int = 3):
+        """Use `open` to create a connected device"""
+        self.dev_addr = addr
+        self.timeout = timeout
+        self.retries = retries
+        self.seq_num = 1
+        self.pending: dict[int, PendingCommand] = {}
+        self.state: dict[int, bytes] = {}
+        self.lock = asyncio.Lock()
+        self.transport: asyncio.DatagramTransport | None = None
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.ini: EthernetDeviceIni | None = None
+        self.opened = False
+
+    @classmethod
+    async def open(cls, addr: str, timeout: float = 1.0, retries: int = 3) -> 'AsyncEthernetDevice':
+        """
+        Params:
+            addr: IP адрес устройства
+            timeout: Время ожидания ответа на команду в секундах
+            retries: Количество повторных отправок команды, ответ на которую не был получен
+        """
+        device = cls(addr, timeout, retries)
+        loop = asyncio.get_running_loop()
+        device.transport, _ = await loop.create_datagram_endpoint(
+            lambda: CommandProtocol(device), remote_addr=(addr, udp_port))
+        try:
+            device.reader, device.writer = await asyncio.open_connection(addr, tcp_port)
+            device.opened = True
+            device.ini = parse_ini((await device.send_command(CMD_READ_INI, data=bytes([0]), ext_packets=1))[1])
+        except BaseException:
+            await device.close()
+            raise
+        return device
+
+    @property
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def getMinExposure(self) -> float:
+        return self.ini.min_exposure
+
+    def getPixelCount(self) -> int:
+        return self.ini.num_pixels - len(measurement_header)
+
+    async def close(self):
+        self.opened = False
+        if self.transport is not None:
+            self.transport.close()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+
+    async def setTimer(self, millis):
+        async with self.lock:
+            await self.set_state(CMD_SET_TIMER, timer_data(millis, self.ini.min_exposure))
+
+    async def readFrame(self, n_times) -> EthernetFrame:
+        return await asyncio.shield(self.receive_frames(n_times))
+
+    # internal stuff
+    def on_reply(self, response: bytes):
+        command = dispatch_reply(self.pending, response)
+        if command is not None and command.is_done and not command.waiter.done():
+            command.waiter.set_result(None)
+
+    async def send_command(self, opcode, data=b'', ext_packets=0, pad_to=16, retransmit=True) -> list[bytes]:
+        if not self.opened:
+            raise DeviceClosedError()
+        seq_num = self.seq_num
+        self.seq_num = (self.seq_num + 1) & 0xFFFF
+
+        packet = make_packet(opcode, seq_num, data, pad_to)
+        command = PendingCommand(opcode, packet, 1 + ext_packets, retransmit,
+                                 waiter=asyncio.get_running_loop().create_future())
+        self.pending[seq_num] = command
+        try:
+            while True:
+                self.transport.sendto(packet)
+                try:
+                    await asyncio.wait_for(asyncio.shield(command.waiter), self.timeout)
+                    break
+                except asyncio.TimeoutError:
+                    if not retransmit or command.attempts > self.retries:
+                        raise DeviceTimeoutError(f'No response to command 0x{opcode:04x}')
+                    command.retry()
+            return command.result()
+        except Exception:
+            # device state is unknown after a failed command
+            self.state.pop(opcode, None)
+            raise
+        finally:
+            del self.pending[seq_num]
+
+    async def set_state(self, opcode, data):
+        """Send a state-changing command unless the device is known to already be in that state"""
+        if self.state.get(opcode) == data:
+            return
+        await self.send_command(opcode, data)
+        self.state[opcode] = data
+
+    async def receive_frames(self, n_times) -> EthernetFrame:
+        async with self.lock:
+            await self.set_state(CMD_SET_LINE_LENGTH, line_length_data(self.ini))
+            # repeating a read command would produce duplicate frames, so it is never retransmitted
+            await self.send_command(CMD_READ_MULTILINE, read_multiline_data(n_times), retransmit=False)
+            data = await self.reader.readexactly(n_times * self.ini.num_pixels * 2)
+        arr = np.frombuffer(data, dtype=np.uint16).reshape(n_times, self.ini.num_pixels)
+        return decode_frames(arr)
@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+FULL_SCALE = np.iinfo(np.uint16).max
+"""Максимальный отсчёт АЦП"""
+MAX_EXPOSURE = 1023 * 10 ** 3 // 10
+"""Максимальная экспозиция, которую можно записать в таймер устройства, мс"""
+
+
+def quantize_exposure(millis: int) -> int:
+    """
+    Экспозиция, которую устройство установит на самом деле.
+    Таймер хранит время в десятых долях миллисекунды в виде 10-битной мантиссы и 2-битного
+    десятичного порядка, младшие разряды отбрасываются (см. `setTimer`)
+    Args:
+        millis: Экспозиция в миллисекундах
+    Returns:
+        Ближайшая снизу экспозиция, представимая таймером
+    """
+    value = int(millis) * 10
+    exponent = 0
+    while value >= (1 << 10):
+        exponent += 1
+        value //= 10
+    if exponent >= 4:
+        raise ValueError('Exposure too big')
+    return value * 10 ** exponent // 10
+
+
+@dataclass()
+class AutoExposureResult:
+    """Результат подбора экспозиции"""
+    exposure: int
+    """Установленная экспозиция, мс"""
+    level: float
+    """Уровень сигнала при последнем измерении, в долях от полной шкалы АЦП"""
+    converged: bool
+    """`True`, если уровень сигнала достиг целевого"""
+    n_reads: int
+    """Количество выполненных измерений"""
+    elapsed: float
+    """Затраченное время, с"""
+
+
+class ExposureController:
+    """Подбор экспозиции по измеренным кадрам.
+
+    Сигнал считается пропорциональным экспозиции за вычетом темнового сигнала, поэтому следующая
+    экспозиция вычисляется по одному измерению. Если в кадре есть зашкаленные значения, уровень
+    сигнала неизвестен, и экспозиция уменьшается в `saturation_step` раз.
+    """
+
+    def __init__(self, target: float = 0.8, percentile: float = 99.0, tolerance: float = 0.1,
+                 min_exposure: int = 1, max_exposure: int = MAX_EXPOSURE,
+                 max_step: float = 10.0, saturation_step: float = 4.0):
+        """
+        Params:
+            target: Целевой уровень сигнала в долях от полной шкалы АЦП
+            percentile: Перцентиль отсчётов кадра, принимаемый за уровень сигнала
+            tolerance: Допустимое относительное отклонение уровня от целевого
+            min_exposure: Минимальная экспозиция, мс
+            max_exposure: Максимальная экспозиция, мс
+            max_step: Максимальное изменение экспозиции за один шаг (в разах)
+            saturation_step: Во сколько раз уменьшается экспозиция при зашкаливании
+        """
+        if not 0 < target < 1:
+            raise ValueError('Target level must be between 0 and 1')
+        self.target = target
+        self.percentile = percentile
+        self.tolerance = tolerance
+        self.min_exposure = min_exposure
+        self.max_exposure = max_exposure
+        self.max_step = max_step
+        self.saturation_step = saturation_step
+
+    def level(self, counts: NDArray) -> float:
+        """Уровень сигнала в долях от полной шкалы АЦП"""
+        return float(np.percentile(counts, self.percentile)) / FULL_SCALE
+
+    def is_converged(self, level: float, clipped: NDArray) -> bool:
+        """Возвращает `True`, если уровень сигнала достаточно близок к целевому"""
+        return not np.any(clipped) and abs(level - self.target) <= self.tolerance * self.target
+
+    def update(self, exposure: int, counts: NDArray, clipped: NDArray,
+               dark: Optional[NDArray] = None) -> tuple[float, Optional[int]]:
+        """
+        Обработать измерение
+        Args:
+            exposure: Экспозиция, при которой выполнено измерение, мс
+            counts: Отсчёты АЦП
+            clipped: Признаки зашкаливания
+            dark: Средний темновой сигнал в отсчётах АЦП для этой экспозиции, если известен
+        Returns:
+            Уровень сигнала и следующая экспозиция. Вместо экспозиции возвращается `None`,
+            если подбор завершён: уровень достиг целевого или экспозицию нельзя изменить
+        """
+        level = self.level(counts)
+        if self.is_converged(level, clipped):
+            return level, None
+
+        if np.any(clipped):
+            factor = 1 / self.saturation_step
+        else:
+            dark_level = 0.0 if dark is None else self.level(dark)
+            signal = level - dark_level
+            if signal <= 0:
+                factor = self.max_step
+            else:
+                factor = np.clip((self.target - dark_level) / signal, 1 / self.max_step, self.max_step)
+
+        proposed = int(np.clip(round(exposure * factor), self.min_exposure, self.max_exposure))
+        proposed = max(quantize_exposure(proposed), self.min_exposure)
+        if proposed == exposure:
+            return level, None
+        return level, proposed
@@ -0,0 +1,190 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence, TypeVar
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .data import Data
+from .device_factory import DeviceID
+from .spectrometer import Spectrometer, FactoryConfig
+
+T = TypeVar('T')
+
+
+@dataclass()
+class GroupReading:
+    """Результат одновременного чтения с группы спектрометров"""
+    data: list[Data]
+    """Данные каждого спектрометра, в порядке спектрометров группы"""
+    start_times: NDArray[float]
+    """Время начала чтения на каждом спектрометре, с (см. `time.time`)"""
+    end_times: NDArray[float]
+    """Время окончания чтения на каждом спектрометре, с"""
+
+    @property
+    def skew(self) -> float:
+        """Разброс моментов начала чтения между спектрометрами, с"""
+        return float(np.ptp(self.start_times))
+
+    @property
+    def end_skew(self) -> float:
+        """Разброс моментов окончания чтения между спектрометрами, с"""
+        return float(np.ptp(self.end_times))
+
+    @property
+    def duration(self) -> float:
+        """Время от начала первого до окончания последнего чтения, с"""
+        return float(np.max(self.end_times) - np.min(self.start_times))
+
+    def timestamps(self) -> list[NDArray[float]]:
+        """
+        Время измерения каждого кадра. Кадры считаются идущими подряд с периодом, равным экспозиции,
+        и заканчивающимися в момент окончания чтения
+        Returns:
+            Массив времён для каждого спектрометра
+        """
+        return [
+            end - np.arange(data.n_times - 1, -1, -1) * (data.exposure / 1000)
+            for data, end in zip(self.data, self.end_times)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, item: int) -> Data:
+        return self.data[item]
+
+
+class SpectrometerGroup:
+    """Группа спектрометров, работающих одновременно.
+
+    У каждого спектрометра есть свой рабочий поток, в котором по очереди выполняются все обращения
+    к этому устройству. Команды группы рассылаются всем потокам сразу, поэтому настройка и чтение
+    занимают столько же времени, сколько у самого медленного устройства, а не сумму времён.
+    Перед чтением потоки дожидаются друг друга на барьере, чтобы команды ушли на устройства
+    как можно ближе по времени. Нативное чтение с USB и работа с сокетами не удерживают GIL.
+    """
+
+    def __init__(self, spectrometers: Sequence[Spectrometer]):
+        """
+        Params:
+            spectrometers: Открытые спектрометры. Для одновременного открытия устройств используйте `open`
+        """
+        if not spectrometers:
+            raise ValueError('Group must contain at least one spectrometer')
+        self.__spectrometers = list(spectrometers)
+        self.__executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'SpectrometerGroup-{i}')
+            for i in range(len(self.__spectrometers))
+        ]
+
+    @classmethod
+    def open(cls, device_ids: Sequence[DeviceID],
+             factory_configs: FactoryConfig | Sequence[FactoryConfig] = FactoryConfig.default(),
+             reopen: bool = True) -> 'SpectrometerGroup':
+        """
+        Открыть устройства одновременно
+        Params:
+            device_ids: Идентификаторы устройств
+            factory_configs: Заводские настройки, общие или для каждого устройства
+            reopen: См. `Spectrometer`
+        Returns:
+            Группа спектрометров
+        """
+        if isinstance(factory_configs, FactoryConfig):
+            factory_configs = [factory_configs] * len(device_ids)
+        if len(factory_configs) != len(device_ids):
+            raise ValueError('Number of factory configs does not match number of devices')
+
+        with ThreadPoolExecutor(max_workers=max(len(device_ids), 1)) as executor:
+            futures = [
+                executor.submit(Spectrometer, device_id, factory_config, reopen)
+                for device_id, factory_config in zip(device_ids, factory_configs)
+            ]
+            errors = [future.exception() for future in futures]
+
+        if any(error is not None for error in errors):
+            for future, error in zip(futures, errors):
+                if error is None:
+                    future.result().close()
+            raise next(error for error in errors if error is not None)
+        return cls([future.result() for future in futures])
+
+    @property
+    def spectrometers(self) -> list[Spectrometer]:
+        return list(self.__spectrometers)
+
+    def __len__(self) -> int:
+        return len(self.__spectrometers)
+
+    def __getitem__(self, item: int) -> Spectrometer:
+        return self.__spectrometers[item]
+
+    def __run(self, func: Callable[[Spectrometer], T]) -> list[T]:
+        # every device is accessed only from its own worker, errors are raised after all workers finish
+        futures = [
+            executor.submit(func, spectrometer)
+            for executor, spectrometer in zip(self.__executors, self.__spectrometers)
+        ]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return [future.result() for future in futures]
+
+    def __read(self, read: Callable[[Spectrometer], Data]) -> GroupReading:
+        barrier = threading.Barrier(len(self.__spectrometers))
+
+        def task(spectrometer: Spectrometer) -> tuple[float, Data, float]:
+            barrier.wait()
+            start = time.time()
+            data = read(spectrometer)
+            return start, data, time.time()
+
+        results = self.__run(task)
+        return GroupReading(
+            data=[data for _, data, _ in results],
+            start_times=np.array([start for start, _, _ in results]),
+            end_times=np.array([end for _, _, end in results]),
+        )
+
+    def close(self) -> None:
+        """Закрыть все устройства"""
+        try:
+            self.__run(Spectrometer.close)
+        finally:
+            for executor in self.__executors:
+                executor.shutdown(wait=False)
+
+    def set_config(self, **kwargs) -> None:
+        """Установить одинаковые настройки всем спектрометрам. Параметры совпадают с `Spectrometer.set_config`"""
+        self.__run(lambda spectrometer: spectrometer.set_config(**kwargs))
+
+    def read_dark_signal(self, n_times: Optional[int] = None) -> None:
+        """Считать темновой сигнал на всех спектрометрах (см. `Spectrometer.read_dark_signal`)"""
+        self.__run(lambda spectrometer: spectrometer.read_dark_signal(n_times))
+
+    def read_raw(self, n_times: Optional[int] = None) -> GroupReading:
+        """Одновременно получить сырые данные со всех спектрометров (см. `Spectrometer.read_raw`)"""
+        return self.__read(lambda spectrometer: spectrometer.read_raw(n_times))
+
+    def read(self, force: bool = False, n_times: Optional[int] = None) -> GroupReading:
+        """
+        Одновременно получить обработанные спектры со всех спектрометров (см. `Spectrometer.read`)
+        Returns:
+            Чтение, в котором `data` содержит объекты `Spectrum`
+        """
+        return self.__read(lambda spectrometer: spectrometer.read(force=force, n_times=n_times))
+
+    def __enter__(self) -> 'SpectrometerGroup':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self) -> str:
+        cls = self.__class__
+        return f'{cls.__name__}({len(self)} spectrometers)'
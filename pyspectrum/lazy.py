@@ -0,0 +1,259 @@
+"""Отложенные вычисления над данными, которые не помещаются в память.
+
+`LazyData` хранит не массивы, а выражение над исходными массивами (`np.memmap`, наборы данных
+h5py, массивы Zarr). Арифметика и срезы только строят новое выражение, а вычисление выполняется
+по блокам кадров при обращении к данным (`iter_chunks`, `compute`) или при свёртке (`mean`, `sum`, ...).
+Поэтому, например, вычитание темнового сигнала из многогигабайтной записи требует памяти
+только на один блок.
+"""
+import operator
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .data import Data, _check_slice_key
+
+CHUNK_FRAMES = 1024
+
+
+def _to_slice(r: range) -> slice:
+    stop = r.stop if r.stop >= 0 else None
+    return slice(r.start, stop, r.step)
+
+
+def _normalize_key(key) -> tuple[slice, slice]:
+    _check_slice_key(key)
+    if type(key) == slice:
+        return key, slice(None)
+    key = key + (slice(None),) * (2 - len(key))
+    return key[0], key[1]
+
+
+class Node(ABC):
+    """Узел выражения. Значение узла - двумерный массив (кадры x отсчёты)"""
+    shape: tuple[int, int]
+
+    @abstractmethod
+    def read(self, rows: slice) -> NDArray:
+        """Вычислить строки `rows` значения узла"""
+
+    @abstractmethod
+    def take(self, rows: slice, cols: slice) -> 'Node':
+        """Узел, значение которого - срез значения этого узла"""
+
+
+class Source(Node):
+    """Исходный массив. Читаются только запрошенные строки и столбцы"""
+
+    def __init__(self, array, rows: Optional[range] = None, cols: Optional[range] = None, dtype=None):
+        self.array = array
+        self.rows = range(array.shape[0]) if rows is None else rows
+        self.cols = range(array.shape[1]) if cols is None else cols
+        self.dtype = dtype
+        self.shape = (len(self.rows), len(self.cols))
+
+    def read(self, rows: slice) -> NDArray:
+        selected = self.rows[rows]
+        if len(selected) == 0:
+            return np.empty((0, self.shape[1]), dtype=self.dtype or self.array.dtype)
+        return np.asarray(self.array[_to_slice(selected), _to_slice(self.cols)], dtype=self.dtype)
+
+    def take(self, rows: slice, cols: slice) -> 'Source':
+        return Source(self.array, self.rows[rows], self.cols[cols], self.dtype)
+
+
+class Constant(Node):
+    """Число или вектор значений по отсчётам, одинаковый для всех кадров"""
+
+    def __init__(self, value, n_times: int):
+        self.value = np.asarray(value)
+        self.shape = (n_times, self.value.shape[0] if self.value.ndim else 0)
+
+    def read(self, rows: slice) -> NDArray:
+        return self.value
+
+    def take(self, rows: slice, cols: slice) -> 'Constant':
+        value = self.value[cols] if self.value.ndim else self.value
+        return Constant(value, len(range(self.shape[0])[rows]))
+
+
+class Operation(Node):
+    """Поэлементная операция над двумя узлами"""
+
+    def __init__(self, op: Callable, left: Node, right: Node):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.shape = left.shape
+
+    def read(self, rows: slice) -> NDArray:
+        return self.op(self.left.read(rows), self.right.read(rows))
+
+    def take(self, rows: slice, cols: slice) -> 'Operation':
+        return Operation(self.op, self.left.take(rows, cols), self.right.take(rows, cols))
+
+
+class LazyData:
+    """Данные, вычисляемые по блокам кадров только при обращении к ним (см. модуль `pyspectrum.lazy`).
+    Поддерживает те же операции, что и `Data`: сложение, вычитание, умножение на число и срезы"""
+
+    def __init__(self, intensity, clipped, exposure: int, intensity_scale: float | None = None,
+                 wavelength: NDArray[float] | None = None):
+        """
+        Params:
+            intensity: Двумерный массив данных (`ndarray`, `np.memmap`, набор данных h5py, массив Zarr) или узел выражения
+            clipped: Массив признаков зашкаливания или узел выражения
+            exposure: Экспозиция в миллисекундах
+            intensity_scale: См. `Data.intensity_scale`
+            wavelength: Длины волн. Если задано, вычисленные данные возвращаются в виде `Spectrum`
+        """
+        self.__intensity = intensity if isinstance(intensity, Node) else Source(intensity)
+        if intensity_scale is not None:
+            self.__intensity = Operation(operator.mul, self.__intensity, Constant(intensity_scale, self.__intensity.shape[0]))
+        self.__clipped = clipped if isinstance(clipped, Node) else Source(clipped, dtype=bool)
+        self.exposure = exposure
+        self.wavelength = wavelength
+
+    @staticmethod
+    def from_data(data: Data) -> 'LazyData':
+        """Обернуть `Data` или `Spectrum`, не копируя массивы"""
+        return LazyData(data.intensity, data.clipped, data.exposure, data.intensity_scale,
+                        getattr(data, 'wavelength', None))
+
+    @property
+    def n_times(self) -> int:
+        """Количество измерений"""
+        return self.__intensity.shape[0]
+
+    @property
+    def n_numbers(self) -> int:
+        """Количество отсчётов в кадре"""
+        return self.__intensity.shape[1]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """Размерность данных"""
+        return self.__intensity.shape
+
+    # --------        expression building        --------
+
+    def __new(self, intensity: Node, clipped: Node, wavelength=None) -> 'LazyData':
+        return LazyData(intensity, clipped, self.exposure, wavelength=wavelength)
+
+    def __operand(self, other) -> tuple[Node, Optional[Node]]:
+        if isinstance(other, LazyData):
+            if self.exposure != other.exposure:
+                raise ValueError('Exposures are different')
+            return other.__intensity, other.__clipped
+        if isinstance(other, Data):
+            return self.__operand(LazyData.from_data(other))
+        if np.ndim(other) == 2:
+            if np.shape(other)[0] == 1:
+                # a single row is the same for all frames, as in numpy broadcasting
+                return Constant(np.asarray(other)[0], self.n_times), None
+            return Source(other), None
+        return Constant(other, self.n_times), None
+
+    def __combine(self, op: Callable, other) -> 'LazyData':
+        intensity, clipped = self.__operand(other)
+        if clipped is not None:
+            clipped = Operation(np.bitwise_or, self.__clipped, clipped)
+        else:
+            clipped = self.__clipped
+        return self.__new(Operation(op, self.__intensity, intensity), clipped, self.wavelength)
+
+    def __add__(self, other) -> 'LazyData':
+        return self.__combine(operator.add, other)
+
+    def __sub__(self, other) -> 'LazyData':
+        return self.__combine(operator.sub, other)
+
+    def __mul__(self, other) -> 'LazyData':
+        if isinstance(other, (Data, LazyData)):
+            raise TypeError('Cannot multiply by Data')
+        return self.__combine(operator.mul, other)
+
+    def __getitem__(self, key) -> 'LazyData':
+        rows, cols = _normalize_key(key)
+        wavelength = None if self.wavelength is None else self.wavelength[cols]
+        return self.__new(self.__intensity.take(rows, cols), self.__clipped.take(rows, cols), wavelength)
+
+    # --------        evaluation        --------
+
+    def __make(self, intensity: NDArray, clipped: NDArray) -> Data:
+        data = Data(intensity, clipped, self.exposure)
+        if self.wavelength is not None:
+            return data.to_spectrum(self.wavelength)
+        return data
+
+    def iter_chunks(self, chunk_frames: int = CHUNK_FRAMES) -> Iterator[Data]:
+        """
+        Вычислить данные по блокам кадров
+        Args:
+            chunk_frames: Количество кадров в блоке
+        Returns:
+            Итератор по блокам в виде `Data` (или `Spectrum`, если заданы длины волн)
+        """
+        for start in range(0, self.n_times, chunk_frames):
+            rows = slice(start, min(start + chunk_frames, self.n_times))
+            intensity = np.broadcast_to(self.__intensity.read(rows), (rows.stop - start, self.n_numbers))
+            clipped = np.broadcast_to(self.__clipped.read(rows), intensity.shape)
+            yield self.__make(np.array(intensity), np.array(clipped, dtype=bool))
+
+    def compute(self) -> Data:
+        """Вычислить все данные в памяти"""
+        chunks = list(self.iter_chunks())
+        if not chunks:
+            return self.__make(np.empty(self.shape), np.empty(self.shape, dtype=bool))
+        return self.__make(
+            np.concatenate([c.intensity for c in chunks]),
+            np.concatenate([c.clipped for c in chunks]),
+        )
+
+    def save(self, path: str, factory_config=None, chunk_frames: int = CHUNK_FRAMES) -> None:
+        """Вычислить данные по блокам и сохранить в файл (см. `Data.save`), не загружая их в память целиком"""
+        from .storage import CaptureHeader, CaptureWriter
+
+        writer = None
+        try:
+            for chunk in self.iter_chunks(chunk_frames):
+                if writer is None:
+                    writer = CaptureWriter(path, CaptureHeader.for_data(chunk, factory_config))
+                writer.append(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    # --------        reductions over frames        --------
+
+    def __reduce(self, combine: Callable, chunk_frames: int) -> NDArray[float]:
+        result = None
+        for chunk in self.iter_chunks(chunk_frames):
+            result = combine(chunk.intensity, result)
+        if result is None:
+            raise ValueError('Data is empty')
+        return result
+
+    def sum(self, chunk_frames: int = CHUNK_FRAMES) -> NDArray[float]:
+        """Сумма интенсивности по кадрам"""
+        return self.__reduce(lambda x, acc: x.sum(axis=0) + (0 if acc is None else acc), chunk_frames)
+
+    def mean(self, chunk_frames: int = CHUNK_FRAMES) -> NDArray[float]:
+        """Средняя интенсивность по кадрам"""
+        return self.sum(chunk_frames) / self.n_times
+
+    def min(self, chunk_frames: int = CHUNK_FRAMES) -> NDArray[float]:
+        """Минимальная интенсивность по кадрам"""
+        return self.__reduce(lambda x, acc: x.min(axis=0) if acc is None else np.minimum(x.min(axis=0), acc),
+                             chunk_frames)
+
+    def max(self, chunk_frames: int = CHUNK_FRAMES) -> NDArray[float]:
+        """Максимальная интенсивность по кадрам"""
+        return self.__reduce(lambda x, acc: x.max(axis=0) if acc is None else np.maximum(x.max(axis=0), acc),
+                             chunk_frames)
+
+    def __repr__(self) -> str:
+        cls = self.__class__
+        return f'{cls.__name__}({self.n_times = }, {self.n_numbers = })'
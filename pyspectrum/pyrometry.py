@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+
+import numpy as np
+import scipy.stats
+from numpy.typing import NDArray
+
+from .data import Spectrum
+
+C2 = 14_388 * 1000
+"""Вторая радиационная постоянная, нм·К"""
+
+
+def wien_coordinates(wavelength: NDArray[float], intensity: NDArray[float]) -> tuple[NDArray[float], NDArray[float]]:
+    """
+    Перевести спектры в координаты Вина: `x = C2 / λ`, `y = ln(λ^4 * N)`.
+    В этих координатах излучение абсолютно чёрного тела - прямая с наклоном `-1 / T`.
+    Неположительные значения интенсивности (шум) заменяются на 0.1
+    Args:
+        wavelength: Длины волн, нм
+        intensity: Интенсивность, массив размера (количество кадров, количество отсчётов) или один кадр
+    Returns:
+        `x` по возрастанию и соответствующие ему `y` для каждого кадра
+    """
+    wavelength = np.asarray(wavelength, dtype=float)[::-1]
+    intensity = np.asarray(intensity)[..., ::-1]
+    x = C2 / wavelength
+    y = 4 * np.log(wavelength) + np.log(np.where(intensity > 0, intensity, 0.1))
+    return x, y
+
+
+@dataclass()
+class PyrometryResult:
+    """Результат определения температуры. Все массивы содержат значения для каждого кадра"""
+    temperature: NDArray[float]
+    """Температура, К"""
+    deviation: NDArray[float]
+    """Полуширина доверительного интервала температуры, К"""
+    slope: NDArray[float]
+    """Наклон прямой в координатах Вина"""
+    intercept: NDArray[float]
+    """Свободный член прямой в координатах Вина"""
+
+
+class Pyrometer:
+    """Определение температуры по спектру теплового излучения.
+
+    Спектр переводится в координаты Вина и исправляется на излучательную способность, найденную по
+    калибровочному спектру источника с известной температурой. По исправленному спектру в заданном
+    диапазоне длин волн методом наименьших квадратов строится прямая, наклон которой равен `-1 / T`.
+    Всё, что зависит только от длин волн и калибровки, вычисляется один раз, а прямые для всех кадров
+    находятся одновременно по явным формулам.
+    """
+
+    def __init__(self, calibration_spectrum: Spectrum, calibration_temp: float,
+                 wavelength_range: tuple[float, float] = (500, 1000), confidence: float = 0.95):
+        """
+        Params:
+            calibration_spectrum: Спектр источника с известной температурой. Используется среднее по кадрам
+            calibration_temp: Температура источника, К
+            wavelength_range: Диапазон длин волн для определения температуры, нм
+            confidence: Доверительная вероятность для `PyrometryResult.deviation`
+        """
+        self.calibration_temp = calibration_temp
+        self.wavelength_range = wavelength_range
+        self.__wavelength = np.asarray(calibration_spectrum.wavelength)
+
+        x, y = wien_coordinates(self.__wavelength, np.mean(calibration_spectrum.scaled().intensity, axis=0))
+        self.__x = x
+        # correction that turns the calibration spectrum into an ideal black body line
+        self.__correction = -x / calibration_temp - y + 4 * np.log(self.__wavelength[::-1])
+
+        imin = np.abs(x - C2 / wavelength_range[1]).argmin()
+        imax = np.abs(x - C2 / wavelength_range[0]).argmin()
+        if imax - imin < 3:
+            raise ValueError('Wavelength range is too narrow')
+        self.__fit = slice(imin, imax)
+
+        fit_x = x[self.__fit]
+        self.__x_mean = fit_x.mean()
+        self.__x_centered = fit_x - self.__x_mean
+        self.__sxx = np.sum(self.__x_centered ** 2)
+        n = imax - imin
+        self.__t = scipy.stats.t.interval(confidence, df=n - 2)[1]
+
+    @property
+    def wien_x(self) -> NDArray[float]:
+        """Координата `x` Вина для всех отсчётов, по возрастанию"""
+        return self.__x
+
+    @property
+    def fit_range(self) -> slice:
+        """Отсчёты `wien_x`, по которым строится прямая"""
+        return self.__fit
+
+    def __check(self, spectrum: Spectrum):
+        if spectrum.wavelength is not self.__wavelength and not np.array_equal(spectrum.wavelength, self.__wavelength):
+            raise ValueError('Spectrum has different wavelengths than the calibration spectrum')
+
+    def wien_y(self, spectrum: Spectrum) -> NDArray[float]:
+        """Исправленные координаты `y` Вина всех кадров спектра, размер (количество кадров, количество отсчётов)"""
+        self.__check(spectrum)
+        intensity = np.atleast_2d(spectrum.scaled().intensity)[:, ::-1]
+        return np.log(np.where(intensity > 0, intensity, 0.1)) + self.__correction
+
+    def fit(self, spectrum: Spectrum) -> PyrometryResult:
+        """
+        Определить температуру для всех кадров спектра
+        Args:
+            spectrum: Спектр с той же калибровкой по длинам волн, что и калибровочный
+        Returns:
+            Температура и погрешность для каждого кадра
+        """
+        self.__check(spectrum)
+        fit = self.__fit
+        n_pixels = len(self.__x)
+        # only the columns used by the fit are read, in ascending x order
+        columns = slice(n_pixels - fit.start - 1, n_pixels - fit.stop - 1 if fit.stop < n_pixels else None, -1)
+        y = np.array(np.atleast_2d(spectrum.scaled().intensity)[:, columns], dtype=float)
+        y[y <= 0] = 0.1
+        np.log(y, out=y)
+        y += self.__correction[fit]
+
+        # closed-form least squares for every frame at once, y is centered in place
+        y_mean = y.mean(axis=1)
+        y -= y_mean[:, None]
+        slope = y @ self.__x_centered / self.__sxx
+        intercept = y_mean - slope * self.__x_mean
+
+        residuals = np.einsum('ij,ij->i', y, y) - slope ** 2 * self.__sxx
+        s2 = np.maximum(residuals, 0) / (y.shape[1] - 2)
+        delta_slope = self.__t * np.sqrt(s2 / self.__sxx)
+
+        return PyrometryResult(
+            temperature=-1 / slope,
+            deviation=delta_slope / slope ** 2,
+            slope=slope,
+            intercept=intercept,
+        )
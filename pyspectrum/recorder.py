@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .data import Data, Spectrum
+from .spectrometer import Spectrometer
+from .storage import CaptureHeader, CaptureWriter
+
+
+class Recorder:
+    """Запись данных со спектрометра в файл во время измерения.
+
+    Каждая пачка кадров, считанная через `read_raw` или `read`, дописывается в файл
+    (см. `pyspectrum.storage`) вместе со временем измерения и экспозицией каждого кадра.
+    Запись на диск выполняется в фоновом потоке, поэтому чтение с устройства не ждёт файловой системы,
+    а данные не накапливаются в памяти. Количество кадров в заголовке файла периодически обновляется,
+    так что при аварийном завершении теряются только кадры, записанные после последнего обновления.
+    """
+
+    def __init__(self, spectrometer: Spectrometer, path: str, flush_interval: float = 1.0, buffer_size: int = 64):
+        """
+        Params:
+            spectrometer: Спектрометр, с которого ведётся запись
+            path: Путь к файлу. Существующий файл будет перезаписан
+            flush_interval: Максимальное время от записи кадров до их сброса на диск в секундах.
+                При `0` каждая пачка сбрасывается сразу
+            buffer_size: Максимальное количество пачек, ожидающих записи. Если запись не успевает,
+                чтение блокируется до освобождения места
+        """
+        self.__spectrometer = spectrometer
+        self.__path = path
+        self.__flush_interval = flush_interval
+        self.__queue: queue.Queue = queue.Queue(buffer_size)
+        self.__header: Optional[CaptureHeader] = None
+        self.__error: Optional[BaseException] = None
+        self.__closed = False
+        self.__n_frames = 0
+
+        self.__thread = threading.Thread(target=self.__run, name='Recorder', daemon=True)
+        self.__thread.start()
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def n_frames(self) -> int:
+        """Количество кадров, переданных на запись"""
+        return self.__n_frames
+
+    # --------        acquisition        --------
+
+    def read_raw(self, n_times: Optional[int] = None) -> Data:
+        """Получить сырые данные с устройства (см. `Spectrometer.read_raw`) и записать их"""
+        data = self.__spectrometer.read_raw(n_times)
+        self.write(data, self.__frame_times(data))
+        return data
+
+    def read(self, force: bool = False, n_times: Optional[int] = None) -> Spectrum:
+        """Получить обработанный спектр с устройства (см. `Spectrometer.read`) и записать его"""
+        data = self.__spectrometer.read(force=force, n_times=n_times)
+        self.write(data, self.__frame_times(data))
+        return data
+
+    @staticmethod
+    def __frame_times(data: Data) -> NDArray[float]:
+        # the batch has just been received, earlier frames are spaced by the exposure
+        end = time.time()
+        return end - np.arange(data.n_times - 1, -1, -1) * (data.exposure / 1000)
+
+    def write(self, data: Data, timestamps: Optional[NDArray[float]] = None) -> None:
+        """
+        Передать кадры на запись. Первая записанная пачка определяет тип данных файла:
+        все последующие должны быть того же типа (`Data` или `Spectrum`), с тем же количеством
+        отсчётов, типом отсчётов, множителем интенсивности и длинами волн.
+        Если запись в файл завершилась ошибкой, она выбрасывается этим и всеми последующими вызовами
+        Args:
+            data: Кадры
+            timestamps: Время измерения каждого кадра в секундах (см. `time.time`)
+        """
+        self.__check_error()
+        if self.__closed:
+            raise ValueError('Recorder is closed')
+
+        header = CaptureHeader.for_data(data, self.__spectrometer.factory_config)
+        if self.__header is None:
+            self.__header = header
+        elif not self.__header.is_compatible(header):
+            raise ValueError('Data is incompatible with previously recorded data')
+
+        self.__queue.put((data, timestamps))
+        self.__n_frames += data.n_times
+
+    def __check_error(self):
+        # the error stays set: once the writer has failed, every later write fails too
+        if self.__error is not None:
+            raise self.__error
+
+    # --------        background thread        --------
+
+    def __run(self):
+        writer: Optional[CaptureWriter] = None
+        # frames written since the last flush must be flushed by `next_flush`
+        dirty = False
+        next_flush = 0.0
+        try:
+            while True:
+                if dirty:
+                    try:
+                        item = self.__queue.get(timeout=max(next_flush - time.monotonic(), 0))
+                    except queue.Empty:
+                        item = ()
+                else:
+                    # nothing to flush, so there is no deadline to wake up for
+                    item = self.__queue.get()
+
+                if item is None:
+                    return
+                if item:
+                    data, timestamps = item
+                    if writer is None:
+                        writer = CaptureWriter(self.__path, self.__header)
+                    writer.append(data, timestamps)
+                    if not dirty:
+                        dirty = True
+                        next_flush = time.monotonic() + self.__flush_interval
+
+                if dirty and time.monotonic() >= next_flush:
+                    writer.flush()
+                    dirty = False
+        except BaseException as e:
+            self.__error = e
+            # keep draining so that producers are never blocked by a dead writer
+            while self.__queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def close(self) -> None:
+        """Дождаться записи всех кадров и закрыть файл"""
+        if not self.__closed:
+            self.__closed = True
+            self.__queue.put(None)
+            self.__thread.join()
+        # reported once more by close, then the recorder is finished
+        error, self.__error = self.__error, None
+        if error is not None:
+            raise error
+
+    def __enter__(self) -> 'Recorder':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self) -> str:
+        cls = self.__class__
+        return f'{cls.__name__}({self.path = }, {self.n_frames = })'
@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .data import Data
+
+
+@dataclass()
+class RingSlot:
+    """Ячейка кольцевого буфера"""
+    samples: NDArray[np.uint16]
+    """Кадры в том виде, в котором они получены с устройства"""
+    clipped: NDArray[bool]
+    """Признак зашкаливания для `samples`"""
+    cropped: NDArray[np.uint16]
+    """Используемая часть `samples` с учётом заводских настроек"""
+    data: Data
+    """Данные, возвращаемые пользователю. Массивы этого объекта переиспользуются"""
+
+
+class FrameRing:
+    """Заранее выделенный кольцевой буфер для многократного чтения данных без выделения памяти.
+
+    Каждое чтение в буфер (см. `Spectrometer.read_raw`) заполняет следующую ячейку и возвращает её `Data`.
+    Возвращённые массивы остаются валидными, пока буфер не сделает полный круг,
+    после чего перезаписываются новыми данными.
+    """
+
+    def __init__(self, n_slots: int, n_times: int, n_pixels: int,
+                 start: int, end: int, reverse: bool, intensity_scale: float, raw_counts: bool):
+        """
+        Params:
+            n_slots: Количество ячеек
+            n_times: Количество кадров в одной ячейке
+            n_pixels: Количество отсчётов в кадре, получаемом с устройства
+            start: Первый используемый отсчёт кадра
+            end: Отсчёт, следующий за последним используемым
+            reverse: Если `True`, порядок отсчётов в кадре обращается
+            intensity_scale: Множитель интенсивности
+            raw_counts: Если `True`, `Data` ячеек содержат отсчёты АЦП (см. `Data.intensity_scale`)
+        """
+        if n_slots < 1:
+            raise ValueError('Ring must have at least one slot')
+
+        self.__n_times = n_times
+        self.__raw_counts = raw_counts
+        self.__intensity_scale = intensity_scale
+        self.__index = -1
+
+        direction = -1 if reverse else 1
+        self.__slots: list[RingSlot] = []
+        for _ in range(n_slots):
+            samples = np.zeros((n_times, n_pixels), dtype=np.uint16)
+            clipped = np.zeros((n_times, n_pixels), dtype=bool)
+            cropped_samples = samples[:, start:end][:, ::direction]
+            cropped_clipped = clipped[:, start:end][:, ::direction]
+            if raw_counts:
+                data = Data(cropped_samples, cropped_clipped, 0, intensity_scale=intensity_scale)
+            else:
+                data = Data(np.zeros(cropped_samples.shape), cropped_clipped, 0)
+            self.__slots.append(RingSlot(samples, clipped, cropped_samples, data))
+
+    @property
+    def n_slots(self) -> int:
+        """Количество ячеек"""
+        return len(self.__slots)
+
+    @property
+    def n_times(self) -> int:
+        """Количество кадров в одной ячейке"""
+        return self.__n_times
+
+    @property
+    def raw_counts(self) -> bool:
+        """Возвращает `True`, если ячейки хранят отсчёты АЦП"""
+        return self.__raw_counts
+
+    @property
+    def last(self) -> Data | None:
+        """Данные последней заполненной ячейки"""
+        if self.__index < 0:
+            return None
+        return self.__slots[self.__index].data
+
+    def peek_slot(self) -> RingSlot:
+        """Вернуть следующую ячейку для заполнения. Буфер переходит к ней только в `commit`"""
+        return self.__slots[(self.__index + 1) % len(self.__slots)]
+
+    def commit(self, slot: RingSlot, exposure: int) -> Data:
+        """Обработать заполненные `samples` ячейки, полученной из `peek_slot`, перейти к ней и вернуть её `Data`.
+        Если заполнение ячейки не удалось, `commit` не вызывается, и `last` остаётся прежним"""
+        index = (self.__index + 1) % len(self.__slots)
+        if self.__slots[index] is not slot:
+            raise ValueError('Slot is not the next slot of the ring')
+        self.__index = index
+        data = slot.data
+        data.exposure = exposure
+        if not self.__raw_counts:
+            np.multiply(slot.cropped, self.__intensity_scale, out=data.intensity)
+        return data
@@ -1,15 +1,23 @@
 import json
+import math
 import sys
+import threading
+from contextlib import closing, contextmanager
 from dataclasses import dataclass
-from typing import Optional
+from time import monotonic
+from typing import Generator, Iterator, Optional
 
 import _pyspectrum as internal
 import numpy as np
 from numpy.typing import NDArray
 
+from .dark_library import DarkLibrary
 from .data import Data, Spectrum
 from .device_factory import DeviceID, create_device
-from .errors import ConfigurationError, LoadError, DeviceClosedError
+from .errors import ConfigurationError, LoadError, DeviceClosedError, DeviceError
+from .exposure import AutoExposureResult, ExposureController, MAX_EXPOSURE
+from .ring import FrameRing
+from .stream import FrameStream
 
 
 def eprint(*args, **kwargs):
@@ -62,6 +70,8 @@ class Config:
     exposure: int = 10  # время экспозиции, ms
     n_times: int = 1  # количество измерений
     dark_signal_path: Optional[str] = None
+    dark_library_path: Optional[str] = None
+    raw_counts: bool = False  # хранить сырые данные в виде отсчётов АЦП (uint16), см. `Data.intensity_scale`
 
 
 class Spectrometer:
@@ -74,19 +84,34 @@ class Spectrometer:
             factory_config: Заводские настройки
         """
         self.__device: internal.RawSpectrometer = create_device(device_id, reopen)
+        self.__device_lock = threading.RLock()
+        # set while `iter_raw` holds the device between chunks
+        self.__iterating = False
         self.__factory_config = factory_config
         self.__config = Config()
         self.__device.setTimer(self.__config.exposure)
         self.__dark_signal: Data | None = None
+        self.__dark_reference: NDArray[float] | None = None
+        self.__dark_library: DarkLibrary | None = None
         self.__wavelengths: NDArray[float] | None = None
 
+    @contextmanager
+    def __use_device(self):
+        with self.__device_lock:
+            # other threads wait on the lock until `iter_raw` is finished, but the lock is reentrant,
+            # so the thread running the iteration itself would get in between chunks and break the stream
+            if self.__iterating:
+                raise DeviceError('Device is busy with iter_raw, finish or close the iterator first')
+            yield
+
     def __check_opened(self):
         if not self.__device.isOpened:
             raise DeviceClosedError()
 
     def close(self) -> None:
         """Закрыть устройство"""
-        self.__device.close()
+        with self.__use_device():
+            self.__device.close()
 
     # --------        dark signal        --------
 
@@ -97,7 +122,7 @@ class Spectrometer:
 
     def __load_dark_signal(self):
         try:
-            data = Data.load(self.__config.dark_signal_path)
+            data = Data.load(self.__config.dark_signal_path, allow_pickle=True)
         except Exception:
             eprint('Dark signal file is invalid or does not exist, dark signal was NOT loaded')
             return
@@ -106,19 +131,81 @@ class Spectrometer:
             eprint("Saved dark signal has different shape, dark signal was NOT loaded")
             return
         if data.exposure != self.__config.exposure:
+            if self.__dark_library is not None:
+                # the current dark signal is kept, the library only fills in for other exposures
+                self.__dark_library.add(data, self.__factory_config.intensity_scale)
+                self.__invalidate_dark_reference()
+                eprint('Saved dark signal has different exposure, it was added to dark library')
+                return
             eprint('Saved dark signal has different exposure, dark signal was NOT loaded')
             return
 
-        self.__dark_signal = data
+        self.__set_dark_signal(data)
         eprint('Dark signal loaded')
 
     def read_dark_signal(self, n_times: Optional[int] = None) -> None:
         """
-        Считать темновой сигнал
+        Считать темновой сигнал. Если задан набор темновых сигналов (см. `dark_library`), сигнал добавляется в него
         Args:
             n_times: Количество измерений. При обработке данных будет использовано среднее значение
         """
-        self.__dark_signal = self.read_raw(n_times)
+        data = self.read_raw(n_times)
+        self.__set_dark_signal(data)
+        if self.__dark_library is not None:
+            self.__dark_library.add(data, self.__factory_config.intensity_scale)
+
+    def __set_dark_signal(self, data: Data | None):
+        self.__dark_signal = data
+        self.__invalidate_dark_reference()
+
+    def __invalidate_dark_reference(self):
+        # the reference may be interpolated from the dark library, so it is recomputed when either changes
+        self.__dark_reference = None
+
+    def __has_dark_reference(self) -> bool:
+        return self.__dark_signal is not None or (self.__dark_library is not None and len(self.__dark_library) > 0)
+
+    def __get_dark_reference(self) -> NDArray[float]:
+        # average dark signal in ADC counts, computed once per dark signal
+        if self.__dark_reference is None:
+            dark_signal = self.__dark_signal
+            if dark_signal is not None:
+                dark_counts = dark_signal.intensity
+                if dark_signal.intensity_scale is None:
+                    dark_counts = dark_counts / self.__factory_config.intensity_scale
+                self.__dark_reference = np.round(np.mean(dark_counts, axis=0))
+            else:
+                self.__dark_reference = np.round(self.__dark_library.reference(self.__config.exposure))
+        return self.__dark_reference
+
+    @property
+    def dark_library(self) -> DarkLibrary | None:
+        """Набор темновых сигналов для разных экспозиций (см. `set_config(dark_library_path=...)`).
+        Если темновой сигнал для текущей экспозиции не считан, при обработке используется сигнал из набора"""
+        return self.__dark_library
+
+    def __load_dark_library(self):
+        try:
+            library = DarkLibrary.load(self.__config.dark_library_path)
+        except LoadError:
+            library = DarkLibrary()
+            eprint('Dark library file is invalid or does not exist, empty dark library was created')
+        else:
+            eprint(f'Dark library loaded, exposures: {library.exposures}')
+
+        if len(library) > 0 and len(library.reference(library.exposures[0])) != (
+                self.__factory_config.end - self.__factory_config.start):
+            eprint('Saved dark library has different shape, empty dark library was created')
+            library = DarkLibrary()
+
+        self.__dark_library = library
+        self.__invalidate_dark_reference()
+
+    def save_dark_library(self):
+        """Сохранить набор темновых сигналов"""
+        if self.__config.dark_library_path is None:
+            raise ConfigurationError('Dark library path is not set')
+        self.__dark_library.save(self.__config.dark_library_path)
 
     def save_dark_signal(self):
         """Сохранить темновой сигнал"""
@@ -127,7 +214,7 @@ class Spectrometer:
         if self.__dark_signal is None:
             raise ConfigurationError('Dark signal is not loaded')
 
-        self.__dark_signal.save(self.__config.dark_signal_path)
+        self.__dark_signal.save(self.__config.dark_signal_path, self.__factory_config)
 
     # --------        wavelength calibration        --------
     def __load_wavelength_calibration(self, path: str) -> None:
@@ -144,9 +231,13 @@ class Spectrometer:
         eprint('Wavelength calibration loaded')
 
     # --------        read raw        --------
-    def read_raw(self, n_times: Optional[int] = None) -> Data:
+    def read_raw(self, n_times: Optional[int] = None, out: Optional[FrameRing] = None) -> Data:
         """
         Получить сырые данные с устройства
+        Args:
+            n_times: Количество измерений. По умолчанию используется `config.n_times`
+            out: Кольцевой буфер (см. `create_ring`). Если задан, данные читаются в его следующую ячейку
+                без выделения памяти, а `n_times` и `config.raw_counts` определяются буфером
         Returns:
             Сырые данные, полученные с устройства
 
@@ -154,88 +245,329 @@ class Spectrometer:
         self.__check_opened()
 
         device = self.__device
-        factory_config = self.__factory_config
         config = self.__config
 
+        if out is not None:
+            if n_times is not None and n_times != out.n_times:
+                raise ValueError('n_times does not match ring buffer')
+            with self.__use_device():
+                # the ring moves to the slot only after a successful read, under the lock
+                slot = out.peek_slot()
+                exposure = config.exposure
+                if hasattr(device, 'readFrameInto'):
+                    device.readFrameInto(slot.samples, slot.clipped)
+                else:
+                    data = device.readFrame(out.n_times)
+                    np.copyto(slot.samples, data.samples, casting='unsafe')
+                    np.copyto(slot.clipped, data.clipped, casting='unsafe')
+                return out.commit(slot, exposure)
+
+        with self.__use_device():
+            exposure = config.exposure
+            data = device.readFrame(config.n_times if n_times is None else n_times)  # type: internal.RawSpectrum
+        return self.__make_data(data.samples, data.clipped, exposure)
+
+    def iter_raw(self, n_times: Optional[int] = None, chunk_frames: int = 64) -> Iterator[Data]:
+        """
+        Получить сырые данные с устройства по частям, по мере их поступления.
+        Обработка данных может идти параллельно с передачей, а используемая память не растёт с `n_times`.
+        Устройства, не поддерживающие чтение по частям, возвращают все кадры одной частью.
+        Пока итерация не завершена, устройство заблокировано (в том числе между частями): обращения
+        к устройству из других потоков ждут её окончания, а из потока, выполняющего итерацию, завершаются
+        ошибкой `DeviceError`. Если итерация прервана, оставшиеся кадры принимаются и отбрасываются
+        при закрытии итератора
+        Args:
+            n_times: Количество измерений. По умолчанию используется `config.n_times`
+            chunk_frames: Максимальное количество кадров в одной части
+        Returns:
+            Итератор по частям сырых данных
+        """
+        self.__check_opened()
+
+        device = self.__device
+        n_times = self.__config.n_times if n_times is None else n_times
+
+        if not hasattr(device, 'iterFrames'):
+            yield self.read_raw(n_times)
+            return
+
+        with self.__use_device():
+            exposure = self.__config.exposure
+            self.__iterating = True
+            try:
+                with closing(device.iterFrames(n_times, chunk_frames)) as chunks:
+                    for frames in chunks:
+                        yield self.__make_data(frames.samples, frames.clipped, exposure)
+            finally:
+                self.__iterating = False
+
+    def __crop(self, frames: NDArray) -> NDArray:
+        # view of the used part of the frames, no copy is made
+        factory_config = self.__factory_config
         direction = -1 if factory_config.reverse else 1
-        n_times = config.n_times if n_times is None else n_times
+        return frames[:, factory_config.start:factory_config.end][:, ::direction]
 
-        data = device.readFrame(n_times)  # type: internal.RawSpectrum
-        intensity = data.samples[:, factory_config.start:factory_config.end][:,
-                    ::direction] * self.__factory_config.intensity_scale
-        clipped = data.clipped[:, factory_config.start:factory_config.end][:, ::direction]
+    def __make_data(self, samples: NDArray, clipped: NDArray, exposure: int) -> Data:
+        factory_config = self.__factory_config
+        samples = self.__crop(samples)
+        clipped = self.__crop(clipped)
+
+        if self.__config.raw_counts:
+            # always a copy: the device may reuse its receive buffer for the next chunk
+            return Data(
+                intensity=np.array(samples, copy=True),
+                clipped=clipped,
+                exposure=exposure,
+                intensity_scale=factory_config.intensity_scale,
+            )
 
         return Data(
-            intensity=intensity,
+            intensity=samples * factory_config.intensity_scale,
             clipped=clipped,
-            exposure=config.exposure,
+            exposure=exposure,
+        )
+
+    def create_ring(self, n_slots: int, n_times: Optional[int] = None) -> FrameRing:
+        """
+        Выделить кольцевой буфер для многократного чтения данных без выделения памяти
+        Args:
+            n_slots: Количество ячеек буфера
+            n_times: Количество измерений в одной ячейке. По умолчанию используется `config.n_times`
+        Returns:
+            Буфер, который можно передавать в `read_raw(out=...)`
+        """
+        self.__check_opened()
+        factory_config = self.__factory_config
+        return FrameRing(
+            n_slots=n_slots,
+            n_times=self.__config.n_times if n_times is None else n_times,
+            n_pixels=self.__device.getPixelCount(),
+            start=factory_config.start,
+            end=factory_config.end,
+            reverse=factory_config.reverse,
+            intensity_scale=factory_config.intensity_scale,
+            raw_counts=self.__config.raw_counts,
         )
 
     # --------        read        --------
-    def read(self, force: bool = False) -> Spectrum:
+    def read(self, force: bool = False, n_times: Optional[int] = None) -> Spectrum:
         """
        Получить обработанный спектр с устройства
        Args:
            force: Если ``True``, позволяет считать сигнал без калибровки по длина волн
+           n_times: Количество измерений. По умолчанию используется `config.n_times`
        Returns:
            Считанный спектр
 
        """
         if self.__wavelengths is None and not force:
             raise ConfigurationError('Wavelength calibration is not loaded')
-        if self.__dark_signal is None:
+        if not self.__has_dark_reference():
             raise ConfigurationError('Dark signal is not loaded')
 
-        data = self.read_raw()
-        scale = self.__factory_config.intensity_scale
+        self.__check_opened()
+        with self.__use_device():
+            exposure = self.__config.exposure
+            data = self.__device.readFrame(self.__config.n_times if n_times is None else n_times)
+
+        # crop and reverse are views of the device buffer, so the result is written
+        # in one subtraction pass and scaled in place, without temporaries
+        intensity = np.subtract(self.__crop(data.samples), self.__get_dark_reference(), dtype=float)
+        intensity *= self.__factory_config.intensity_scale
         return Spectrum(
-            intensity=(data.intensity / scale - np.round(
-                np.mean(self.__dark_signal.intensity / scale, axis=0))) * scale,
-            clipped=data.clipped,
+            intensity=intensity,
+            clipped=self.__crop(data.clipped),
             wavelength=self.__wavelengths,
+            exposure=exposure,
+        )
+
+    # --------        auto exposure        --------
+    @property
+    def min_exposure(self) -> int:
+        """Минимальная экспозиция, поддерживаемая устройством, мс"""
+        if hasattr(self.__device, 'getMinExposure'):
+            return max(math.ceil(self.__device.getMinExposure()), 1)
+        return 1
+
+    def auto_exposure(self,
+                      target: float = 0.8,
+                      percentile: float = 99.0,
+                      tolerance: float = 0.1,
+                      n_times: int = 1,
+                      max_reads: int = 10,
+                      settle_time: Optional[float] = None,
+                      min_exposure: Optional[int] = None,
+                      max_exposure: int = MAX_EXPOSURE,
+                      ) -> AutoExposureResult:
+        """
+        Подобрать экспозицию, при которой уровень сигнала близок к целевому (см. `ExposureController`).
+        Подобранная экспозиция остаётся установленной. Если задан набор темновых сигналов (`dark_library`),
+        он используется для учёта темнового сигнала при подборе и для обработки после смены экспозиции,
+        иначе темновой сигнал сбрасывается, как при любой смене экспозиции
+        Args:
+            target: Целевой уровень сигнала в долях от полной шкалы АЦП
+            percentile: Перцентиль отсчётов, принимаемый за уровень сигнала
+            tolerance: Допустимое относительное отклонение уровня от целевого
+            n_times: Количество кадров в одном измерении
+            max_reads: Максимальное количество измерений
+            settle_time: Максимальное время подбора в секундах. Измерение не начинается,
+                если оно не успеет завершиться за это время
+            min_exposure: Минимальная экспозиция, мс. По умолчанию используется минимум устройства
+            max_exposure: Максимальная экспозиция, мс
+        Returns:
+            Результат подбора
+        """
+        self.__check_opened()
+        steps = self.auto_exposure_steps(target, percentile, tolerance, n_times, max_reads, settle_time,
+                                         min_exposure, max_exposure)
+        try:
+            exposure = next(steps)
+            while True:
+                if exposure is None:
+                    exposure = steps.send(self.read_raw(n_times))
+                else:
+                    self.set_config(exposure=exposure)
+                    exposure = steps.send(None)
+        except StopIteration as stop:
+            return stop.value
+
+    def auto_exposure_steps(self,
+                            target: float = 0.8,
+                            percentile: float = 99.0,
+                            tolerance: float = 0.1,
+                            n_times: int = 1,
+                            max_reads: int = 10,
+                            settle_time: Optional[float] = None,
+                            min_exposure: Optional[int] = None,
+                            max_exposure: int = MAX_EXPOSURE,
+                            ) -> Generator[Optional[int], Data, AutoExposureResult]:
+        """
+        Подбор экспозиции по шагам, когда чтение и настройку выполняет вызывающий код (например, в asyncio).
+        Генератор выдаёт `None`, когда нужно измерение: в ответ через `send` передаётся результат
+        `read_raw(n_times)`. Иначе генератор выдаёт экспозицию, которую нужно установить через
+        `set_config(exposure=...)`, и в ответ передаётся `None`. Результат подбора возвращается
+        в `StopIteration.value`. Параметры совпадают с `auto_exposure`
+        """
+        controller = ExposureController(
+            target=target,
+            percentile=percentile,
+            tolerance=tolerance,
+            min_exposure=max(self.min_exposure, min_exposure or 1),
+            max_exposure=max_exposure,
+        )
+        scale = self.__factory_config.intensity_scale
+
+        start = monotonic()
+        level = 0.0
+        n_reads = 0
+        converged = False
+        while n_reads < max_reads:
+            data = yield None
+            n_reads += 1
+
+            counts = data.intensity if data.intensity_scale is not None else data.intensity / scale
+            dark = self.__get_dark_reference() if self.__has_dark_reference() else None
+            level, next_exposure = controller.update(data.exposure, counts, data.clipped, dark)
+            if next_exposure is None:
+                converged = controller.is_converged(level, data.clipped)
+                break
+            if settle_time is not None and monotonic() - start + next_exposure * n_times / 1000 > settle_time:
+                break
+            yield next_exposure
+
+        return AutoExposureResult(
             exposure=self.__config.exposure,
+            level=level,
+            converged=converged,
+            n_reads=n_reads,
+            elapsed=monotonic() - start,
         )
 
+    # --------        stream        --------
+    def stream(self, n_times: Optional[int] = None, processed: bool = False, buffer_size: int = 16) -> FrameStream:
+        """
+        Запустить непрерывное чтение данных в фоновом потоке
+        Args:
+            n_times: Количество кадров, считываемых одной командой. По умолчанию используется `config.n_times`
+            processed: Если `True`, поток возвращает обработанные спектры (см. `read`), иначе - сырые данные
+            buffer_size: Количество пачек кадров, которые могут ожидать обработки
+        Returns:
+            Итератор по считанным пачкам кадров. Для остановки чтения используйте `FrameStream.stop`
+            или конструкцию `with`
+        """
+        self.__check_opened()
+        if processed:
+            if not self.is_configured:
+                raise ConfigurationError('Spectrometer is not configured for reading processed data')
+            read = lambda: self.read(n_times=n_times)
+        else:
+            read = lambda: self.read_raw(n_times)
+
+        return FrameStream(read, buffer_size)
+
     # --------        config        --------
     @property
     def config(self) -> Config:
         return self.__config
 
+    @property
+    def factory_config(self) -> FactoryConfig:
+        return self.__factory_config
+
     @property
     def is_configured(self) -> bool:
         """Возвращает `True`, если спектрометр настроен для чтения обработанных данных"""
-        return (self.__dark_signal is not None) and (self.__wavelengths is not None)
+        return self.__has_dark_reference() and (self.__wavelengths is not None)
 
     def set_config(self,
                    exposure: Optional[int] = None,
                    n_times: Optional[int] = None,
                    dark_signal_path: Optional[str] = None,
                    wavelength_calibration_path: Optional[str] = None,
+                   raw_counts: Optional[bool] = None,
+                   dark_library_path: Optional[str] = None,
                    ):
         """Установить настройки спектрометра. Все параметры опциональны, при
         отсутствии параметра соответствующая настройка не изменяется.
 
         Params:
-            exposure: Время экспозиции (в мс). При изменении темновой сигнал будет сброшен.
+            exposure: Время экспозиции (в мс). При изменении темновой сигнал будет сброшен,
+                а при наличии набора темновых сигналов будет использован сигнал из набора.
             n_times: Количество измерений
             dark_signal_path: Путь к файлу темнового сигнала. Если файл темнового сигнала существует и валиден, он будет загружен.
             wavelength_calibration_path: Путь к файлу данных калибровки по длине волны
+            raw_counts: Если `True`, `read_raw` возвращает отсчёты АЦП без преобразования в вещественные числа.
+                Множитель интенсивности сохраняется в `Data.intensity_scale`
+            dark_library_path: Путь к файлу набора темновых сигналов (см. `DarkLibrary`).
+                Если файл существует и валиден, набор будет загружен, иначе будет создан пустой набор.
         """
         if (exposure is not None) and (exposure != self.__config.exposure):
             self.__check_opened()
-            self.__config.exposure = exposure
-            self.__device.setTimer(self.__config.exposure)
-
-            if self.__dark_signal is not None:
-                self.__dark_signal = None
-                eprint('Different exposure was set, dark signal invalidated')
+            with self.__use_device():
+                self.__device.setTimer(exposure)
+                self.__config.exposure = exposure
+
+            had_dark_signal = self.__dark_signal is not None
+            self.__set_dark_signal(None)
+            if had_dark_signal:
+                if self.__has_dark_reference():
+                    eprint('Different exposure was set, dark signal taken from dark library')
+                else:
+                    eprint('Different exposure was set, dark signal invalidated')
 
         if n_times is not None:
             self.__config.n_times = n_times
 
+        if (dark_library_path is not None) and (dark_library_path != self.__config.dark_library_path):
+            self.__config.dark_library_path = dark_library_path
+            self.__load_dark_library()
+
         if (dark_signal_path is not None) and (dark_signal_path != self.__config.dark_signal_path):
             self.__config.dark_signal_path = dark_signal_path
             self.__load_dark_signal()
 
         if wavelength_calibration_path is not None:
             self.__load_wavelength_calibration(wavelength_calibration_path)
+
+        if raw_counts is not None:
+            self.__config.raw_counts = raw_counts
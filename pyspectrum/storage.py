@@ -0,0 +1,324 @@
+"""Бинарный формат файлов для хранения `Data` и `Spectrum`.
+
+Файл состоит из заголовка и последовательности записей, по одной на кадр. Запись содержит
+время измерения, экспозицию, отсчёты кадра и упакованные по 8 в байт признаки зашкаливания.
+Записи имеют фиксированный размер, поэтому файл открывается через `np.memmap` без чтения
+данных в память, а новые кадры можно дописывать в конец файла.
+"""
+import json
+import os
+import struct
+from dataclasses import dataclass, asdict
+from typing import Any, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .data import Data, Spectrum
+from .errors import LoadError
+
+MAGIC = b'PYSPCAP\0'
+VERSION = 1
+# magic, version, metadata length, number of frames
+PREFIX = struct.Struct('<8sIIQ')
+N_FRAMES_OFFSET = 16
+ALIGNMENT = 64
+CHUNK_FRAMES = 1024
+
+
+class PackedMask:
+    """Двумерный массив boolean значений, хранящийся упакованным по 8 значений в байт.
+    Значения распаковываются только для запрошенных строк. Преобразуется в `ndarray` через `np.asarray`"""
+
+    def __init__(self, packed: NDArray[np.uint8], n_numbers: int):
+        self.__packed = packed
+        self.__n_numbers = n_numbers
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.__packed.shape[0], self.__n_numbers
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(bool)
+
+    def __len__(self) -> int:
+        return self.__packed.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> NDArray[bool]:
+        result = np.unpackbits(self.__packed, axis=1, count=self.__n_numbers).view(bool)
+        return result if dtype is None else result.astype(dtype)
+
+    def __getitem__(self, key):
+        if type(key) != tuple:
+            key = (key,)
+        rows = np.unpackbits(np.atleast_2d(self.__packed[key[0]]), axis=1, count=self.__n_numbers).view(bool)
+        if np.ndim(self.__packed[key[0]]) == 1:
+            rows = rows[0]
+            return rows[key[1:]] if len(key) > 1 else rows
+        return rows[(slice(None),) + key[1:]]
+
+
+@dataclass()
+class CaptureHeader:
+    """Метаданные файла"""
+    kind: str
+    """Тип сохранённого объекта: `Data` или `Spectrum`"""
+    n_numbers: int
+    """Количество отсчётов в кадре"""
+    dtype: str
+    """Тип отсчётов"""
+    exposure: int
+    """Экспозиция в миллисекундах"""
+    intensity_scale: Optional[float] = None
+    """См. `Data.intensity_scale`"""
+    wavelength: Optional[list[float]] = None
+    """Длины волн (только для `Spectrum`)"""
+    factory_config: Optional[dict[str, Any]] = None
+    """Заводские настройки устройства, с которого получены данные"""
+
+    def record_dtype(self) -> np.dtype:
+        return np.dtype([
+            ('timestamp', '<f8'),
+            ('exposure', '<f8'),
+            ('intensity', self.dtype, (self.n_numbers,)),
+            ('clipped', 'u1', ((self.n_numbers + 7) // 8,)),
+        ])
+
+    @staticmethod
+    def for_data(data: Data, factory_config=None) -> 'CaptureHeader':
+        is_spectrum = isinstance(data, Spectrum)
+        return CaptureHeader(
+            kind='Spectrum' if is_spectrum else 'Data',
+            n_numbers=data.n_numbers,
+            dtype=np.dtype(data.intensity.dtype).newbyteorder('<').str,
+            exposure=data.exposure,
+            intensity_scale=data.intensity_scale,
+            wavelength=None if not is_spectrum or data.wavelength is None else np.asarray(data.wavelength).tolist(),
+            factory_config=None if factory_config is None else asdict(factory_config),
+        )
+
+    def is_compatible(self, other: 'CaptureHeader') -> bool:
+        """Возвращает `True`, если кадры с заголовком `other` можно дописать в файл с этим заголовком"""
+        return (
+            (self.kind, self.n_numbers, np.dtype(self.dtype), self.intensity_scale, self.wavelength)
+            == (other.kind, other.n_numbers, np.dtype(other.dtype), other.intensity_scale, other.wavelength)
+        )
+
+    def encode(self, n_frames: int = 0) -> bytes:
+        """Заголовок файла, дополненный до границы начала записей"""
+        meta = json.dumps(asdict(self)).encode()
+        size = PREFIX.size + len(meta)
+        padding = (-size) % ALIGNMENT
+        return PREFIX.pack(MAGIC, VERSION, len(meta) + padding, n_frames) + meta + b' ' * padding
+
+
+def make_records(header: CaptureHeader, intensity: NDArray, clipped: NDArray, exposure: float,
+                 timestamp: Optional[NDArray] = None) -> NDArray:
+    """Упаковать кадры в записи файла"""
+    records = np.empty(intensity.shape[0], dtype=header.record_dtype())
+    records['timestamp'] = np.nan if timestamp is None else timestamp
+    records['exposure'] = exposure
+    records['intensity'] = intensity
+    records['clipped'] = np.packbits(np.asarray(clipped, dtype=bool), axis=1)
+    return records
+
+
+def write_capture(path: str, data: Data, factory_config=None, timestamps: Optional[NDArray] = None) -> None:
+    """
+    Сохранить данные в файл
+    Args:
+        path: Путь к файлу
+        data: Сохраняемые данные
+        factory_config: Заводские настройки устройства (`FactoryConfig`), сохраняются в заголовке
+        timestamps: Время измерения каждого кадра в секундах
+    """
+    header = CaptureHeader.for_data(data, factory_config)
+    with open(path, 'wb') as f:
+        f.write(header.encode(data.n_times))
+        for start in range(0, data.n_times, CHUNK_FRAMES):
+            end = min(start + CHUNK_FRAMES, data.n_times)
+            records = make_records(
+                header,
+                data.intensity[start:end],
+                data.clipped[start:end],
+                data.exposure,
+                None if timestamps is None else timestamps[start:end],
+            )
+            f.write(records.tobytes())
+
+
+class CaptureWriter:
+    """Дозапись кадров в конец файла.
+
+    Количество кадров в заголовке обновляется только в `flush` после того, как записи кадров
+    сброшены на диск. Поэтому при аварийном завершении файл остаётся корректным и содержит
+    все кадры, записанные до последнего вызова `flush`.
+    """
+
+    def __init__(self, path: str, header: CaptureHeader):
+        """
+        Params:
+            path: Путь к файлу. Существующий файл будет перезаписан
+            header: Метаданные файла
+        """
+        self.__header = header
+        self.__n_frames = 0
+        self.__committed = 0
+        self.__dirty = True
+        self.__file = open(path, 'wb')
+        self.__file.write(header.encode(0))
+        self.flush()
+
+    @property
+    def header(self) -> CaptureHeader:
+        return self.__header
+
+    @property
+    def n_frames(self) -> int:
+        """Количество записанных кадров"""
+        return self.__n_frames
+
+    def append(self, data: Data, timestamps: Optional[NDArray] = None) -> None:
+        """
+        Дописать кадры в конец файла
+        Args:
+            data: Кадры. Тип объекта, количество отсчётов, их тип, множитель интенсивности и длины волн
+                должны совпадать с заголовком файла
+            timestamps: Время измерения каждого кадра в секундах
+        """
+        if not self.__header.is_compatible(CaptureHeader.for_data(data)):
+            raise ValueError('Data is incompatible with the file')
+        records = make_records(self.__header, data.intensity, data.clipped, data.exposure, timestamps)
+        self.__file.write(records.tobytes())
+        self.__n_frames += data.n_times
+        self.__dirty = True
+
+    def flush(self) -> None:
+        """Сбросить записанные кадры на диск и обновить количество кадров в заголовке"""
+        if not self.__dirty:
+            return
+        f = self.__file
+        f.flush()
+        os.fsync(f.fileno())
+        self.__dirty = False
+        if self.__committed == self.__n_frames:
+            return
+        f.seek(N_FRAMES_OFFSET)
+        f.write(struct.pack('<Q', self.__n_frames))
+        f.seek(0, os.SEEK_END)
+        f.flush()
+        os.fsync(f.fileno())
+        self.__committed = self.__n_frames
+
+    def close(self) -> None:
+        """Сбросить данные на диск и закрыть файл"""
+        if self.__file.closed:
+            return
+        self.flush()
+        self.__file.close()
+
+
+def read_header(f) -> tuple[CaptureHeader, int, int]:
+    """Прочитать заголовок открытого файла. Возвращает заголовок, смещение записей и количество кадров"""
+    prefix = f.read(PREFIX.size)
+    if len(prefix) != PREFIX.size:
+        raise LoadError(f.name)
+    magic, version, meta_len, n_frames = PREFIX.unpack(prefix)
+    if magic != MAGIC or version != VERSION:
+        raise LoadError(f.name)
+    try:
+        header = CaptureHeader(**json.loads(f.read(meta_len)))
+    except (ValueError, TypeError):
+        raise LoadError(f.name)
+    return header, PREFIX.size + meta_len, n_frames
+
+
+def is_capture(path: str) -> bool:
+    """Возвращает `True`, если файл записан в этом формате"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class Capture:
+    """Файл с данными, открытый через `np.memmap`. Данные читаются с диска только при обращении к ним"""
+
+    def __init__(self, path: str):
+        """
+        Params:
+            path: Путь к файлу
+        """
+        with open(path, 'rb') as f:
+            self.__header, offset, n_frames = read_header(f)
+
+        dtype = self.__header.record_dtype()
+        if n_frames == 0:
+            self.__records = np.empty(0, dtype=dtype)
+        else:
+            self.__records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(n_frames,))
+
+    @property
+    def header(self) -> CaptureHeader:
+        return self.__header
+
+    @property
+    def n_frames(self) -> int:
+        """Количество кадров"""
+        return self.__records.shape[0]
+
+    @property
+    def intensity(self) -> NDArray:
+        """Отсчёты всех кадров (без копирования)"""
+        return self.__records['intensity']
+
+    @property
+    def clipped(self) -> PackedMask:
+        """Признаки зашкаливания всех кадров"""
+        return PackedMask(self.__records['clipped'], self.__header.n_numbers)
+
+    @property
+    def timestamps(self) -> NDArray[float]:
+        """Время измерения каждого кадра в секундах (`nan`, если неизвестно)"""
+        return self.__records['timestamp']
+
+    @property
+    def exposures(self) -> NDArray[float]:
+        """Экспозиция каждого кадра в миллисекундах"""
+        return self.__records['exposure']
+
+    @property
+    def factory_config(self):
+        """Заводские настройки устройства (`FactoryConfig`), если они были сохранены"""
+        if self.__header.factory_config is None:
+            return None
+        from .spectrometer import FactoryConfig
+        return FactoryConfig(**self.__header.factory_config)
+
+    @property
+    def wavelength(self) -> Optional[NDArray[float]]:
+        """Длины волн (только для `Spectrum`)"""
+        return None if self.__header.wavelength is None else np.array(self.__header.wavelength)
+
+    @property
+    def data(self) -> Data:
+        """Данные файла, прочитанные в память, в виде `Data` или `Spectrum` с обычными массивами `ndarray`.
+        Экспозиция берётся из заголовка, экспозиция отдельных кадров доступна в `exposures`.
+        Для обработки файлов, не помещающихся в память, используйте `lazy`"""
+        header = self.__header
+        data = Data(np.array(self.intensity), np.asarray(self.clipped), header.exposure,
+                    intensity_scale=header.intensity_scale)
+        if header.kind == 'Spectrum':
+            return data.to_spectrum(self.wavelength)
+        return data
+
+    def lazy(self) -> 'LazyData':
+        """Данные файла для отложенных вычислений (см. `pyspectrum.lazy`).
+        Кадры читаются с диска по блокам только при вычислении"""
+        from .lazy import LazyData
+        header = self.__header
+        return LazyData(self.intensity, self.clipped, header.exposure, header.intensity_scale,
+                        self.wavelength if header.kind == 'Spectrum' else None)
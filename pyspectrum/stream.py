@@ -0,0 +1,151 @@
+import queue
+import threading
+from time import monotonic
+from typing import Callable, Optional
+
+from .data import Data
+
+
+class FrameStream:
+    """Непрерывное чтение кадров со спектрометра в фоновом потоке.
+
+    Фоновый поток постоянно держит устройство занятым: следующая команда чтения отправляется сразу
+    после получения предыдущей пачки кадров, не дожидаясь, пока пользователь её обработает.
+    Если пользователь не успевает забирать данные, самые старые пачки выбрасываются, а их кадры
+    учитываются в `dropped`.
+    """
+
+    def __init__(self, read: Callable[[], Data], buffer_size: int = 16, late_tolerance: float = 0.5):
+        """
+        Params:
+            read: Функция, считывающая одну пачку кадров
+            buffer_size: Максимальное количество пачек, ожидающих обработки
+            late_tolerance: Допустимое относительное превышение ожидаемой длительности чтения пачки.
+                Ожидаемая длительность вычисляется по экспозиции каждой пачки, поэтому экспозицию можно
+                менять во время чтения. Пачки, пришедшие позже, учитываются в `late`
+        """
+        if buffer_size < 1:
+            raise ValueError('Buffer size must be positive')
+
+        self.__read = read
+        self.__late_tolerance = late_tolerance
+        self.__queue: queue.Queue = queue.Queue(buffer_size)
+        self.__stop_event = threading.Event()
+        self.__error: Optional[BaseException] = None
+        self.__finished = False
+        self.__stats_lock = threading.Lock()
+
+        self.__received = 0
+        self.__dropped = 0
+        self.__late = 0
+
+        self.__thread = threading.Thread(target=self.__run, name='FrameStream', daemon=True)
+        self.__thread.start()
+
+    # --------        statistics        --------
+
+    @property
+    def received(self) -> int:
+        """Количество кадров, считанных с устройства"""
+        return self.__received
+
+    @property
+    def dropped(self) -> int:
+        """Количество кадров, выброшенных из-за переполнения буфера"""
+        return self.__dropped
+
+    @property
+    def late(self) -> int:
+        """Количество пачек, чтение которых заняло заметно больше ожидаемого времени"""
+        return self.__late
+
+    @property
+    def is_running(self) -> bool:
+        """Возвращает `True`, пока фоновый поток читает данные"""
+        return self.__thread.is_alive()
+
+    # --------        background thread        --------
+
+    def __run(self):
+        previous = monotonic()
+        try:
+            while not self.__stop_event.is_set():
+                data = self.__read()
+                now = monotonic()
+
+                # the exposure may be changed while streaming, so it is taken from the batch itself
+                expected = data.exposure / 1000 * data.n_times
+                with self.__stats_lock:
+                    self.__received += data.n_times
+                    if now - previous > expected * (1 + self.__late_tolerance):
+                        self.__late += 1
+                previous = now
+
+                self.__put(data)
+        except BaseException as e:
+            self.__error = e
+        finally:
+            self.__put(None)
+
+    def __put(self, item: Optional[Data]):
+        while True:
+            try:
+                self.__queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    stale = self.__queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if stale is not None:
+                    with self.__stats_lock:
+                        self.__dropped += stale.n_times
+
+    # --------        consumer side        --------
+
+    def __iter__(self) -> 'FrameStream':
+        return self
+
+    def __next__(self) -> Data:
+        return self.get()
+
+    def get(self, timeout: Optional[float] = None) -> Data:
+        """
+        Получить следующую пачку кадров
+        Args:
+            timeout: Максимальное время ожидания в секундах. `None` - ждать бесконечно
+        Returns:
+            Пачка кадров в порядке поступления
+        Raises:
+            StopIteration: поток остановлен
+            TimeoutError: данные не пришли за `timeout` секунд
+        """
+        if self.__finished:
+            raise StopIteration
+        try:
+            item = self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('No frames received in time')
+
+        if item is None:
+            self.__finished = True
+            if self.__error is not None and not self.__stop_event.is_set():
+                raise self.__error
+            raise StopIteration
+        return item
+
+    def stop(self) -> None:
+        """Остановить чтение. Пачка, читаемая в данный момент, будет дочитана и выброшена"""
+        self.__stop_event.set()
+        self.__thread.join()
+        self.__finished = True
+
+    def __enter__(self) -> 'FrameStream':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __repr__(self) -> str:
+        cls = self.__class__
+        return f'{cls.__name__}({self.received = }, {self.dropped = }, {self.late = })'
@@ -125,13 +125,13 @@ setup(
     author="leadpogrommer",
     long_description="Library for communication with VMK spectrometers",
     long_description_content_type="text/plain",
-    package_data={'pyspectrum.demo': ['*']},
+    package_data={'pyspectrum.demo': ['*'], 'pyspectrum.colorimetry': ['tables/*.npy']},
     ext_modules=[CMakeExtension("cmake_example")],
     package_dir={'pyspectrum': 'pyspectrum'},
-    packages=['pyspectrum'],
+    packages=['pyspectrum', 'pyspectrum.colorimetry'],
     cmdclass={"build_ext": CMakeBuild},
     zip_safe=False,
-    extras_require={"test": ["pytest>=6.0"]},
+    extras_require={"test": ["pytest>=6.0"], "hdf5": ["h5py"], "zarr": ["zarr"]},
     python_requires=">=3.10",
     install_requires=['numpy', 'matplotlib', 'scipy'],
 )
@@ -9,6 +9,9 @@ public:
     virtual void setTimer(unsigned long millis) = 0;
     virtual unsigned int getPixelCount() = 0;
     virtual RawSpectrum readFrame(int n_times) = 0;
+    // Reads n_times frames into caller-owned buffers of
+    // n_times * getPixelCount() elements each
+    virtual void readFrameInto(int n_times, uint16_t* samples, uint8_t* clipped) = 0;
     virtual void close() = 0;
     virtual bool isOpened() = 0;
 };
\ No newline at end of file
@@ -9,18 +9,25 @@ namespace py = pybind11;
 struct RawSpectrum {
     unsigned int n_samples;
     unsigned int n_measures;
-    std::vector<int> samples;
+    std::vector<uint16_t> samples;
     std::vector<uint8_t> clipped;
 
-    py::array_t<int> pyGetSamples() {
-        return py::array_t<int>({n_measures, n_samples},
-                                {n_samples * sizeof(int), sizeof(int)},
-                                samples.data());
+    // Returned arrays are views into the vectors above. The python object
+    // owning the RawSpectrum is used as the array base, so the memory
+    // stays alive as long as any view exists and nothing is copied.
+    static py::array_t<uint16_t> pyGetSamples(py::object self) {
+        auto& spectrum = self.cast<RawSpectrum&>();
+        return py::array_t<uint16_t>(
+            {spectrum.n_measures, spectrum.n_samples},
+            {spectrum.n_samples * sizeof(uint16_t), sizeof(uint16_t)},
+            spectrum.samples.data(), self);
     }
 
-    py::array_t<uint8_t> pyGetClipped() {
+    static py::array_t<uint8_t> pyGetClipped(py::object self) {
+        auto& spectrum = self.cast<RawSpectrum&>();
         return py::array_t<uint8_t>(
-            {n_measures, n_samples},
-            {n_samples * sizeof(uint8_t), sizeof(uint8_t)}, clipped.data());
+            {spectrum.n_measures, spectrum.n_samples},
+            {spectrum.n_samples * sizeof(uint8_t), sizeof(uint8_t)},
+            spectrum.clipped.data(), self);
     }
 };
@@ -1,6 +1,7 @@
 #pragma once
 
 #include <memory>
+#include <string>
 
 class UsbContext {
 
@@ -11,8 +12,19 @@ public:
     void close();
     void setBitmode(unsigned char mask, unsigned char enable);
     void setTimeouts(int readTimeoutMillis, int writeTimeoutMillis);
-    int read(unsigned char *buf, int size);
+    // Blocks until at least one byte is available or timeoutMillis elapses.
+    // Returns the number of bytes read, 0 on timeout.
+    int read(unsigned char *buf, int size, int timeoutMillis);
     int write(unsigned char *buf, int size);
+    // Hint that the given amount of data is about to be read, so transfers
+    // for it can be queued in advance
+    void setReadAhead(size_t bytes);
+    // Drops received data that was not read yet, so it can not be taken
+    // for the reply to the next request
+    void discardInput();
+    // Same as discardInput, also clears the receive buffer of the chip.
+    // Used after a timeout, when the rest of a reply may still be queued
+    void purge();
 
 private:
     struct Private;
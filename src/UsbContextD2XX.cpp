@@ -8,6 +8,8 @@
 
 struct UsbContext::Private {
     FT_HANDLE handle;
+    int readTimeoutMillis = 0;
+    int writeTimeoutMillis = 0;
 };
 
 UsbContext::UsbContext() : p(new Private) {}
@@ -52,9 +54,18 @@ void UsbContext::setTimeouts(int readTimeoutMillis, int writeTimeoutMillis) {
     if (FT_SetTimeouts(p->handle, readTimeoutMillis, writeTimeoutMillis) != FT_OK) {
         throw std::runtime_error("Failed to set timeouts");
     }
+    p->readTimeoutMillis = readTimeoutMillis;
+    p->writeTimeoutMillis = writeTimeoutMillis;
 }
 
-int UsbContext::read(unsigned char *buf, int size) {
+int UsbContext::read(unsigned char *buf, int size, int timeoutMillis) {
+    // FT_Read sleeps in the driver until all requested bytes arrive or the
+    // read timeout elapses, so the whole wait is handed to the driver.
+    // Setting the timeout is a control transfer, so it is done only when the
+    // value differs from the last one set
+    if (timeoutMillis != p->readTimeoutMillis) {
+        setTimeouts(timeoutMillis, p->writeTimeoutMillis);
+    }
     DWORD res;
     if (FT_Read(p->handle, buf, size, &res) != FT_OK) {
         throw std::runtime_error("Device read error");
@@ -62,6 +73,28 @@ int UsbContext::read(unsigned char *buf, int size) {
     return res;
 }
 
+void UsbContext::setReadAhead(size_t bytes) {
+    // the D2XX driver keeps its own bulk requests queued
+}
+
+void UsbContext::discardInput() {
+    // there is no staging on this side, but the driver queue may still hold
+    // the tail of an earlier reply; checking it does not touch the bus
+    DWORD queued = 0;
+    if (FT_GetQueueStatus(p->handle, &queued) != FT_OK) {
+        throw std::runtime_error("Device read error");
+    }
+    if (queued > 0) {
+        purge();
+    }
+}
+
+void UsbContext::purge() {
+    if (FT_Purge(p->handle, FT_PURGE_RX) != FT_OK) {
+        throw std::runtime_error("Failed to purge device buffers");
+    }
+}
+
 int UsbContext::write(unsigned char *buf, int size) {
     DWORD res;
     if (FT_Write(p->handle, buf, size, &res) != FT_OK) {
@@ -1,15 +1,201 @@
+#include <algorithm>
+#include <array>
+#include <chrono>
+#include <cstring>
+#include <new>
 #include <stdexcept>
+#include <vector>
 
 #include <ftdi.hpp>
 
 #include "UsbContext.h"
 
+// Reads are served by a small engine of asynchronous bulk transfers. While
+// more data is expected (see setReadAhead) several transfers stay queued,
+// so the chip can stream without waiting for the host between chunks.
+static constexpr int kTransferSize = 16 * 1024;
+static constexpr int kMaxTransfers = 8;
+// every packet from the chip starts with two modem status bytes
+static constexpr int kStatusBytes = 2;
+
 struct UsbContext::Private {
+    struct Transfer {
+        Private* owner = nullptr;
+        libusb_transfer* transfer = nullptr;
+        std::vector<unsigned char> buffer;
+        bool busy = false;
+    };
+
     Ftdi::Context context;
+
+    std::array<Transfer, kMaxTransfers> transfers;
+    int inFlight = 0;
+    int error = 0;
+
+    std::vector<unsigned char> staging;
+    size_t stagingOffset = 0;
+    size_t readAhead = 0;
+
+    size_t available() const { return staging.size() - stagingOffset; }
+
+    void append(const unsigned char* data, size_t size) {
+        if (stagingOffset > 0 && stagingOffset == staging.size()) {
+            staging.clear();
+            stagingOffset = 0;
+        }
+        staging.insert(staging.end(), data, data + size);
+        readAhead -= std::min(readAhead, size);
+    }
+
+    size_t take(unsigned char* buf, size_t size) {
+        size_t n = std::min(size, available());
+        std::memcpy(buf, staging.data() + stagingOffset, n);
+        stagingOffset += n;
+        if (stagingOffset == staging.size()) {
+            staging.clear();
+            stagingOffset = 0;
+        }
+        return n;
+    }
+
+    bool wantsMore() const {
+        return static_cast<size_t>(inFlight) * kTransferSize < readAhead;
+    }
+
+    // The completion callback runs inside libusb, so nothing on its path may
+    // throw: transfers are allocated up front and failures go to `error`.
+    static void onTransferDone(libusb_transfer* transfer) noexcept;
+    void allocateTransfers();
+    void submit(Transfer& t) noexcept;
+    void submitWanted(bool atLeastOne) noexcept;
+    void handleEvents(int timeoutMillis);
+    void cancelTransfers();
+    void clearStaging();
+    void cancelAll();
 };
 
+void UsbContext::Private::onTransferDone(libusb_transfer* transfer) noexcept {
+    auto& t = *static_cast<Transfer*>(transfer->user_data);
+    auto* p = t.owner;
+    t.busy = false;
+    p->inFlight--;
+
+    if (transfer->status != LIBUSB_TRANSFER_COMPLETED &&
+        transfer->status != LIBUSB_TRANSFER_CANCELLED) {
+        p->error = LIBUSB_ERROR_IO;
+    }
+
+    const int packetSize = static_cast<int>(p->context.context()->max_packet_size);
+    try {
+        for (int offset = 0; offset < transfer->actual_length; offset += packetSize) {
+            int packetEnd = std::min(offset + packetSize, transfer->actual_length);
+            if (packetEnd - offset > kStatusBytes) {
+                p->append(transfer->buffer + offset + kStatusBytes,
+                          packetEnd - offset - kStatusBytes);
+            }
+        }
+    } catch (...) {
+        p->error = LIBUSB_ERROR_NO_MEM;
+    }
+
+    if (transfer->status == LIBUSB_TRANSFER_COMPLETED && p->error == 0) {
+        p->submitWanted(false);
+    }
+}
+
+void UsbContext::Private::allocateTransfers() {
+    // enough for every queued transfer, so the callback normally appends
+    // without reallocating (clear() keeps the capacity)
+    staging.reserve(kMaxTransfers * kTransferSize);
+    for (auto& t : transfers) {
+        if (t.transfer == nullptr) {
+            t.owner = this;
+            t.buffer.resize(kTransferSize);
+            t.transfer = libusb_alloc_transfer(0);
+            if (t.transfer == nullptr) {
+                throw std::runtime_error("Failed to allocate usb transfer");
+            }
+        }
+    }
+}
+
+void UsbContext::Private::submit(Transfer& t) noexcept {
+    auto* ftdi = context.context();
+    libusb_fill_bulk_transfer(t.transfer, ftdi->usb_dev, ftdi->out_ep,
+                              t.buffer.data(), kTransferSize, onTransferDone,
+                              &t, 0);
+    int res = libusb_submit_transfer(t.transfer);
+    if (res < 0) {
+        error = res;
+        return;
+    }
+    t.busy = true;
+    inFlight++;
+}
+
+void UsbContext::Private::submitWanted(bool atLeastOne) noexcept {
+    for (auto& t : transfers) {
+        if (!wantsMore() && (inFlight > 0 || !atLeastOne)) {
+            return;
+        }
+        if (!t.busy) {
+            submit(t);
+            if (error != 0) {
+                return;
+            }
+        }
+    }
+}
+
+void UsbContext::Private::handleEvents(int timeoutMillis) {
+    timeval tv{timeoutMillis / 1000, (timeoutMillis % 1000) * 1000};
+    int res = libusb_handle_events_timeout_completed(
+        context.context()->usb_ctx, &tv, nullptr);
+    if (res < 0 && res != LIBUSB_ERROR_INTERRUPTED) {
+        throw std::runtime_error("Device read error");
+    }
+}
+
+void UsbContext::Private::cancelTransfers() {
+    readAhead = 0;
+    for (auto& t : transfers) {
+        if (t.busy) {
+            libusb_cancel_transfer(t.transfer);
+        }
+    }
+    while (inFlight > 0) {
+        handleEvents(100);
+    }
+}
+
+void UsbContext::Private::clearStaging() {
+    staging.clear();
+    stagingOffset = 0;
+    // data left in libftdi's own buffer by earlier synchronous reads
+    auto* ftdi = context.context();
+    ftdi->readbuffer_offset += ftdi->readbuffer_remaining;
+    ftdi->readbuffer_remaining = 0;
+}
+
+void UsbContext::Private::cancelAll() {
+    cancelTransfers();
+    for (auto& t : transfers) {
+        if (t.transfer != nullptr) {
+            libusb_free_transfer(t.transfer);
+            t.transfer = nullptr;
+        }
+    }
+    clearStaging();
+    error = 0;
+}
+
 UsbContext::UsbContext() : p(new Private) {}
-UsbContext::~UsbContext() {}
+UsbContext::~UsbContext() {
+    try {
+        p->cancelAll();
+    } catch (...) {
+    }
+}
 
 void UsbContext::open(int vendor, int product, const std::string& serial) {
     if (p->context.open(vendor, product,  std::string(), serial, 0) < 0) {
@@ -18,6 +204,7 @@ void UsbContext::open(int vendor, int product, const std::string& serial) {
 }
 
 void UsbContext::close() {
+    p->cancelAll();
     if (p->context.close() < 0) {
         throw std::runtime_error("Failed to close device");
     }
@@ -34,12 +221,67 @@ void UsbContext::setTimeouts(int readTimeoutMillis, int writeTimeoutMillis) {
     p->context.set_usb_write_timeout(writeTimeoutMillis);
 }
 
-int UsbContext::read(unsigned char *buf, int size) {
-    int res = p->context.read(buf, size);
-    if (res < 0) {
-        throw std::runtime_error("Device read error");
+void UsbContext::setReadAhead(size_t bytes) {
+    p->readAhead = bytes > p->available() ? bytes - p->available() : 0;
+}
+
+void UsbContext::discardInput() {
+    // transfers still in flight are kept: the chip sends nothing between
+    // requests, so whatever they receive belongs to the next reply
+    p->clearStaging();
+}
+
+void UsbContext::purge() {
+    p->cancelTransfers();
+    p->clearStaging();
+    p->error = 0;
+    if (p->context.flush(Ftdi::Context::Input) < 0) {
+        throw std::runtime_error("Failed to purge device buffers");
     }
-    return res;
+}
+
+int UsbContext::read(unsigned char *buf, int size, int timeoutMillis) {
+    using clock = std::chrono::steady_clock;
+    const auto deadline = clock::now() + std::chrono::milliseconds(timeoutMillis);
+
+    // data left in libftdi's own buffer by earlier synchronous reads
+    auto* ftdi = p->context.context();
+    if (ftdi->readbuffer_remaining > 0) {
+        p->staging.insert(p->staging.end(),
+                          ftdi->readbuffer + ftdi->readbuffer_offset,
+                          ftdi->readbuffer + ftdi->readbuffer_offset +
+                              ftdi->readbuffer_remaining);
+        ftdi->readbuffer_offset += ftdi->readbuffer_remaining;
+        ftdi->readbuffer_remaining = 0;
+    }
+
+    p->allocateTransfers();
+
+    // Events are handled in libusb's poll, so waiting costs no CPU. When the
+    // chip has no data it still completes a transfer with a status-only
+    // packet every latency timer period, and the transfer is resubmitted.
+    // Errors from the completion callback are thrown here, on the reading
+    // thread, once handleEvents has returned.
+    while (p->available() == 0) {
+        if (p->error != 0) {
+            int error = p->error;
+            p->error = 0;
+            if (error == LIBUSB_ERROR_NO_MEM) {
+                throw std::bad_alloc();
+            }
+            throw std::runtime_error("Device read error");
+        }
+        p->submitWanted(true);
+
+        auto remaining = std::chrono::duration_cast<std::chrono::milliseconds>(
+                             deadline - clock::now()).count();
+        if (remaining <= 0) {
+            return 0;
+        }
+        p->handleEvents(static_cast<int>(remaining));
+    }
+
+    return static_cast<int>(p->take(buf, size));
 }
 
 int UsbContext::write(unsigned char *buf, int size) {
@@ -48,4 +290,4 @@ int UsbContext::write(unsigned char *buf, int size) {
         throw std::runtime_error("Device write error");
     }
     return res;
-}
\ No newline at end of file
+}
@@ -1,4 +1,5 @@
 #include "UsbRawSpectrometer.h"
+#include <algorithm>
 #include <chrono>
 
 UsbRawSpectrometer::UsbRawSpectrometer(int vendor, int product, std::string serial, int64_t readTimeout)
@@ -14,6 +15,7 @@ UsbRawSpectrometer::UsbRawSpectrometer(int vendor, int product, std::string seri
 // 10 bits for significand
 // 2 bits for exponent
 void UsbRawSpectrometer::setTimer(unsigned long millis) {
+    std::lock_guard<std::mutex> lock(mutex);
     millis *= 10;
     int exponent = 0;
     while (millis >= (1 << 10)) {
@@ -31,29 +33,35 @@ void UsbRawSpectrometer::setTimer(unsigned long millis) {
 unsigned int UsbRawSpectrometer::getPixelCount() { return pixel_number; }
 
 RawSpectrum UsbRawSpectrometer::readFrame(int n_times) {
+    const size_t count = static_cast<size_t>(n_times) * pixel_number;
     RawSpectrum ret{
         getPixelCount(),
         static_cast<unsigned int>(n_times),
-        std::vector<int>(n_times * pixel_number),
-        std::vector<uint8_t>(n_times * pixel_number),
+        std::vector<uint16_t>(count),
+        std::vector<uint8_t>(count),
     };
-    std::vector<uint16_t> data(pixel_number * n_times);
+    readFrameInto(n_times, ret.samples.data(), ret.clipped.data());
+    return ret;
+}
 
-    sendCommand(COMMAND_READ_FRAME, n_times);
-    readData(reinterpret_cast<uint8_t*>(data.data()),
-             pixel_number * n_times * 2);
+void UsbRawSpectrometer::readFrameInto(int n_times, uint16_t* samples, uint8_t* clipped) {
+    std::lock_guard<std::mutex> lock(mutex);
+    const size_t count = static_cast<size_t>(n_times) * pixel_number;
 
-    std::transform(data.begin(), data.end(), ret.samples.begin(),
-                   [](uint16_t n) { return n ^ (1 << 15); });
-    std::transform(ret.samples.begin(), ret.samples.end(), ret.clipped.begin(),
-                   [](uint16_t n) { return n == UINT16_MAX; });
+    sendCommand(COMMAND_READ_FRAME, n_times);
+    readData(reinterpret_cast<uint8_t*>(samples), count * sizeof(uint16_t));
 
-    return ret;
+    for (size_t i = 0; i < count; i++) {
+        uint16_t n = samples[i] ^ (1 << 15);
+        samples[i] = n;
+        clipped[i] = n == UINT16_MAX;
+    }
 }
 
 DeviceReply UsbRawSpectrometer::sendCommand(uint8_t code, uint32_t data) {
     DeviceCommand command = {
         {'#', 'C', 'M', 'D'}, code, 4, sequenceNumber++, data};
+    context.discardInput();
     context.write(reinterpret_cast<unsigned char*>(&command),
                   sizeof(DeviceCommand));
     DeviceReply reply{};
@@ -65,6 +73,19 @@ DeviceReply UsbRawSpectrometer::sendCommand(uint8_t code, uint32_t data) {
 }
 
 void UsbRawSpectrometer::readData(uint8_t* buffer, size_t amount) {
+    // the read-ahead hint must not outlive this read, even if it throws
+    struct ReadAheadGuard {
+        UsbContext& context;
+        ~ReadAheadGuard() { context.setReadAhead(0); }
+    } guard{context};
+    // every chunk comes with its own header; the chunk size is not known
+    // until the first header arrives, so the estimate is refined after it
+    size_t chunkSize = std::max<size_t>(amount, 1);
+    auto expectedBytes = [&](size_t remaining) {
+        size_t chunks = (remaining + chunkSize - 1) / chunkSize;
+        return remaining + chunks * sizeof(DeviceDataHeader);
+    };
+    context.setReadAhead(expectedBytes(amount));
     size_t dataRead = 0;
     while (dataRead < amount) {
         DeviceDataHeader header{};
@@ -77,29 +98,44 @@ void UsbRawSpectrometer::readData(uint8_t* buffer, size_t amount) {
         }
         readExactly(buffer + dataRead, header.length);
         dataRead += header.length;
+        chunkSize = std::max<size_t>(header.length, 1);
+        context.setReadAhead(expectedBytes(amount - dataRead));
     }
 }
 
-static int64_t getCurrentTime() {
-    return std::chrono::duration_cast<std::chrono::milliseconds>(
-               std::chrono::system_clock::now().time_since_epoch())
-        .count();
-}
-
 void UsbRawSpectrometer::readExactly(uint8_t* buff, int amount) {
+    using clock = std::chrono::steady_clock;
+    const auto timeout = std::chrono::milliseconds(readTimeout);
+    // the timeout is counted from the last time any data was received
+    auto deadline = clock::now() + timeout;
+
+    // Right after data was received the whole timeout is passed as is, so it
+    // stays the same from read to read and the D2XX backend does not have to
+    // reconfigure the driver. Only a wait that already failed is shortened.
+    int64_t wait = readTimeout;
     int wasRead = 0;
-    int64_t lastSuccessfulRead = getCurrentTime();
     while (wasRead != amount) {
-        int chunkSize = context.read(buff + wasRead, amount - wasRead);
-        wasRead += chunkSize;
-        int64_t currentTime = getCurrentTime();
-        if (currentTime - lastSuccessfulRead > readTimeout) {
+        int chunkSize = context.read(buff + wasRead, amount - wasRead,
+                                     static_cast<int>(wait));
+        if (chunkSize > 0) {
+            wasRead += chunkSize;
+            deadline = clock::now() + timeout;
+            wait = readTimeout;
+            continue;
+        }
+        wait = std::chrono::duration_cast<std::chrono::milliseconds>(
+                   deadline - clock::now()).count();
+        if (wait <= 0) {
+            // the rest of the reply may still arrive and must not be read
+            // as the reply to the next request
+            context.purge();
             throw std::runtime_error("Device read timeout");
         }
     }
 }
 
 void UsbRawSpectrometer::close() {
+    std::lock_guard<std::mutex> lock(mutex);
     context.close();
     opened = false;
 }
@@ -1,5 +1,7 @@
 #pragma once
 
+#include <mutex>
+
 #include "RawSpectrometer.h"
 #include "UsbContext.h"
 
@@ -45,6 +47,8 @@ public:
 
     RawSpectrum readFrame(int n_times) override;
 
+    void readFrameInto(int n_times, uint16_t* samples, uint8_t* clipped) override;
+
     void close() override;
 
     bool isOpened() override;
@@ -55,6 +59,8 @@ private:
     uint16_t sequenceNumber = 1;
     UsbContext context;
     bool opened = true;
+    // Python bindings release the GIL, so calls may come from several threads
+    std::mutex mutex;
 
     void readExactly(uint8_t* buff, int amount);
     DeviceReply sendCommand(uint8_t code, uint32_t data);
@@ -1,20 +1,46 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 
 #include "UsbRawSpectrometer.h"
 
 namespace py = pybind11;
 
+using SamplesArray = py::array_t<uint16_t, py::array::c_style>;
+using ClippedArray = py::array_t<bool, py::array::c_style>;
+
+static void readFrameInto(RawSpectrometer& device, SamplesArray samples,
+                          ClippedArray clipped) {
+    if (samples.ndim() != 2 || samples.shape(1) != device.getPixelCount()) {
+        throw std::invalid_argument(
+            "samples must have shape (n_times, pixel_count)");
+    }
+    if (clipped.ndim() != 2 || clipped.shape(0) != samples.shape(0) ||
+        clipped.shape(1) != samples.shape(1)) {
+        throw std::invalid_argument("clipped must have the same shape as samples");
+    }
+    py::gil_scoped_release release;
+    device.readFrameInto(static_cast<int>(samples.shape(0)),
+                         samples.mutable_data(),
+                         reinterpret_cast<uint8_t*>(clipped.mutable_data()));
+}
+
 PYBIND11_MODULE(PYMODULE_NAME, m) {
     py::class_<RawSpectrometer>(m, "RawSpectrometer")
-        .def("readFrame", &RawSpectrometer::readFrame)
+        .def("readFrame", &RawSpectrometer::readFrame,
+             py::call_guard<py::gil_scoped_release>())
+        .def("readFrameInto", &readFrameInto, py::arg("samples").noconvert(),
+             py::arg("clipped").noconvert())
         .def("getPixelCount", &RawSpectrometer::getPixelCount)
-        .def("setTimer", &RawSpectrometer::setTimer)
-        .def("close", &RawSpectrometer::close)
+        .def("setTimer", &RawSpectrometer::setTimer,
+             py::call_guard<py::gil_scoped_release>())
+        .def("close", &RawSpectrometer::close,
+             py::call_guard<py::gil_scoped_release>())
         .def_property_readonly("isOpened", &RawSpectrometer::isOpened);
 
     py::class_<UsbRawSpectrometer, RawSpectrometer>(m, "UsbRawSpectrometer")
-        .def(pybind11::init<int, int, std::string, int>());
+        .def(pybind11::init<int, int, std::string, int>(),
+             py::call_guard<py::gil_scoped_release>());
 
     py::class_<RawSpectrum>(m, "RawSpectrum")
         .def_property_readonly("samples", &RawSpectrum::pyGetSamples)
@@ -0,0 +1,168 @@
+// UsbRawSpectrometer against a scripted device. The UsbContext below stands
+// in for the USB backends: bytes written by the device are queued on the
+// host side until read, like the staging buffer of the libftdi backend.
+
+#include <algorithm>
+#include <chrono>
+#include <cstring>
+#include <deque>
+#include <iostream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+
+#include "UsbRawSpectrometer.h"
+
+static constexpr int kPixels = 0x1006;
+static constexpr int kChunkSize = 4096;
+static constexpr int64_t kReadTimeout = 50;
+
+struct FakeDevice {
+    // received by the host, not read yet
+    std::deque<unsigned char> input;
+    // sent by the device only after the host gave up waiting
+    std::deque<unsigned char> late;
+    // frame bytes (headers included) sent before the device stalls, -1 for all
+    long stallAfter = -1;
+    // timeouts passed to every read
+    std::vector<int> readTimeouts;
+
+    void send(const void* data, size_t size) {
+        auto bytes = static_cast<const unsigned char*>(data);
+        input.insert(input.end(), bytes, bytes + size);
+    }
+
+    void onCommand(const DeviceCommand& command) {
+        DeviceReply reply{{'#', 'A', 'N', 'S'}, static_cast<char>(command.code), 2,
+                          command.sequenceNumber, 0};
+        send(&reply, sizeof(reply));
+        if (command.code == COMMAND_READ_FRAME) {
+            sendFrame(command.data);
+        }
+    }
+
+    void sendFrame(uint32_t n_times) {
+        std::deque<unsigned char> frame;
+        size_t amount = static_cast<size_t>(n_times) * kPixels * sizeof(uint16_t);
+        for (size_t offset = 0; offset < amount; offset += kChunkSize) {
+            uint16_t length = static_cast<uint16_t>(std::min<size_t>(kChunkSize, amount - offset));
+            DeviceDataHeader header{{'#', 'D', 'A', 'T'}, length};
+            auto bytes = reinterpret_cast<unsigned char*>(&header);
+            frame.insert(frame.end(), bytes, bytes + sizeof(header));
+            for (size_t i = offset / 2; i < (offset + length) / 2; i++) {
+                uint16_t sample = static_cast<uint16_t>(i % kPixels) ^ (1 << 15);
+                frame.push_back(sample & 0xff);
+                frame.push_back(sample >> 8);
+            }
+        }
+        size_t now = stallAfter < 0 ? frame.size() : static_cast<size_t>(stallAfter);
+        input.insert(input.end(), frame.begin(), frame.begin() + now);
+        late.insert(late.end(), frame.begin() + now, frame.end());
+        stallAfter = -1;
+    }
+};
+
+static FakeDevice device;
+
+struct UsbContext::Private {};
+
+UsbContext::UsbContext() : p(new Private) {}
+UsbContext::~UsbContext() {}
+void UsbContext::open(int, int, const std::string&) {}
+void UsbContext::close() {}
+void UsbContext::setBitmode(unsigned char, unsigned char) {}
+void UsbContext::setTimeouts(int, int) {}
+void UsbContext::setReadAhead(size_t) {}
+
+int UsbContext::read(unsigned char *buf, int size, int timeoutMillis) {
+    device.readTimeouts.push_back(timeoutMillis);
+    if (device.input.empty()) {
+        std::this_thread::sleep_for(std::chrono::milliseconds(timeoutMillis));
+        device.input.insert(device.input.end(), device.late.begin(), device.late.end());
+        device.late.clear();
+        return 0;
+    }
+    int n = std::min<int>(size, static_cast<int>(device.input.size()));
+    std::copy(device.input.begin(), device.input.begin() + n, buf);
+    device.input.erase(device.input.begin(), device.input.begin() + n);
+    return n;
+}
+
+int UsbContext::write(unsigned char *buf, int size) {
+    DeviceCommand command{};
+    std::memcpy(&command, buf, sizeof(command));
+    device.onCommand(command);
+    return size;
+}
+
+void UsbContext::discardInput() {
+    device.input.clear();
+}
+
+void UsbContext::purge() {
+    device.input.clear();
+    device.late.clear();
+}
+
+static int failures = 0;
+
+static void check(bool condition, const std::string& message) {
+    if (!condition) {
+        std::cerr << "FAILED: " << message << std::endl;
+        failures++;
+    }
+}
+
+static bool frameIsValid(const RawSpectrum& frame) {
+    for (size_t i = 0; i < frame.samples.size(); i++) {
+        if (frame.samples[i] != i % kPixels) {
+            return false;
+        }
+    }
+    return true;
+}
+
+static void testRead() {
+    UsbRawSpectrometer spectrometer(0x0403, 0x6014, "", kReadTimeout);
+    device.readTimeouts.clear();
+    check(frameIsValid(spectrometer.readFrame(2)), "frame is read");
+    // a changed timeout costs the D2XX backend a control transfer
+    bool sameTimeout = std::all_of(device.readTimeouts.begin(), device.readTimeouts.end(),
+                                   [](int t) { return t == kReadTimeout; });
+    check(sameTimeout, "read timeout does not change while data arrives");
+}
+
+static void testReadAfterTimeout() {
+    UsbRawSpectrometer spectrometer(0x0403, 0x6014, "", kReadTimeout);
+    device.stallAfter = 3 * (kChunkSize + sizeof(DeviceDataHeader)) / 2;
+    bool timedOut = false;
+    try {
+        spectrometer.readFrame(1);
+    } catch (const std::runtime_error&) {
+        timedOut = true;
+    }
+    check(timedOut, "stalled frame times out");
+
+    // the tail of the stalled frame must not be taken for the next replies
+    spectrometer.setTimer(10);
+    check(frameIsValid(spectrometer.readFrame(1)), "frame after a timeout is read");
+}
+
+static void testStaleInputBeforeRequest() {
+    UsbRawSpectrometer spectrometer(0x0403, 0x6014, "", kReadTimeout);
+    const char stale[] = "#DAT";
+    device.send(stale, sizeof(stale));
+    check(frameIsValid(spectrometer.readFrame(1)), "stale input is dropped before a request");
+}
+
+int main() {
+    testRead();
+    testReadAfterTimeout();
+    testStaleInputBeforeRequest();
+    if (failures > 0) {
+        return 1;
+    }
+    std::cout << "OK" << std::endl;
+    return 0;
+}
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from pyspectrum import Spectrum
+from pyspectrum.colorimetry import Colorimeter, LedAnalyzer, blackbody, flicker
+from pyspectrum.colorimetry import data
+
+
+def make_spectrum(intensity):
+    intensity = np.atleast_2d(intensity)
+    return Spectrum(intensity, np.zeros(intensity.shape, dtype=bool), 10, np.linspace(350, 850, intensity.shape[1]))
+
+
+@pytest.mark.parametrize('illuminant', ['E', 'D65'])
+def test_white_sample(illuminant):
+    reference = make_spectrum(np.full(1000, 2.0))
+    colorimeter = Colorimeter(reference, illuminant)
+
+    colors = colorimeter.measure(make_spectrum(np.full((3, 1000), 2.0)))
+    assert colors.XYZ().shape == (3, 3)
+    white = data.ILLUMINANT_WHITE_POINT[illuminant]['2deg']
+    assert np.allclose(colors.XYZ(), white, rtol=1e-2)
+    assert np.allclose(colors.Lab(), [100, 0, 0], atol=1)
+
+
+@pytest.mark.parametrize('illuminant, expected', [
+    ('E', [0.3327, 0.3333, 0.3320]),
+    ('D65', [0.3164, 0.3333, 0.3620]),
+])
+def test_gray_sample_400_700(illuminant, expected):
+    # values of the step integration; the example before it gave (0.3164, 0.3333, 0.3412) for E
+    # and (0.3043, 0.3333, 0.3692) for D65, because the last sample was weighted by -700 nm
+    wavelength = np.linspace(400, 700, 301)
+
+    def spectrum(intensity):
+        return Spectrum(np.atleast_2d(intensity), np.zeros((1, 301), dtype=bool), 10, wavelength)
+
+    colorimeter = Colorimeter(spectrum(np.ones(301)), illuminant)
+    XYZ = colorimeter.measure(spectrum(np.full(301, 1 / 3))).XYZ()[0]
+    assert XYZ == pytest.approx(expected, abs=1e-4)
+
+
+def test_frames_are_independent():
+    reference = make_spectrum(np.ones(1000))
+    colorimeter = Colorimeter(reference, 'D65')
+
+    rng = np.random.default_rng(0)
+    spectrum = make_spectrum(rng.uniform(0, 1, (10, 1000)))
+    colors = colorimeter.measure(spectrum)
+    for i in [0, 5, 9]:
+        single = colorimeter.measure(spectrum[i:i + 1])
+        assert np.allclose(single.Luv(), colors[i].Luv())
+        assert np.allclose(single.RGB('sRGB'), colors.RGB('sRGB')[i])
+
+
+@pytest.mark.parametrize('temperature', [2700, 4000, 6500])
+def test_led_blackbody(temperature):
+    wavelength = np.linspace(850, 350, 1000)
+    analyzer = LedAnalyzer(wavelength)
+    spectrum = blackbody(wavelength, temperature)
+
+    assert analyzer.cct(spectrum)[0] == pytest.approx(temperature, rel=0.01)
+    rendering = analyzer.color_rendering(spectrum)
+    assert rendering.special.shape == (1, 14)
+    assert rendering.is_valid[0]
+    assert rendering.general[0] > 99
+
+
+def test_led_frames_are_independent():
+    wavelength = np.linspace(350, 850, 1000)
+    analyzer = LedAnalyzer(wavelength)
+    led = np.exp(-0.5 * ((wavelength - 450) / 10) ** 2) + 2.5 * np.exp(-0.5 * ((wavelength - 580) / 50) ** 2)
+    frames = led * np.linspace(0.5, 1.5, 10)[:, None]
+
+    rendering = analyzer.color_rendering(frames)
+    power = analyzer.luminous_power(frames)
+    for i in [0, 5, 9]:
+        assert np.allclose(analyzer.color_rendering(frames[i]).special, rendering.special[i])
+        assert analyzer.luminous_power(frames[i])[0] == pytest.approx(power[i])
+    # CRI does not depend on the brightness of the source
+    assert np.allclose(rendering.general, rendering.general[0])
+    # Ra only averages the first eight samples
+    assert np.allclose(rendering.general, rendering.special[:, :8].mean(axis=1))
+    assert np.allclose(rendering.mean_special, rendering.special.mean(axis=1))
+    assert not np.allclose(rendering.general, rendering.mean_special)
+    assert np.allclose(power, power[0] * np.linspace(1, 3, 10))
+
+
+def test_flicker():
+    frame_period = 0.25e-3
+    t = np.arange(1000) * frame_period
+    power = 1 + 0.5 * np.sin(2 * np.pi * 100 * t)
+
+    result = flicker(power, frame_period)
+    assert result.percent_flicker == pytest.approx(50, rel=1e-3)
+    assert result.flicker_index == pytest.approx(0.5 / np.pi, rel=1e-2)
+    assert result.dominant_frequency == pytest.approx(100)
+
+    wavelength = np.linspace(350, 850, 100)
+    frames = power[:, None] * blackbody(wavelength, 3000)
+    analyzer = LedAnalyzer(wavelength)
+    assert analyzer.flicker(frames, frame_period).percent_flicker == pytest.approx(50, rel=1e-3)
+
+
+def test_tables():
+    assert list(data.OBSERVER_SENSITIVITY) == ['2deg', '10deg']
+    observer = data.OBSERVER_SENSITIVITY['2deg']
+    assert observer.dtype.names == ('wavelength', 'X', 'Y', 'Z')
+    assert observer['wavelength'][0] == 360 and observer['wavelength'][-1] == 830
+    assert not observer.flags.writeable
+    assert data.TEST_COLOR_SAMPLES['reflectance'].shape == (14, len(data.TEST_COLOR_SAMPLES['wavelength']))
+
+    white = data.ILLUMINANT_WHITE_POINT['E']['2deg']
+    assert white is data.ILLUMINANT_WHITE_POINT['E']['2deg']
+    assert np.allclose(white, 1, atol=1e-3)
@@ -0,0 +1,492 @@
+import asyncio
+import contextlib
+import struct
+from collections import deque
+from socket import SOCK_DGRAM, MSG_WAITALL, timeout as socket_timeout
+
+import numpy as np
+import pytest
+
+from pyspectrum import (
+    ethernet_device, DeviceError, DeviceTimeoutError, DeviceClosedError, Spectrometer, EthernetID, FactoryConfig, AsyncSpectrometer,
+)
+from pyspectrum.ethernet_device import (
+    EthernetDevice, AsyncEthernetDevice, check_header, CMD_READ_INI, CMD_READ_MULTILINE, CMD_SET_LINE_LENGTH, CMD_SET_TIMER, measurement_header,
+)
+
+NUM_PIXELS = 16
+
+
+class FakeUdpSocket:
+    def __init__(self, device: 'FakeDevice'):
+        self.device = device
+        self.inbox = deque()
+
+    def settimeout(self, _):
+        pass
+
+    def sendto(self, packet, _):
+        self.device.handle(packet)
+
+    def recvfrom(self, _):
+        if not self.inbox:
+            raise socket_timeout()
+        return self.inbox.popleft(), None
+
+    def close(self):
+        pass
+
+
+class FakeTcpSocket:
+    def __init__(self, max_recv: int):
+        self.max_recv = max_recv
+        self.stream = bytearray()
+
+    def connect(self, _):
+        pass
+
+    def recv_into(self, buffer, n_bytes=0, flags=0):
+        view = memoryview(buffer).cast('B')
+        n_bytes = n_bytes or len(view)
+        if not flags & MSG_WAITALL:
+            n_bytes = min(n_bytes, self.max_recv, len(self.stream))
+        assert n_bytes <= len(self.stream)
+        view[:n_bytes] = self.stream[:n_bytes]
+        del self.stream[:n_bytes]
+        return n_bytes
+
+    def close(self):
+        pass
+
+
+class FakeDevice:
+    """Ethernet spectrometer answering commands through fake sockets"""
+
+    def __init__(self, max_recv: int = 1 << 20):
+        self.udp = FakeUdpSocket(self)
+        self.tcp = FakeTcpSocket(max_recv)
+        self.sent: list[int] = []
+        # opcode -> number of commands to ignore
+        self.drop: dict[int, int] = {}
+        # opcode -> response code
+        self.errors: dict[int, int] = {}
+        # replies are kept until `release` is called
+        self.hold = False
+        self.held: list[bytes] = []
+        self.n_frames = 0
+        # called with every batch of frames before it is sent
+        self.frame_hook = None
+
+    def reply(self, code, opcode, seq, payload=b''):
+        return struct.pack('<H2xHH', code, opcode, seq) + payload
+
+    def handle(self, packet):
+        opcode, seq = struct.unpack('<HH', packet[:4])
+        self.sent.append(opcode)
+        if self.drop.get(opcode, 0) > 0:
+            self.drop[opcode] -= 1
+            return
+
+        replies = [self.reply(self.errors.get(opcode, 0), opcode, seq)]
+        if opcode == CMD_READ_INI:
+            ini = struct.pack('<B3xHHBBxBHHIBBff', 1, NUM_PIXELS, 1, 1, 0, 0, 5, 0, NUM_PIXELS, 0, 0, 0.0, 0.0)
+            replies.append(self.reply(0, opcode, seq, ini))
+        elif opcode == CMD_READ_MULTILINE:
+            n_times = struct.unpack('<H2xI', packet[4:12])[1]
+            self.tcp.stream += self.frames(n_times).tobytes()
+
+        if self.hold:
+            self.held += replies
+        else:
+            self.udp.inbox.extend(replies)
+
+    def release(self, reverse=False):
+        self.udp.inbox.extend(reversed(self.held) if reverse else self.held)
+        self.held = []
+        self.hold = False
+
+    def frames(self, n_times):
+        frames = np.zeros((n_times, NUM_PIXELS), dtype=np.uint16)
+        frames[:, :len(measurement_header)] = measurement_header
+        frames[:, len(measurement_header):] = np.arange(self.n_frames, self.n_frames + n_times)[:, None]
+        self.n_frames += n_times
+        if self.frame_hook is not None:
+            self.frame_hook(frames)
+        return frames
+
+
+@pytest.fixture()
+def fake(monkeypatch) -> FakeDevice:
+    fake = FakeDevice()
+    monkeypatch.setattr(ethernet_device, 'socket', lambda _, kind: fake.udp if kind == SOCK_DGRAM else fake.tcp)
+    return fake
+
+
+@pytest.fixture()
+def device(fake) -> EthernetDevice:
+    device = EthernetDevice('127.0.0.1', retries=2)
+    fake.sent.clear()
+    return device
+
+
+def test_read_ini(fake):
+    device = EthernetDevice('127.0.0.1')
+    assert device.ini.num_pixels == NUM_PIXELS
+    assert device.getMinExposure() == pytest.approx(0.5)
+    assert device.getPixelCount() == NUM_PIXELS - len(measurement_header)
+
+
+def test_pipelined_out_of_order(fake, device):
+    fake.hold = True
+    first = device.submit(CMD_SET_TIMER, struct.pack('<H2xH', 10, 0))
+    second = device.submit(CMD_SET_LINE_LENGTH, struct.pack('<IH', NUM_PIXELS, 1))
+    fake.release(reverse=True)
+
+    assert len(device.collect(first)) == 1
+    assert len(device.collect(second)) == 1
+    assert not device.pending
+    assert fake.sent == [CMD_SET_TIMER, CMD_SET_LINE_LENGTH]
+
+
+def test_retransmit(fake, device):
+    fake.drop[CMD_SET_TIMER] = 2
+    device.setTimer(10)
+    assert fake.sent == [CMD_SET_TIMER] * 3
+
+
+def test_timeout(fake, device):
+    fake.drop[CMD_SET_TIMER] = 10
+    with pytest.raises(DeviceTimeoutError):
+        device.setTimer(10)
+    assert fake.sent == [CMD_SET_TIMER] * 3
+    assert CMD_SET_TIMER not in device.state
+    assert not device.pending
+
+
+def test_multi_packet_retransmit(fake, device):
+    # only the data packet of the first attempt arrives, it is dropped and the reply is assembled from the retransmit
+    fake.hold = True
+    seq = device.submit(CMD_READ_INI, bytes([0]), ext_packets=1)
+    fake.udp.inbox.append(fake.held[1])
+    fake.held = []
+    fake.hold = False
+    payloads = device.collect(seq)
+    assert fake.sent == [CMD_READ_INI] * 2
+    assert len(payloads[0]) == 0 and len(payloads[1]) > 0
+
+
+def test_state_cache(fake, device):
+    device.setTimer(10)
+    device.setTimer(10)
+    assert fake.sent == [CMD_SET_TIMER]
+    device.setTimer(20)
+    assert fake.sent == [CMD_SET_TIMER] * 2
+
+
+def test_error_for_other_command(fake, device):
+    device.setTimer(10)
+    device.set_state(CMD_SET_LINE_LENGTH, struct.pack('<IH', NUM_PIXELS, 1))
+    fake.errors[CMD_SET_LINE_LENGTH] = 3
+
+    failing = device.submit(CMD_SET_LINE_LENGTH, struct.pack('<IH', NUM_PIXELS, 2))
+    other = device.submit(CMD_SET_TIMER, struct.pack('<H2xH', 20, 0))
+    device.collect(other)
+    with pytest.raises(Exception, match='response code'):
+        device.collect(failing)
+    assert CMD_SET_TIMER in device.state
+    assert CMD_SET_LINE_LENGTH not in device.state
+
+
+def test_read_not_sent_after_failed_config(fake, device):
+    fake.errors[CMD_SET_LINE_LENGTH] = 3
+    with pytest.raises(Exception, match='response code'):
+        device.readFrame(2)
+    assert CMD_READ_MULTILINE not in fake.sent
+    assert not fake.tcp.stream
+
+
+def test_read_frame(fake, device):
+    frame = device.readFrame(3)
+    assert fake.sent == [CMD_SET_LINE_LENGTH, CMD_READ_MULTILINE]
+    assert frame.samples.shape == (3, NUM_PIXELS - len(measurement_header))
+    assert np.all(frame.samples == np.arange(3)[:, None])
+
+    device.readFrame(3)
+    assert fake.sent == [CMD_SET_LINE_LENGTH] + [CMD_READ_MULTILINE] * 2
+
+
+def test_check_header():
+    frames = FakeDevice().frames(100)
+    check_header(frames)
+    frames[57, 3] ^= 1
+    with pytest.raises(Exception, match='header'):
+        check_header(frames)
+
+
+def test_corrupted_header(fake, device):
+    def corrupt(frames):
+        frames[4, 0] = 1
+
+    fake.frame_hook = corrupt
+    with pytest.raises(Exception, match='header'):
+        device.readFrame(8)
+
+
+def test_clipped(fake, device):
+    def saturate(frames):
+        frames[1, len(measurement_header) + 2] = np.iinfo(np.uint16).max
+        frames[2, -1] = np.iinfo(np.uint16).max
+
+    fake.frame_hook = saturate
+    frame = device.readFrame(3)
+    assert frame.clipped.dtype == bool
+    expected = np.zeros(frame.samples.shape, dtype=bool)
+    expected[1, 2] = expected[2, -1] = True
+    assert np.array_equal(frame.clipped, expected)
+
+    fake.frame_hook = saturate
+    samples = np.empty(frame.samples.shape, dtype=np.uint16)
+    clipped = np.empty(frame.samples.shape, dtype=bool)
+    device.readFrameInto(samples, clipped)
+    assert np.array_equal(clipped, expected)
+
+
+@pytest.fixture()
+def fragmented(monkeypatch) -> FakeDevice:
+    # the stream arrives in pieces that do not line up with frame boundaries
+    fake = FakeDevice(max_recv=NUM_PIXELS * 2 + 8)
+    monkeypatch.setattr(ethernet_device, 'socket', lambda _, kind: fake.udp if kind == SOCK_DGRAM else fake.tcp)
+    return fake
+
+
+def test_iter_frames(fragmented):
+    device = EthernetDevice('127.0.0.1')
+    chunks = [np.array(frames.samples) for frames in device.iterFrames(10, chunk_frames=3)]
+    assert all(1 <= len(chunk) <= 3 for chunk in chunks)
+    samples = np.concatenate(chunks)
+    assert np.array_equal(samples[:, 0], np.arange(10))
+    assert not fragmented.tcp.stream
+
+
+def test_iter_frames_abandoned(fragmented):
+    device = EthernetDevice('127.0.0.1')
+    frames = device.iterFrames(10, chunk_frames=3)
+    first = next(frames)
+    assert len(first.samples) == 1
+    # part of the second frame is already received
+    assert len(fragmented.tcp.stream) == 10 * NUM_PIXELS * 2 - (NUM_PIXELS * 2 + 8)
+    frames.close()
+    assert not fragmented.tcp.stream
+
+    assert np.all(device.readFrame(2).samples == np.arange(10, 12)[:, None])
+
+
+def test_iter_raw_copies_chunks(fragmented):
+    spectrometer = Spectrometer(EthernetID('127.0.0.1'), FactoryConfig(0, 10, False, 1.0))
+    spectrometer.set_config(raw_counts=True)
+    chunks = list(spectrometer.iter_raw(10, chunk_frames=1))
+    assert len(chunks) == 10
+    assert all(np.all(chunk.intensity == i) for i, chunk in enumerate(chunks))
+
+
+def test_iter_raw_reentry(fragmented):
+    spectrometer = Spectrometer(EthernetID('127.0.0.1'), FactoryConfig(0, 10, False, 1.0))
+    chunks = spectrometer.iter_raw(10, chunk_frames=1)
+    assert np.all(next(chunks).intensity == 0)
+    # the same thread must not use the device while the stream is suspended
+    with pytest.raises(DeviceError):
+        spectrometer.read_raw(1)
+    with pytest.raises(DeviceError):
+        spectrometer.set_config(exposure=20)
+    assert spectrometer.config.exposure == 10
+    assert np.all(next(chunks).intensity == 1)
+
+    chunks.close()
+    assert np.all(spectrometer.read_raw(1).intensity == 10)
+
+
+class FakeServer(asyncio.DatagramProtocol):
+    """Serves `FakeDevice` replies over real sockets, for the asyncio device"""
+
+    def __init__(self, fake: FakeDevice):
+        self.fake = fake
+        self.transport = None
+        self.addr = None
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def start(self, monkeypatch):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=('127.0.0.1', 0))
+        self.server = await asyncio.start_server(self.on_connect, '127.0.0.1', 0)
+        monkeypatch.setattr(ethernet_device, 'udp_port', self.transport.get_extra_info('sockname')[1])
+        monkeypatch.setattr(ethernet_device, 'tcp_port', self.server.sockets[0].getsockname()[1])
+
+    def stop(self):
+        self.transport.close()
+        self.server.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def on_connect(self, reader, writer):
+        self.writer = writer
+        self.flush()
+
+    def datagram_received(self, data, addr):
+        self.addr = addr
+        self.fake.handle(data)
+        self.flush()
+
+    def flush(self):
+        while self.fake.udp.inbox:
+            self.transport.sendto(self.fake.udp.inbox.popleft(), self.addr)
+        if self.writer is not None and self.fake.tcp.stream:
+            self.writer.write(bytes(self.fake.tcp.stream))
+            self.fake.tcp.stream.clear()
+
+
+def run_served(monkeypatch, test, fake: FakeDevice | None = None):
+    fake = FakeDevice() if fake is None else fake
+
+    async def run():
+        server = FakeServer(fake)
+        await server.start(monkeypatch)
+        try:
+            await test(fake)
+        finally:
+            server.stop()
+
+    asyncio.run(run())
+
+
+def test_async_read_frame(monkeypatch):
+    async def test(fake):
+        device = await AsyncEthernetDevice.open('127.0.0.1')
+        assert device.getPixelCount() == NUM_PIXELS - len(measurement_header)
+        frame = await device.readFrame(3)
+        assert np.all(frame.samples == np.arange(3)[:, None])
+        assert not np.any(frame.clipped)
+        await device.readFrame(2)
+        assert fake.sent == [CMD_READ_INI, CMD_SET_LINE_LENGTH, CMD_READ_MULTILINE, CMD_READ_MULTILINE]
+        await device.close()
+        with pytest.raises(DeviceClosedError):
+            await device.readFrame(1)
+
+    run_served(monkeypatch, test)
+
+
+def test_async_retransmit_and_timeout(monkeypatch):
+    async def test(fake):
+        device = await AsyncEthernetDevice.open('127.0.0.1', timeout=0.05, retries=2)
+        fake.sent.clear()
+        fake.drop[CMD_SET_TIMER] = 2
+        await device.setTimer(10)
+        assert fake.sent == [CMD_SET_TIMER] * 3
+
+        fake.sent.clear()
+        fake.drop[CMD_SET_TIMER] = 10
+        with pytest.raises(DeviceTimeoutError):
+            await device.setTimer(20)
+        assert fake.sent == [CMD_SET_TIMER] * 3
+        assert CMD_SET_TIMER not in device.state
+        assert not device.pending
+        await device.close()
+
+    run_served(monkeypatch, test)
+
+
+def test_async_spectrometer(monkeypatch):
+    async def test(fake):
+        spectrometer = await AsyncSpectrometer.open(EthernetID('127.0.0.1'), FactoryConfig(0, 10, False, 1.0))
+        async with spectrometer:
+            await spectrometer.set_config(exposure=20, n_times=2)
+            assert fake.sent.count(CMD_SET_TIMER) == 2
+            assert spectrometer.config.exposure == 20
+
+            data = await spectrometer.read_raw(3)
+            assert data.shape == (3, 10)
+            assert np.all(data.intensity == np.arange(3)[:, None])
+
+            await spectrometer.read_dark_signal()
+            assert spectrometer.dark_signal.n_times == 2
+            spectrum = await spectrometer.read(force=True)
+            # frames 5 and 6 minus the rounded mean of dark frames 3 and 4
+            assert np.array_equal(spectrum.intensity[:, 0], [1, 2])
+
+            batches = []
+            async with contextlib.aclosing(spectrometer.stream(n_times=2)) as stream:
+                async for batch in stream:
+                    batches.append(batch)
+                    if len(batches) == 2:
+                        break
+            assert [batch.intensity[0, 0] for batch in batches] == [7, 9]
+            # the read started before the break is received in full and dropped
+            data = await spectrometer.read_raw(1)
+            assert data.intensity[0, 0] == fake.n_frames - 1 == 13
+
+        with pytest.raises(DeviceClosedError):
+            await spectrometer.read_raw()
+
+    run_served(monkeypatch, test)
+
+
+def test_async_set_config_loads_files_in_thread(monkeypatch, tmp_path):
+    import threading
+    from pyspectrum import Data
+    load = Data.load.__func__
+    threads = []
+
+    def recording_load(cls, *args, **kwargs):
+        threads.append(threading.current_thread())
+        return load(cls, *args, **kwargs)
+
+    async def test(fake):
+        spectrometer = await AsyncSpectrometer.open(EthernetID('127.0.0.1'), FactoryConfig(0, 10, False, 1.0))
+        async with spectrometer:
+            await spectrometer.set_config(n_times=2)
+            await spectrometer.read_dark_signal()
+            path = str(tmp_path / 'dark')
+            spectrometer.dark_signal.save(path)
+
+            monkeypatch.setattr(Data, 'load', classmethod(recording_load))
+            await spectrometer.set_config(exposure=20)
+            assert spectrometer.dark_signal is None
+            await spectrometer.set_config(exposure=10, dark_signal_path=path)
+            assert spectrometer.config.exposure == 10
+            assert spectrometer.dark_signal is not None
+            assert threads and threading.main_thread() not in threads
+
+    run_served(monkeypatch, test)
+
+
+def test_async_spectrometer_releases_device(monkeypatch):
+    from pyspectrum import device_factory
+    cache = getattr(device_factory, '__device_cache')
+
+    async def test(fake):
+        size = len(cache)
+        for _ in range(3):
+            spectrometer = await AsyncSpectrometer.open(EthernetID('127.0.0.1'), FactoryConfig(0, 10, False, 1.0))
+            await spectrometer.close()
+        assert len(cache) == size
+
+    run_served(monkeypatch, test)
+
+
+def test_async_auto_exposure(monkeypatch):
+    async def test(fake):
+        spectrometer = await AsyncSpectrometer.open(EthernetID('127.0.0.1'), FactoryConfig(0, 10, False, 1.0))
+        async with spectrometer:
+            fake.sent.clear()
+            # the fake signal is far below the target, so every step raises the exposure
+            result = await spectrometer.auto_exposure(target=0.5, max_reads=3)
+            assert result.n_reads == 3 and not result.converged
+            assert result.exposure == spectrometer.config.exposure == 10000
+            assert fake.sent.count(CMD_SET_TIMER) == 3
+            assert fake.sent.count(CMD_READ_MULTILINE) == 3
+
+            # the synchronous spectrometer only processes frames received by the async device
+            with pytest.raises(DeviceError):
+                spectrometer.spectrometer.read_raw(1)
+
+    run_served(monkeypatch, test)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from pyspectrum import Spectrum
+from pyspectrum.pyrometry import Pyrometer, C2
+
+wavelength = np.linspace(400, 1100, 1800)
+response = np.linspace(0.5, 1.5, wavelength.size)
+
+
+def black_body(temperature):
+    return 1e20 / wavelength ** 5 / (np.exp(C2 / (wavelength * temperature)) - 1) * response
+
+
+def make_spectrum(intensity):
+    intensity = np.atleast_2d(intensity)
+    return Spectrum(intensity, np.zeros(intensity.shape, dtype=bool), 10, wavelength)
+
+
+def test_temperature():
+    pyrometer = Pyrometer(make_spectrum(black_body(2800)), 2800, (500, 1000))
+    temperatures = [1800, 2200, 3000]
+    result = pyrometer.fit(make_spectrum([black_body(t) for t in temperatures]))
+    # Wien approximation is slightly off for the Planck spectrum far from the calibration temperature
+    assert np.allclose(result.temperature, temperatures, rtol=1e-2)
+    assert result.deviation.shape == (3,)
+
+
+def test_noise_deviation():
+    pyrometer = Pyrometer(make_spectrum(black_body(2800)), 2800)
+    rng = np.random.default_rng(0)
+    noisy = black_body(2000) * (1 + 0.05 * rng.standard_normal((2, wavelength.size)))
+    clean, noisy = pyrometer.fit(make_spectrum(black_body(2000))), pyrometer.fit(make_spectrum(noisy))
+    assert np.all(noisy.deviation > clean.deviation)
+    assert np.allclose(noisy.temperature, 2000, rtol=1e-2)
+
+    with pytest.raises(ValueError):
+        Pyrometer(make_spectrum(black_body(2800)), 2800, (500, 500.1))
@@ -1,10 +1,12 @@
+import asyncio
+import time
 from dataclasses import dataclass
 
 import numpy as np
 from numpy.typing import NDArray
 import json
 import pytest
-from pyspectrum import Spectrometer, Data, FactoryConfig, DeviceClosedError, Spectrum
+from pyspectrum import Spectrometer, Data, FactoryConfig, DeviceClosedError, Spectrum, AsyncSpectrometer, Capture, LoadError, Recorder, DarkLibrary, SpectrometerGroup
 from pyspectrum.device_factory import DeviceID
 
 
@@ -22,6 +24,9 @@ class MockInternalSpectrometer:
     def setTimer(self, _):
         pass
 
+    def getPixelCount(self):
+        return self.resolution
+
     def readFrame(self, n_times):
         samples = np.array([np.arange(0, self.resolution, 1) + i for i in range(n_times)])
         clipped = np.zeros((n_times, self.resolution))
@@ -197,3 +202,471 @@ def test_slices():
     assert np.array_equal(data[1:].wavelength, data.wavelength)
     assert np.array_equal(data[:,1:].wavelength, np.array([101, 102]))
 
+
+
+def test_stream(device: Spectrometer):
+    device.set_config(n_times=2)
+    with device.stream(buffer_size=4) as stream:
+        batches = [next(stream) for _ in range(3)]
+    assert all(b.shape == (2, 10) for b in batches)
+    assert stream.received >= 6
+    with pytest.raises(StopIteration):
+        next(stream)
+
+
+def test_stream_error(device: Spectrometer):
+    stream = device.stream()
+    device.close()
+    with pytest.raises(DeviceClosedError):
+        for _ in stream:
+            pass
+
+
+class MockTimedSpectrometer(MockInternalSpectrometer):
+    def __init__(self):
+        super().__init__()
+        self.exposure = 10
+
+    def setTimer(self, millis):
+        self.exposure = millis
+
+    def readFrame(self, n_times):
+        time.sleep(self.exposure / 1000 * n_times)
+        return super().readFrame(n_times)
+
+
+class MockTimedID(DeviceID):
+    def _create(self):
+        return MockTimedSpectrometer()
+
+
+def test_stream_exposure_change(tmp_path):
+    config_path = str(tmp_path / 'cfg.json')
+    create_factory_config(config_path, 0, 10, False)
+    device = Spectrometer(MockTimedID(), FactoryConfig.load(config_path))
+    device.set_config(exposure=20)
+    with device.stream() as stream:
+        next(stream)
+        device.set_config(exposure=100)
+        # batches read with the new exposure take five times longer, but are not late
+        while next(stream).exposure != 100:
+            pass
+        next(stream)
+    assert stream.late == 0
+
+
+def test_raw_counts(tmp_path):
+    config_path = str(tmp_path / 'cfg.json')
+    create_factory_config(config_path, 0, 10, False, intensity_scale=2.0)
+    device = Spectrometer(MockID(), FactoryConfig.load(config_path))
+    scaled = device.read_raw()
+
+    device.set_config(raw_counts=True)
+    raw = device.read_raw()
+    assert raw.intensity_scale == 2.0
+    assert raw.intensity.dtype == MockInternalSpectrometer().readFrame(1).samples.dtype
+    assert np.array_equal(raw.scaled().intensity, scaled.intensity)
+    assert np.array_equal((raw + 1).intensity, scaled.intensity + 1)
+    assert raw[:, 1:].intensity_scale == 2.0
+
+    device.read_dark_signal()
+    device.set_config(raw_counts=False)
+    assert np.array_equal(device.read(force=True).intensity, np.zeros((1, 10)))
+
+
+@pytest.mark.parametrize("raw_counts", [True, False])
+def test_ring(tmp_path, raw_counts):
+    device = create_device(tmp_path, 10, 20, True)
+    device.set_config(n_times=2, raw_counts=raw_counts)
+    expected = device.read_raw()
+    ring = device.create_ring(2)
+    first = device.read_raw(out=ring)
+    second = device.read_raw(out=ring)
+    assert first is not second
+    assert np.array_equal(first.intensity, expected.intensity)
+    assert first.intensity_scale == expected.intensity_scale
+    assert device.read_raw(out=ring) is first
+    assert ring.last is first
+
+
+class MockFailingSpectrometer(MockInternalSpectrometer):
+    fail = False
+
+    def readFrame(self, n_times):
+        if self.fail:
+            raise TimeoutError()
+        return super().readFrame(n_times)
+
+
+@dataclass(unsafe_hash=True)
+class MockFailingID(DeviceID):
+    def _create(self):
+        return MockFailingSpectrometer()
+
+
+def test_ring_failed_read(tmp_path):
+    config_path = str(tmp_path / 'cfg.json')
+    create_factory_config(config_path, 0, 10, False)
+    device = Spectrometer(MockFailingID(), FactoryConfig.load(config_path))
+    ring = device.create_ring(2)
+    first = device.read_raw(out=ring)
+    expected = first.intensity.copy()
+    next_slot = ring.peek_slot()
+
+    MockFailingSpectrometer.fail = True
+    try:
+        with pytest.raises(TimeoutError):
+            device.read_raw(out=ring)
+    finally:
+        MockFailingSpectrometer.fail = False
+    assert ring.last is first
+    assert np.array_equal(first.intensity, expected)
+    assert ring.peek_slot() is next_slot
+
+    second = device.read_raw(out=ring)
+    assert second is next_slot.data
+    assert ring.last is second
+
+
+def test_async(tmp_path):
+    async def run():
+        config_path = str(tmp_path / 'cfg.json')
+        create_factory_config(config_path, 0, 10, False)
+        async with await AsyncSpectrometer.open(MockID(), FactoryConfig.load(config_path)) as device:
+            await device.set_config(n_times=2, exposure=5)
+            data = await device.read_raw()
+            assert data.shape == (2, 10) and data.exposure == 5
+            await device.read_dark_signal()
+            assert (await device.read(force=True)).shape == (2, 10)
+
+            batches = []
+            async for batch in device.stream(n_times=3):
+                batches.append(batch)
+                if len(batches) == 3:
+                    break
+            assert all(b.shape == (3, 10) for b in batches)
+
+    asyncio.run(run())
+
+
+class MockSlowSpectrometer(MockInternalSpectrometer):
+    delay = 0.2
+
+    def readFrame(self, n_times):
+        time.sleep(self.delay)
+        return super().readFrame(n_times)
+
+
+class MockSlowID(DeviceID):
+    def _create(self):
+        return MockSlowSpectrometer()
+
+
+def test_group(tmp_path):
+    config_path = str(tmp_path / 'cfg.json')
+    create_factory_config(config_path, 0, 10, False)
+    with SpectrometerGroup.open([MockSlowID() for _ in range(4)], FactoryConfig.load(config_path)) as group:
+        assert len(group) == 4
+        group.set_config(n_times=2, exposure=5)
+        assert all(device.config.exposure == 5 for device in group.spectrometers)
+
+        reading = group.read_raw()
+        assert [data.shape for data in reading] == [(2, 10)] * 4
+        # reads run concurrently, not one after another
+        assert reading.duration < 2 * MockSlowSpectrometer.delay
+        assert 0 <= reading.skew < MockSlowSpectrometer.delay
+        assert all(len(t) == 2 and t[1] - t[0] == pytest.approx(0.005, abs=1e-6) for t in reading.timestamps())
+
+        group.read_dark_signal()
+        assert all(isinstance(data, Spectrum) for data in group.read(force=True))
+        with pytest.raises(FileNotFoundError):
+            group.set_config(wavelength_calibration_path=str(tmp_path / 'missing.json'))
+    with pytest.raises(DeviceClosedError):
+        group[0].read_raw()
+
+
+def test_iter_raw(device: Spectrometer):
+    chunks = list(device.iter_raw(3))
+    assert len(chunks) == 1
+    assert np.array_equal(chunks[0].intensity, device.read_raw(3).intensity)
+
+
+def test_save_load(tmp_path, device: Spectrometer):
+    path = str(tmp_path / 'data')
+    data = device.read_raw(20)
+    data.clipped = data.clipped.astype(bool)
+    data.clipped[3, 5] = True
+    data.save(path, FactoryConfig.default())
+
+    loaded = Data.load(path)
+    assert type(loaded.intensity) is np.ndarray and type(loaded.clipped) is np.ndarray
+    assert loaded.exposure == data.exposure
+    assert np.array_equal(loaded.intensity, data.intensity)
+    assert np.array_equal(loaded.clipped, data.clipped)
+    assert np.array_equal(loaded[2:4, 1:7].clipped, data.clipped[2:4, 1:7])
+    assert loaded.clipped.any() and loaded.clipped.sum() == 1
+    loaded.intensity -= 1
+    loaded.clipped[3, 5] = False
+    assert np.array_equal(loaded.intensity, data.intensity - 1)
+    assert not loaded.clipped.any()
+
+    capture = Capture(path)
+    assert capture.factory_config == FactoryConfig.default()
+    assert np.array_equal(capture.intensity, data.intensity)
+    assert np.array_equal(capture.clipped[3], data.clipped[3])
+    assert np.array_equal(capture.clipped[2:4, 1:7], data.clipped[2:4, 1:7])
+    assert np.array_equal(Data.load(path).intensity, data.intensity)
+    with pytest.raises(LoadError):
+        Spectrum.load(path)
+
+    spectrum = Spectrum(data.intensity, data.clipped, data.exposure, np.arange(data.n_numbers))
+    spectrum.save(path)
+    loaded = Spectrum.load(path)
+    assert np.array_equal(loaded.wavelength, spectrum.wavelength)
+    assert np.array_equal((loaded - data).intensity, np.zeros(data.shape))
+
+
+def test_load_pickle(tmp_path, device: Spectrometer):
+    import pickle
+    path = str(tmp_path / 'data')
+    data = device.read_raw(2)
+    with open(path, 'wb') as f:
+        pickle.dump(data, f)
+
+    with pytest.raises(LoadError, match='allow_pickle=True'):
+        Data.load(path)
+    assert np.array_equal(Data.load(path, allow_pickle=True).intensity, data.intensity)
+
+
+def test_recorder(tmp_path, device: Spectrometer):
+    path = str(tmp_path / 'recording')
+    with Recorder(device, path, flush_interval=0) as recorder:
+        first = recorder.read_raw(3)
+        device.set_config(exposure=20)
+        recorder.read_raw(2)
+        with pytest.raises(ValueError):
+            recorder.write(first[:, 1:])
+    assert recorder.n_frames == 5
+
+    capture = Capture(path)
+    assert capture.n_frames == 5
+    assert capture.factory_config == device.factory_config
+    assert np.array_equal(capture.exposures, [10, 10, 10, 20, 20])
+    assert not np.any(np.isnan(capture.timestamps))
+    assert np.array_equal(capture.intensity[:3], first.intensity)
+
+
+def test_recorder_incompatible(tmp_path, device: Spectrometer):
+    data = device.read_raw(2)
+    spectrum = Spectrum(data.intensity, data.clipped, data.exposure, np.arange(data.n_numbers))
+    with Recorder(device, str(tmp_path / 'recording')) as recorder:
+        recorder.write(spectrum)
+        with pytest.raises(ValueError):
+            recorder.write(data)
+        with pytest.raises(ValueError):
+            recorder.write(Spectrum(data.intensity, data.clipped, data.exposure, np.arange(data.n_numbers) + 1))
+        with pytest.raises(ValueError):
+            recorder.write(Spectrum(data.intensity, data.clipped, data.exposure, np.arange(data.n_numbers),
+                                    intensity_scale=2.0))
+        recorder.write(spectrum)
+    assert Capture(str(tmp_path / 'recording')).n_frames == 4
+
+
+def test_recorder_error(tmp_path, device: Spectrometer):
+    # the file can not be created, so the writer thread fails on the first batch
+    recorder = Recorder(device, str(tmp_path))
+    data = device.read_raw(2)
+    recorder.write(data)
+    deadline = time.monotonic() + 5
+    with pytest.raises(OSError):
+        while time.monotonic() < deadline:
+            recorder.write(data)
+            time.sleep(0.01)
+    # the failure is reported by every later call, not only by the first one
+    with pytest.raises(OSError):
+        recorder.write(data)
+    with pytest.raises(OSError):
+        recorder.close()
+    recorder.close()
+
+
+def test_recorder_flush(tmp_path, device: Spectrometer, monkeypatch):
+    from pyspectrum import storage
+    fsync = storage.os.fsync
+    calls = []
+    monkeypatch.setattr(storage.os, 'fsync', lambda fd: (calls.append(fd), fsync(fd)))
+
+    with Recorder(device, str(tmp_path / 'recording'), flush_interval=0) as recorder:
+        recorder.read_raw(2)
+        time.sleep(0.1)
+        n_calls = len(calls)
+        assert n_calls > 0
+        # an idle recorder does not flush again
+        time.sleep(0.1)
+        assert len(calls) == n_calls
+    # nothing was written since the last flush, so closing does not sync the file
+    assert len(calls) == n_calls
+
+
+@pytest.mark.parametrize('module', ['h5py', 'zarr'])
+def test_archive(tmp_path, device: Spectrometer, module):
+    pytest.importorskip(module)
+    from pyspectrum import archive
+    save, load = (archive.save_hdf5, archive.load_hdf5) if module == 'h5py' else (archive.save_zarr, archive.load_zarr)
+
+    path = str(tmp_path / 'archive')
+    data = device.read_raw(20)
+    spectrum = Spectrum(data.intensity, data.clipped.astype(bool), data.exposure, np.arange(data.n_numbers))
+    save(spectrum, path, chunk_frames=8, chunk_pixels=4)
+
+    def check(loaded):
+        assert isinstance(loaded, Spectrum)
+        assert loaded.shape == spectrum.shape
+        part = loaded[5:10, 2:6]
+        assert np.array_equal(part.intensity, spectrum.intensity[5:10, 2:6])
+        assert np.array_equal(part.wavelength, spectrum.wavelength[2:6])
+
+    if module == 'zarr':
+        check(load(path))
+        return
+
+    with load(path) as opened:
+        check(opened.data)
+    # the file is closed, so it can be written again
+    save(spectrum[:10], path)
+    with load(path) as opened:
+        assert opened.data.n_times == 10
+
+
+def test_lazy(tmp_path, device: Spectrometer):
+    path = str(tmp_path / 'data')
+    data = device.read_raw(50)
+    data.clipped = data.clipped.astype(bool)
+    data.clipped[7, 3] = True
+    data.save(path)
+    dark = data[:10]
+
+    lazy = (Capture(path).lazy() - np.mean(dark.intensity, axis=0)) * 2
+    expected = (data - np.mean(dark.intensity, axis=0)) * 2
+    assert lazy.shape == data.shape
+    assert np.array_equal(lazy.compute().intensity, expected.intensity)
+    assert np.array_equal(lazy[5:20, 2:8].compute().intensity, expected.intensity[5:20, 2:8])
+    assert np.array_equal(lazy[::-1].compute().clipped, data.clipped[::-1])
+    assert np.allclose(lazy.mean(chunk_frames=7), expected.intensity.mean(axis=0))
+    assert np.array_equal(lazy.max(chunk_frames=7), expected.intensity.max(axis=0))
+
+    lazy.save(str(tmp_path / 'processed'), chunk_frames=16)
+    assert np.array_equal(Data.load(str(tmp_path / 'processed')).intensity, expected.intensity)
+
+    row = np.mean(dark.intensity, axis=0, keepdims=True)
+    broadcast = Data.load(path).lazy() - row
+    assert broadcast.shape == data.shape
+    assert np.array_equal(broadcast.compute().intensity, data.intensity - row)
+    assert np.array_equal(broadcast[5:20, 2:8].compute().intensity, (data.intensity - row)[5:20, 2:8])
+
+
+def test_dark_reference_cached(device: Spectrometer):
+    device.read_dark_signal(5)
+    first = device.read(force=True)
+    # the averaged dark signal is computed once per dark signal
+    device.dark_signal.intensity[:] = 0
+    assert np.array_equal(device.read(force=True).intensity, first.intensity)
+    device.read_dark_signal(5)
+    assert np.array_equal(device.read(force=True).intensity, first.intensity)
+    device.set_config(exposure=20)
+    with pytest.raises(Exception):
+        device.read(force=True)
+
+
+def test_dark_library(tmp_path, device: Spectrometer):
+    library = DarkLibrary()
+    for exposure, level in [(10, 100), (30, 300)]:
+        library.add_reference(exposure, np.full(4, level))
+    assert np.array_equal(library.reference(20), np.full(4, 200))
+    assert np.array_equal(library.reference(50), np.full(4, 300))
+    library.interpolate = False
+    assert np.array_equal(library.reference(15), np.full(4, 100))
+
+    path = str(tmp_path / 'library')
+    device.set_config(dark_library_path=path)
+    with pytest.raises(Exception):
+        device.read(force=True)
+    device.read_dark_signal(5)
+    device.set_config(exposure=30)
+    device.read_dark_signal(5)
+    device.save_dark_library()
+
+    d2 = create_device(tmp_path)
+    d2.set_config(dark_library_path=path, exposure=20)
+    assert d2.dark_library.exposures == [10, 30]
+    # swapping exposures does not require new dark signal
+    d2.read(force=True)
+    d2.set_config(exposure=10)
+    device.set_config(exposure=10)
+    assert np.array_equal(d2.read(force=True).intensity, device.read(force=True).intensity)
+
+
+def test_dark_signal_other_exposure(tmp_path, device: Spectrometer):
+    other = create_device(tmp_path)
+    other.set_config(exposure=20)
+    dark_path = str(tmp_path / 'dark')
+    other.read_raw(5).save(dark_path)
+
+    device.read_dark_signal(5)
+    dark_signal = device.dark_signal
+    device.set_config(dark_library_path=str(tmp_path / 'library'), dark_signal_path=dark_path)
+    # the library has nothing for the current exposure, so the read dark signal stays in use
+    assert device.dark_signal is dark_signal
+    assert device.dark_library.exposures == [20]
+
+    # a dark signal just read is kept when the file is loaded again, even though the library now has it too
+    device.read_dark_signal(5)
+    dark_signal = device.dark_signal
+    device.set_config(dark_signal_path=str(tmp_path / 'missing'))
+    device.set_config(dark_signal_path=dark_path)
+    assert device.dark_signal is dark_signal
+    assert device.dark_library.exposures == [10, 20]
+    device.read(force=True)
+    device.set_config(dark_signal_path=str(tmp_path / 'saved'))
+    device.save_dark_signal()
+
+
+class MockLightSpectrometer(MockInternalSpectrometer):
+    """Signal grows linearly with exposure and saturates at the ADC limit"""
+
+    def __init__(self):
+        super().__init__()
+        self.exposure = 10
+
+    def setTimer(self, exposure):
+        self.exposure = exposure
+
+    def getMinExposure(self):
+        return 2
+
+    def readFrame(self, n_times):
+        samples = 1000 + np.tile(np.arange(self.resolution) * self.exposure / 10, (n_times, 1))
+        clipped = samples >= 65535
+        return MockInternalRawSpectrum(clipped, np.minimum(samples, 65535))
+
+
+class MockLightID(DeviceID):
+    def _create(self):
+        return MockLightSpectrometer()
+
+
+def test_auto_exposure():
+    from pyspectrum.exposure import quantize_exposure
+    assert [quantize_exposure(e) for e in [5, 102, 1023, 1029, 12345]] == [5, 102, 1023, 1020, 12300]
+
+    device = Spectrometer(MockLightID())
+    result = device.auto_exposure(target=0.5, max_reads=20)
+    assert result.converged
+    assert device.config.exposure == result.exposure
+    assert abs(result.level - 0.5) <= 0.05
+
+    device.set_config(exposure=10)
+    result = device.auto_exposure(target=0.5, max_exposure=50)
+    assert not result.converged
+    assert result.exposure == 50
+    assert device.min_exposure == 2